@@ -1,7 +1,9 @@
 from fastapi import APIRouter
 from app.api.v1.endpoints import users
 from app.api.v1.endpoints import documents
+from app.api.v1.endpoints import chat
 
 api_router = APIRouter()
 api_router.include_router(users.router, prefix="/users", tags=["users"])
-api_router.include_router(documents.router, prefix="/documents", tags=["documents"])
\ No newline at end of file
+api_router.include_router(documents.router, prefix="/documents", tags=["documents"])
+api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
\ No newline at end of file
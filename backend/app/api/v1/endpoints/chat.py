@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.db.session import get_db
+from app.db.session import SessionLocal, get_db
 from app.services.chat import ChatService
 from app.schemas.chat import (
     ChatMessageCreate, 
@@ -11,6 +12,7 @@ from app.api.dependencies.auth import get_current_user
 from typing import List, Optional
 from uuid import UUID
 from app.models.user import User
+import json
 
 router = APIRouter()
 
@@ -70,6 +72,40 @@ async def send_message(
         sources=sources
     )
 
+@router.post("/sessions/{session_id}/messages/stream")
+async def stream_message(
+    session_id: UUID,
+    message: ChatMessageCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Send a message and stream the AI response as Server-Sent Events.
+
+    Emits a `sources` event, then `token` events as the answer is generated,
+    and a final `message` event with the stored assistant message (or an
+    `error` event).
+    """
+    session = await ChatService(db).get_session(session_id, current_user.id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    async def event_stream():
+        # get_db closes its session once the endpoint returns, before the
+        # body is streamed, so the stream opens and closes its own
+        stream_db = SessionLocal()
+        try:
+            chat_service = ChatService(stream_db)
+            async for event in chat_service.stream_message(session, message.content):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageResponse])
 async def get_messages(
     session_id: UUID,
@@ -4,8 +4,9 @@ from fastapi import (
     HTTPException, 
     UploadFile, 
     File, 
-    BackgroundTasks, 
     Form,
+    Query,
+    Request,
     status
 )
 from sqlalchemy.orm import Session
@@ -20,47 +21,26 @@ from datetime import datetime
 from typing import List
 from app.schemas.query import QueryCreate, QueryResponse
 from app.services.rag import RAGService
-from app.services.document_processor import DocumentProcessor
+from app.services.ingestion_queue import IngestionQueue
+from app.core.config import settings
 
 router = APIRouter()
 
-@router.post("/", response_model=DocumentResponse)
-async def upload_document(
-    file: UploadFile = File(...),
-    title: str = Form(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Upload a new document"""
-    try:
-        document_service = DocumentService(db)
-        document = await document_service.create_document(
-            user_id=current_user.id,
-            title=title,
-            file=file
-        )
-        
-        # Make sure we return a valid DocumentResponse
-        return DocumentResponse(
-            id=document.id,
-            title=document.title,
-            created_at=document.created_at,
-            status=document.status,
-            file_url=document.file_url
-        )
-        
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=str(e)
-        )
+ALLOWED_CONTENT_TYPES = [
+    "application/pdf",
+    "application/vnd.ms-powerpoint",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "text/csv"
+]
 
 @router.post(
     "/",
     response_model=DocumentResponse,
     status_code=status.HTTP_201_CREATED,
     summary="Upload Document",
-    description="Upload a new document and trigger processing",
+    description="Upload a new document and queue it for processing",
     response_description="The created document"
 )
 async def upload_document(
@@ -74,7 +54,10 @@ async def upload_document(
         description="Title of the document",
         example="My Important Document"
     ),
-    background_tasks: BackgroundTasks,
+    priority: int = Form(
+        0,
+        description="Ingestion priority; higher values are processed first"
+    ),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -84,23 +67,14 @@ async def upload_document(
     - Validate file size and type
     - Create document record
     - Store file in S3
-    - Trigger background processing
+    - Queue it for the ingestion workers
     """
-    # Validate file size (example: 10MB limit)
-    if file.size > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large")
+    # Validate file size up front when known; the upload enforces it regardless
+    if file.size and file.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
         
     # Validate file type
-    allowed_types = [
-        "application/pdf",
-        "application/vnd.ms-powerpoint",
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-        "application/vnd.ms-excel",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        "text/csv"
-    ]
-    
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail="File type not supported")
     
     document_service = DocumentService(db)
@@ -108,19 +82,112 @@ async def upload_document(
         # Create document record
         document = await document_service.create_document(
             user_id=current_user.id,
-            file=file,
-            document=DocumentCreate(title=title)
+            title=title,
+            file=file
         )
         
-        # Trigger background processing
-        document_processor = DocumentProcessor(db)
-        background_tasks.add_task(
-            document_processor.process_document,
-            document.id
-        )
+        # Queue processing; it survives API restarts and runs in `python -m app.worker`
+        await IngestionQueue(db).enqueue(document.id, priority=priority)
         
         return document
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post(
+    "/stream",
+    response_model=DocumentResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Upload Document Stream",
+    description="Upload a document sent as the raw request body, streamed straight to storage",
+    response_description="The created document"
+)
+async def upload_document_stream(
+    request: Request,
+    title: str = Query(..., description="Title of the document"),
+    filename: str = Query(..., description="Original file name, used for its extension"),
+    priority: int = Query(0, description="Ingestion priority; higher values are processed first"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a large document without multipart form encoding. The body is
+    read in parts as it arrives, so the file is never spooled to disk or
+    held in memory whole. The Content-Type header gives the file type.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="File type not supported")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    document_service = DocumentService(db)
+    try:
+        document = await document_service.create_document_from_stream(
+            user_id=current_user.id,
+            title=title,
+            filename=filename,
+            content_type=content_type,
+            stream=request.stream()
+        )
+        await IngestionQueue(db).enqueue(document.id, priority=priority)
+        return document
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put(
+    "/{document_id}",
+    response_model=DocumentResponse,
+    summary="Update Document",
+    description="Upload a new version of a document and queue it for incremental processing",
+    response_description="The updated document"
+)
+async def update_document(
+    document_id: UUID,
+    file: UploadFile = File(
+        ...,
+        description="The new version of the document file"
+    ),
+    priority: int = Form(
+        0,
+        description="Ingestion priority; higher values are processed first"
+    ),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Replace a document's file. Only chunks whose content changed since the
+    previous version are re-embedded; an identical file is a no-op.
+    """
+    if file.size and file.size > settings.MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="File too large")
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="File type not supported")
+
+    document_service = DocumentService(db)
+    try:
+        document, previous_chunk_set = await document_service.update_document(
+            document_id=document_id,
+            user_id=current_user.id,
+            file=file
+        )
+        if previous_chunk_set is not None:
+            await IngestionQueue(db).enqueue(
+                document.id,
+                priority=priority,
+                previous_chunk_set=previous_chunk_set
+            )
+        return document
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -199,10 +266,10 @@ async def query_document(
     
     try:
         # Process document
-        vectorstore = await rag_service.process_document(document.file_url)
+        vectorstore = await rag_service.process_document(document.file_url, document.id)
         
         # Get answer
-        result = await rag_service.query_document(vectorstore, query.question)
+        result = await rag_service.query_document(vectorstore, query.question, document.id)
         
         return QueryResponse(
             document_id=document.id,
@@ -14,12 +14,60 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "document_enquery"
     POSTGRES_PORT: str = "5432"
     SQLALCHEMY_DATABASE_URI: Optional[str] = None
+
+    # Worker pools for blocking work
+    IO_POOL_SIZE: int = 16  # boto3 and other network calls
+    DB_POOL_SIZE: int = 8  # threads running synchronous DB sessions
+    CPU_POOL_SIZE: int = 0  # processes for document parsing; 0 means one per CPU
+    
+    # Ingestion queue and workers
+    INGESTION_WORKER_CONCURRENCY: int = 2  # documents processed at once per worker process
+    INGESTION_MAX_ATTEMPTS: int = 3
+    INGESTION_RETRY_BASE_DELAY: int = 30  # seconds, doubled on each retry
+    INGESTION_POLL_INTERVAL: float = 2.0  # seconds between polls of an empty queue
+    INGESTION_JOB_TIMEOUT: int = 1800  # seconds before a running job is presumed dead
+    INGESTION_PAGE_WINDOW: int = 10  # PDF pages partitioned at a time
+    INGESTION_PIPELINE_DEPTH: int = 2  # windows/batches buffered between pipeline stages
+    PDF_PARSE_WORKERS: int = 0  # page ranges of one PDF partitioned at once; 0 means CPU_POOL_SIZE
+    PDF_PARALLEL_MIN_PAGES: int = 20  # shorter PDFs are partitioned by a single process
+    PDF_TEXT_LAYER_MIN_CHARS: int = 20  # pages with less extractable text are OCR'd
+    CHUNK_MAX_TOKENS: int = 300  # approximate model tokens per chunk
+    CHUNK_OVERLAP_TOKENS: int = 40  # text shared by consecutive chunks of a section
+    TABLE_INGESTION_ENABLED: bool = True  # store spreadsheets/CSV as Parquet tables, embedding summaries only
+    TABLE_ROW_GROUP_SIZE: int = 500  # rows per Parquet row group and per embedded summary
+    TABLE_QUERY_ENABLED: bool = True  # answer aggregate questions by querying stored tables
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379"
     
     # Google
     GOOGLE_API_KEY: str = ""
+
+    # LLM
+    LLM_PROVIDER: str = "google"  # "google" or "fake" (offline stand-in)
+    LLM_MODEL: str = "gemini-pro"
+
+    # Embeddings
+    EMBEDDING_PROVIDER: str = "google"  # "google" or "local" (offline hashing stand-in)
+    EMBEDDING_MODEL: str = "models/embedding-001"
+    EMBEDDING_DIMENSION: int = 768
+    EMBEDDING_BATCH_SIZE: int = 100
+    CHUNK_INSERT_METHOD: str = "executemany"  # or "copy" (binary COPY, PostgreSQL only; see tests/test_bulk_insert.py)
+    CHUNK_INSERT_BATCH_SIZE: int = 1000
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 5
+    EMBEDDING_RETRY_BASE_DELAY: float = 1.0
+    EMBEDDING_BATCH_WAIT_MS: int = 20
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "data/cache/embeddings.sqlite3"
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 10000
+    EMBEDDING_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # Answer cache
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_DISTANCE: float = 0.05  # cosine distance for reusing a paraphrase's answer
+    ANSWER_CACHE_MAX_ENTRIES: int = 2000
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
     
     # JWT
     SECRET_KEY: str = "your-secret-key-here"
@@ -31,6 +79,65 @@ class Settings(BaseSettings):
     AWS_SECRET_ACCESS_KEY: str
     AWS_REGION: str = "us-east-1"
     S3_BUCKET_NAME: str
+    S3_MULTIPART_PART_SIZE: int = 8 * 1024 * 1024  # S3 requires at least 5MB per part
+    S3_MULTIPART_CONCURRENCY: int = 4  # parts uploaded (and buffered) at once per upload
+
+    # Uploads
+    MAX_UPLOAD_SIZE: int = 200 * 1024 * 1024
+
+    # Local vector indexes
+    VECTOR_INDEX_DIR: str = "data/indexes"
+    VECTOR_SEARCH_BACKEND: str = "local"  # "local" (mmap store with pgvector fallback), "faiss" or "pgvector"
+    VECTOR_INDEX_CACHE_DOCUMENTS: int = 256  # local indexes kept open per process
+
+    # Hybrid (full-text + vector) retrieval
+    HYBRID_SEARCH_ENABLED: bool = True
+    # PostgreSQL text search configuration. migrations/add_chunk_full_text_search.sql
+    # hardcodes 'english' for existing databases; when changing this, rebuild
+    # content_tsv with the new configuration too
+    SEARCH_TEXT_CONFIG: str = "english"
+    SEARCH_LEXICAL_POOL: int = 200  # full-text matches rescored with BM25
+    SEARCH_CANDIDATES: int = 20  # results taken from each retriever before fusion
+    SEARCH_RRF_K: int = 60  # reciprocal rank fusion constant
+    SEARCH_VECTOR_THRESHOLD: float = 0.5  # minimum cosine similarity of vector candidates
+    RAG_RETRIEVAL_MODE: str = "hybrid"  # on-the-fly RAGService: "vector", "lexical" (BM25, no embedding call) or "hybrid"
+
+    # Prompt context assembly
+    CONTEXT_MAX_TOKENS: int = 2000  # token budget for retrieved chunks in a prompt
+    CONTEXT_CANDIDATES: int = 12  # retrieved chunks considered for the context
+    CONTEXT_MMR_LAMBDA: float = 0.7  # relevance vs. diversity trade-off (1.0 = relevance only)
+    CONTEXT_DUPLICATE_THRESHOLD: float = 0.9  # similarity above which a lower ranked chunk is dropped
+
+    # Reranking of retrieved chunks (lets retrieval use a cheaper ANN configuration)
+    RERANK_ENABLED: bool = True
+    RERANK_CANDIDATES: int = 50  # chunks retrieved for the reranker to choose from
+    RERANK_PRIOR_WEIGHT: float = 0.3  # weight of the retriever's own ranking in the final order
+
+    # Chat conversation memory
+    MEMORY_ENABLED: bool = True
+    MEMORY_WINDOW_MESSAGES: int = 6  # recent messages kept verbatim; older ones are summarized
+    MEMORY_MAX_TOKENS: int = 800  # cap on summary plus recent messages in a prompt
+    MEMORY_SUMMARY_MAX_WORDS: int = 150
+    MEMORY_FOLD_MIN_MESSAGES: int = 4  # messages past the window folded into the summary in one call
+    MEMORY_REWRITE_ENABLED: bool = True  # rewrite follow-ups into standalone retrieval queries
+
+    # pgvector index on document_chunks.embedding
+    PGVECTOR_INDEX_TYPE: str = "hnsw"  # "hnsw", "ivfflat" or "none"
+    PGVECTOR_HNSW_M: int = 16
+    PGVECTOR_HNSW_EF_CONSTRUCTION: int = 64
+    PGVECTOR_HNSW_EF_SEARCH: int = 40  # candidates per query; raised to the query's limit when lower
+    PGVECTOR_IVFFLAT_LISTS: int = 100  # roughly rows / 1000
+    PGVECTOR_IVFFLAT_PROBES: int = 10
+    PGVECTOR_EXACT_SEARCH_MAX_ROWS: int = 5000  # searches over at most this many chunks skip the index; 0 = never
+
+    # FAISS
+    FAISS_INDEX_TYPE: str = "hnsw"  # "flat", "ivf" or "hnsw"
+    FAISS_SHARD_BY: str = "user"  # "user" or "document"
+    FAISS_IVF_NLIST: int = 1024
+    FAISS_IVF_NPROBE: int = 16
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 80
+    FAISS_HNSW_EF_SEARCH: int = 64
 
     class Config:
         env_file = ".env"
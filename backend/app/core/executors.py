@@ -0,0 +1,123 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+from app.core.config import settings
+import asyncio
+import threading
+import os
+
+class InstrumentedExecutor:
+    """Runs blocking work from async code on a dedicated pool and tracks its load.
+
+    Pools are created on first use so importing this module never forks or
+    spawns threads, e.g. inside process-pool children.
+    """
+
+    def __init__(self, name: str, factory: Callable[[int], Executor], max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._factory(self.max_workers)
+            return self._executor
+
+    def _track(self, func: Callable, *args, **kwargs) -> Any:
+        # Runs on the worker thread: the job has left the queue
+        with self._lock:
+            self._active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func(*args, **kwargs) on the pool and await its result"""
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._submitted += 1
+        if isinstance(executor, ProcessPoolExecutor):
+            # Child processes cannot update our counters, so count on this side
+            with self._lock:
+                self._active += 1
+            job = partial(func, *args, **kwargs)
+        else:
+            job = partial(self._track, func, *args, **kwargs)
+        try:
+            result = await loop.run_in_executor(executor, job)
+            with self._lock:
+                self._completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            if isinstance(executor, ProcessPoolExecutor):
+                with self._lock:
+                    self._active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = self._submitted - self._completed - self._failed
+            return {
+                "max_workers": self.max_workers,
+                "active": min(self._active, self.max_workers),
+                "queued": max(0, in_flight - min(self._active, self.max_workers)),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+# boto3 and other network clients
+io_executor = InstrumentedExecutor(
+    "io",
+    lambda workers: ThreadPoolExecutor(max_workers=workers, thread_name_prefix="io"),
+    settings.IO_POOL_SIZE
+)
+
+# Synchronous SQLAlchemy sessions
+db_executor = InstrumentedExecutor(
+    "db",
+    lambda workers: ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db"),
+    settings.DB_POOL_SIZE
+)
+
+# CPU-heavy work such as document parsing; functions and arguments must pickle
+cpu_executor = InstrumentedExecutor(
+    "cpu",
+    lambda workers: ProcessPoolExecutor(max_workers=workers),
+    settings.CPU_POOL_SIZE or os.cpu_count() or 1
+)
+
+async def run_io(func: Callable, *args, **kwargs) -> Any:
+    return await io_executor.run(func, *args, **kwargs)
+
+async def run_db(func: Callable, *args, **kwargs) -> Any:
+    return await db_executor.run(func, *args, **kwargs)
+
+async def run_cpu(func: Callable, *args, **kwargs) -> Any:
+    return await cpu_executor.run(func, *args, **kwargs)
+
+def get_executor_stats() -> Dict[str, Dict[str, int]]:
+    return {executor.name: executor.stats() for executor in (io_executor, db_executor, cpu_executor)}
+
+def shutdown_executors() -> None:
+    for executor in (io_executor, db_executor, cpu_executor):
+        executor.shutdown()
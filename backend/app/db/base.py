@@ -1,2 +1,7 @@
 from app.db.base_class import Base  # noqa
-from app.models.user import User  # noqa
\ No newline at end of file
+from app.models.user import User  # noqa
+from app.models.document import Document, DocumentChunk  # noqa
+from app.models.chat import ChatSession, ChatMessage  # noqa
+from app.models.ingestion_job import IngestionJob  # noqa
+from app.models.content_blob import ContentBlob  # noqa
+from app.models.document_table import DocumentTable  # noqa
@@ -0,0 +1,141 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_INDEX_NAME = "ix_document_chunks_embedding"
+
+# hnsw.ef_search and ivfflat.probes cannot go higher
+MAX_EF_SEARCH = 1000
+
+# pgvector version of the database, read once per process
+_extension_version: Optional[Tuple[int, ...]] = None
+_version_lock = threading.Lock()
+
+def _index_options() -> Optional[Dict[str, int]]:
+    """Build options of the configured embedding index, or None for no index"""
+    if settings.PGVECTOR_INDEX_TYPE == "hnsw":
+        return {"m": settings.PGVECTOR_HNSW_M, "ef_construction": settings.PGVECTOR_HNSW_EF_CONSTRUCTION}
+    if settings.PGVECTOR_INDEX_TYPE == "ivfflat":
+        return {"lists": settings.PGVECTOR_IVFFLAT_LISTS}
+    return None
+
+def create_vector_extension(engine: Engine) -> None:
+    """Enable pgvector; must run before the tables are created"""
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+def ensure_vector_index(engine: Engine) -> None:
+    """Create, or rebuild after a settings change, the cosine index on chunk embeddings.
+
+    The index is built CONCURRENTLY so ingestion keeps writing chunks while
+    it builds. A build can take minutes on a large table, so it is run as a
+    one-off command (app/scripts/ensure_vector_index.py), not on startup.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    options = _index_options()
+    method = settings.PGVECTOR_INDEX_TYPE
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        column_type = connection.execute(text("""
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = 'document_chunks'::regclass AND attname = 'embedding'
+        """)).scalar()
+        expected_type = f"vector({settings.EMBEDDING_DIMENSION})"
+        if column_type != expected_type:
+            logger.error(
+                f"document_chunks.embedding is {column_type}, expected {expected_type}; "
+                f"run migrations/create_vector_extension.sql"
+            )
+            return
+
+        index = connection.execute(
+            text("""
+                SELECT pg_get_indexdef(i.indexrelid) AS definition, i.indisvalid AS valid
+                FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = :name
+            """),
+            {"name": EMBEDDING_INDEX_NAME}
+        ).first()
+        if index is not None:
+            definition = index.definition
+            if not index.valid:
+                # Left by a CONCURRENTLY build that failed; it is never used for queries
+                logger.warning(f"Rebuilding invalid embedding index: {definition}")
+            elif options is not None and f"USING {method} " in definition \
+                    and all(f"{key}='{value}'" in definition for key, value in options.items()):
+                return
+            else:
+                logger.info(f"Dropping outdated embedding index: {definition}")
+            connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {EMBEDDING_INDEX_NAME}"))
+
+        if options is None:
+            return
+        with_clause = ", ".join(f"{key} = {int(value)}" for key, value in options.items())
+        logger.info(f"Building {method} embedding index ({with_clause})")
+        connection.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {EMBEDDING_INDEX_NAME} "
+            f"ON document_chunks USING {method} (embedding vector_cosine_ops) WITH ({with_clause})"
+        ))
+
+def _vector_version(db: Session) -> Tuple[int, ...]:
+    global _extension_version
+    with _version_lock:
+        if _extension_version is None:
+            version = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            _extension_version = tuple(int(part) for part in (version or "0").split(".") if part.isdigit())
+        return _extension_version
+
+def set_vector_search_params(db: Session, limit: int = 0, exact: bool = False) -> None:
+    """Apply the index's query-time recall settings for the current transaction.
+
+    Rows failing a WHERE filter are dropped after the index returns its
+    candidates, so a filtered query can come back short. The candidate list
+    is therefore made at least limit long, and on pgvector >= 0.8 the index
+    keeps scanning until enough rows pass the filter. With exact, index
+    scans are disabled so a selective filter is served from its own index
+    and every matching row is compared.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    if exact:
+        db.execute(text("SET LOCAL enable_indexscan = off"))
+        return
+    iterative = _vector_version(db) >= (0, 8)
+    if settings.PGVECTOR_INDEX_TYPE == "hnsw":
+        ef_search = min(max(int(settings.PGVECTOR_HNSW_EF_SEARCH), limit), MAX_EF_SEARCH)
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+        if iterative:
+            db.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+    elif settings.PGVECTOR_INDEX_TYPE == "ivfflat":
+        db.execute(text(f"SET LOCAL ivfflat.probes = {int(settings.PGVECTOR_IVFFLAT_PROBES)}"))
+        if iterative:
+            db.execute(text("SET LOCAL ivfflat.iterative_scan = relaxed_order"))
+
+@contextmanager
+def vector_search_params(db: Session, limit: int = 0, exact: bool = False) -> Iterator[None]:
+    """Apply set_vector_search_params to the queries run inside the block only.
+
+    SET LOCAL lasts until the transaction ends, so the settings are made in
+    a savepoint that is rolled back afterwards; later queries in the same
+    transaction are planned normally. Fetch results inside the block.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        yield
+        return
+    savepoint = db.begin_nested()
+    try:
+        set_vector_search_params(db, limit, exact)
+        yield
+    finally:
+        savepoint.rollback()
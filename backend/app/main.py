@@ -2,7 +2,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.db.base import Base
 from app.db.session import engine
+from app.db.pgvector import create_vector_extension
 from app.core.config import settings
+from app.core.executors import get_executor_stats, shutdown_executors
+from app.services.reranker import get_reranker
 from app.api.v1 import api_router
 from fastapi.openapi.utils import get_openapi
 
@@ -14,7 +17,7 @@ app = FastAPI(
     openapi_url="/api/v1/openapi.json",
     docs_url="/docs",
     swagger_ui_oauth2_redirect_url="/api/v1/users/login",
-    openapi_tags=[{"name": "users"}, {"name": "documents"}],
+    openapi_tags=[{"name": "users"}, {"name": "documents"}, {"name": "chat"}],
 )
 
 # Update the OpenAPI schema to use the correct token URL
@@ -64,6 +67,7 @@ app.add_middleware(
 )
 
 # Create database tables
+create_vector_extension(engine)
 Base.metadata.create_all(bind=engine)
 print("Tables created!")
 
@@ -72,4 +76,18 @@ app.include_router(api_router, prefix="/api/v1")
 
 @app.get("/")
 async def root():
-    return {"message": "Welcome to Document Processing API"}
\ No newline at end of file
+    return {"message": "Welcome to Document Processing API"}
+
+@app.get("/metrics/executors")
+async def executor_metrics():
+    """Worker pool utilization and queue depth"""
+    return get_executor_stats()
+
+@app.get("/metrics/reranker")
+async def reranker_metrics():
+    """Reranking calls, candidates scored and latency"""
+    return get_reranker().get_stats()
+
+@app.on_event("shutdown")
+def shutdown():
+    shutdown_executors()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, UUID, Text, ForeignKey
+from sqlalchemy import Column, String, DateTime, UUID, Text, ForeignKey, Integer
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 import uuid
@@ -11,6 +11,9 @@ class ChatSession(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Running summary of the messages that have left the recent window
+    summary = Column(Text, nullable=True)
+    summarized_message_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
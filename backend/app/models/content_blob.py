@@ -0,0 +1,33 @@
+from sqlalchemy import Column, String, DateTime, BigInteger, Integer
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from enum import Enum
+from app.db.base_class import Base
+
+class ContentBlobStatus(str, Enum):
+    PENDING = "pending"  # stored, not yet chunked and embedded
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
+class ContentBlob(Base):
+    """One stored copy of an uploaded file, shared by every document with the same bytes.
+
+    The blob's chunks and embeddings (document_chunks rows whose chunk_set
+    is the content hash) are shared the same way. ref_count counts the
+    documents referencing the blob; the file and its chunks are freed when
+    it drops to zero.
+    """
+    __tablename__ = "content_blobs"
+
+    content_hash = Column(String(64), primary_key=True)  # hex SHA-256 of the file
+    file_url = Column(String, nullable=False)
+    file_size = Column(BigInteger)
+    content_type = Column(String)
+    ref_count = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default=ContentBlobStatus.PENDING)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Blobs are only deleted once unreferenced; never null out a document's hash
+    documents = relationship("Document", back_populates="blob", passive_deletes="all")
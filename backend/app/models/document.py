@@ -1,13 +1,16 @@
-from sqlalchemy import Column, String, DateTime, UUID, BigInteger, ForeignKey, Text, Integer, JSON, ARRAY, Float
+from sqlalchemy import Column, String, DateTime, UUID, BigInteger, ForeignKey, Text, Integer, JSON, Computed, Index
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, TSVECTOR
+from pgvector.sqlalchemy import Vector
+from app.core.config import settings
 import uuid
 from app.db.base import Base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 from enum import Enum
 
 class DocumentStatus(str, Enum):
+    QUEUED = "queued"
     PROCESSING = "processing"
     READY = "ready"
     FAILED = "failed"
@@ -20,20 +23,48 @@ class Document(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     status = Column(String, default=DocumentStatus.PROCESSING)
     file_url = Column(String)  # Added this column
+    content_type = Column(String)
+    content_hash = Column(String(64), ForeignKey("content_blobs.content_hash"), index=True)  # hex SHA-256 of the uploaded file
+    file_size = Column(BigInteger)
+    progress = Column(Integer, default=0)  # percent of ingestion completed
+    error_message = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow)  # Added this column
 
     # Fix the relationship name to match DocumentChunk's back_populates
     document_chunks = relationship("DocumentChunk", back_populates="document")
+    chat_sessions = relationship("ChatSession", back_populates="document", cascade="all, delete-orphan")
+    ingestion_jobs = relationship("IngestionJob", back_populates="document", cascade="all, delete-orphan")
+    blob = relationship("ContentBlob", back_populates="documents")
+
+    @property
+    def chunk_set(self) -> str:
+        """Key of the chunk/embedding set this document searches.
+
+        Documents with the same content share one set; documents uploaded
+        before content hashing have their own, keyed by id.
+        """
+        return self.content_hash or str(self.id)
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_document_chunks_content_tsv", "content_tsv", postgresql_using="gin"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # Only set for per-document chunk sets; shared sets outlive any one document
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"))
     content = Column(Text)
+    chunk_set = Column(String(64), index=True)  # Document.chunk_set of the documents sharing this chunk
     chunk_index = Column(Integer)
-    embedding = Column(ARRAY(Float))  # For vector storage
+    content_hash = Column(String(64), index=True)  # hex SHA-256 of the normalized content
+    embedding = Column(Vector(settings.EMBEDDING_DIMENSION))  # pgvector, sized for the embedding model
+    # Full-text search vector, maintained by PostgreSQL from content
+    content_tsv = deferred(Column(TSVECTOR, Computed(
+        f"to_tsvector('{settings.SEARCH_TEXT_CONFIG}', coalesce(content, ''))",
+        persisted=True
+    )))
     chunk_metadata = Column(JSON)  # Changed from 'metadata' to 'chunk_metadata'
     created_at = Column(DateTime, default=datetime.utcnow)
 
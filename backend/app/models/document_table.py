@@ -0,0 +1,20 @@
+from sqlalchemy import Column, String, DateTime, UUID, Integer, JSON
+from datetime import datetime
+import uuid
+from app.db.base_class import Base
+
+class DocumentTable(Base):
+    """A spreadsheet sheet or CSV stored as a Parquet file for direct querying.
+
+    Tables belong to a chunk set (Document.chunk_set), like the summary
+    chunks embedded for them, so documents with the same content share them.
+    """
+    __tablename__ = "document_tables"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    chunk_set = Column(String(64), nullable=False, index=True)
+    name = Column(String, nullable=False)  # sheet name, or the file name for CSV
+    file_url = Column(String, nullable=False)  # Parquet file in S3
+    columns = Column(JSON, nullable=False)  # [{"name": ..., "dtype": ...}]
+    row_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
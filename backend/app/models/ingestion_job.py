@@ -0,0 +1,36 @@
+from sqlalchemy import Column, String, DateTime, UUID, ForeignKey, Text, Integer, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from enum import Enum
+import uuid
+from app.db.base_class import Base
+
+class IngestionJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    __table_args__ = (
+        # Matches the worker's claim query: next runnable job by priority, then age
+        Index("ix_ingestion_jobs_claim", "status", "priority", "run_after"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, nullable=False, default=IngestionJobStatus.QUEUED)
+    priority = Column(Integer, nullable=False, default=0)  # higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # Chunk set of the version being replaced, whose embeddings can be reused
+    previous_chunk_set = Column(String(64))
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String)
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    document = relationship("Document", back_populates="ingestion_jobs")
@@ -13,6 +13,7 @@ class DocumentResponse(DocumentBase):
     id: UUID = Field(..., description="Unique identifier")
     created_at: datetime = Field(..., description="When the document was created")
     status: str = Field(..., description="Processing status")
+    progress: Optional[int] = Field(None, description="Percent of ingestion completed")
     file_url: Optional[str] = Field(None, description="URL to access the file")
 
     class Config:
@@ -0,0 +1,8 @@
+import logging
+from app.db.pgvector import ensure_vector_index
+from app.db.session import engine
+
+if __name__ == "__main__":
+    # Build or rebuild the embedding index to match the PGVECTOR_* settings
+    logging.basicConfig(level=logging.INFO)
+    ensure_vector_index(engine)
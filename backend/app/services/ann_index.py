@@ -0,0 +1,499 @@
+from app.core.config import settings
+from app.services.embedding_store import MatrixWriter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+import faiss
+import numpy as np
+import shutil
+import fcntl
+import json
+import os
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rebuild an index once this share of its vectors are deleted but still stored
+COMPACTION_RATIO = 0.2
+
+class FaissIndex:
+    """One FAISS shard of chunk embeddings with incremental add/remove.
+
+    Vectors are L2-normalized and searched by inner product, so scores are
+    cosine similarities. Chunk content and metadata are kept in memory,
+    keyed by the int64 FAISS id; on disk they live in each document's
+    segment (see AnnIndexManager).
+    """
+
+    def __init__(self, index_type: Optional[str] = None):
+        self.index_type = index_type or settings.FAISS_INDEX_TYPE
+        if self.index_type not in ("flat", "ivf", "hnsw"):
+            raise ValueError(f"Unsupported FAISS index type: {self.index_type}")
+        self.index = None
+        self.next_id = 0
+        self.payloads: Dict[int, Dict] = {}
+        self.document_ids: Dict[str, List[int]] = {}
+        # Segment each document's vectors were read from
+        self.segments: Dict[str, str] = {}
+        # Vectors added or removed since the shard was last checkpointed
+        self.changes = 0
+        # HNSW graphs cannot drop vectors, so removals are masked until compaction
+        self.tombstones: set = set()
+        # Number of vectors the IVF coarse quantizer was trained on
+        self.trained_size = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.payloads)
+
+    def _build_index(self, dimension: int, training: np.ndarray):
+        if self.index_type == "ivf":
+            # Keep roughly 39+ training points per list, as FAISS recommends
+            nlist = max(1, min(settings.FAISS_IVF_NLIST, len(training) // 39))
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(training)
+            index.nprobe = min(settings.FAISS_IVF_NPROBE, nlist)
+            # IVF takes ids natively; the hashtable map allows remove/reconstruct by id
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            self.trained_size = len(training)
+            return index
+
+        if self.index_type == "hnsw":
+            base = faiss.IndexHNSWFlat(dimension, settings.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            base.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+            base.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+        else:
+            base = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIDMap2(base)
+
+    @staticmethod
+    def _prepare(vectors) -> np.ndarray:
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        faiss.normalize_L2(matrix)
+        return matrix
+
+    def add(
+        self,
+        document_id: UUID,
+        chunks: List[Dict],
+        embeddings: List[List[float]],
+        segment: Optional[str] = None
+    ) -> None:
+        """Add a document's chunks, replacing any it already had"""
+        if str(document_id) in self.document_ids or str(document_id) in self.segments:
+            self.remove(document_id)
+        if segment is not None:
+            self.segments[str(document_id)] = segment
+        if not chunks:
+            return
+
+        vectors = self._prepare(embeddings)
+        if self.index is None:
+            self.index = self._build_index(vectors.shape[1], vectors)
+
+        ids = np.arange(self.next_id, self.next_id + len(chunks), dtype=np.int64)
+        self.next_id += len(chunks)
+        self.index.add_with_ids(vectors, ids)
+
+        for faiss_id, chunk in zip(ids.tolist(), chunks):
+            self.payloads[faiss_id] = {
+                "document_id": str(document_id),
+                "content": chunk["content"],
+                "metadata": chunk.get("metadata") or {}
+            }
+        self.document_ids[str(document_id)] = ids.tolist()
+        self.changes += len(chunks)
+
+        # Retrain IVF centroids once the shard has grown well past its training set
+        if self.index_type == "ivf" and self.index.nlist < settings.FAISS_IVF_NLIST \
+                and self.size > 4 * self.trained_size:
+            self._compact()
+
+    def remove(self, document_id: UUID) -> None:
+        """Remove every chunk of a document"""
+        self.segments.pop(str(document_id), None)
+        ids = self.document_ids.pop(str(document_id), [])
+        if not ids:
+            return
+        for faiss_id in ids:
+            self.payloads.pop(faiss_id, None)
+        self.changes += len(ids)
+
+        if self.index_type == "hnsw":
+            self.tombstones.update(ids)
+            if len(self.tombstones) > COMPACTION_RATIO * self.index.ntotal:
+                self._compact()
+        else:
+            self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def _compact(self) -> None:
+        """Rebuild the index from the live vectors, dropping tombstones"""
+        live_ids = np.asarray(sorted(self.payloads), dtype=np.int64)
+        if not len(live_ids):
+            self.index = None
+        else:
+            vectors = np.vstack([self.index.reconstruct(int(faiss_id)) for faiss_id in live_ids])
+            self.index = self._build_index(vectors.shape[1], vectors)
+            self.index.add_with_ids(vectors, live_ids)
+        self.tombstones.clear()
+
+    def search(
+        self,
+        query_embedding: List[float],
+        document_ids: Optional[List[UUID]] = None,
+        limit: int = 3,
+        include_embeddings: bool = False
+    ) -> List[Dict]:
+        """Return the nearest chunks, optionally restricted to some documents.
+
+        With include_embeddings, each match carries its (normalized) vector.
+        """
+        if self.index is None or not self.payloads:
+            return []
+
+        allowed = None
+        if document_ids is not None:
+            allowed = {str(document_id) for document_id in document_ids}
+            if not allowed & self.document_ids.keys():
+                return []
+            if self.document_ids.keys() <= allowed:
+                allowed = None
+
+        query = self._prepare(query_embedding)
+        k = limit if allowed is None and not self.tombstones else limit * 4
+        while True:
+            k = min(k, self.index.ntotal)
+            scores, ids = self.index.search(query, k)
+            matches = []
+            for score, faiss_id in zip(scores[0].tolist(), ids[0].tolist()):
+                payload = self.payloads.get(faiss_id)
+                if payload is None or (allowed is not None and payload["document_id"] not in allowed):
+                    continue
+                match = {**payload, "score": float(score)}
+                if include_embeddings:
+                    match["embedding"] = self.index.reconstruct(int(faiss_id))
+                matches.append(match)
+                if len(matches) == limit:
+                    return matches
+            # Over-fetch until the filter leaves enough hits or the shard is exhausted
+            if k >= self.index.ntotal:
+                return matches
+            k *= 4
+
+    def save_checkpoint(self, path: str) -> None:
+        """Write the index and the id layout of its segments to a directory"""
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        if self.index is not None:
+            faiss.write_index(self.index, os.path.join(tmp_path, "index.faiss"))
+        with open(os.path.join(tmp_path, "state.json"), "w") as f:
+            json.dump(
+                {
+                    "index_type": self.index_type,
+                    "next_id": self.next_id,
+                    "tombstones": sorted(self.tombstones),
+                    "trained_size": self.trained_size,
+                    "document_ids": self.document_ids,
+                    "segments": self.segments
+                },
+                f
+            )
+
+        # Swap the finished checkpoint into place so readers never see a partial write
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.changes = 0
+
+    @classmethod
+    def load_checkpoint(cls, path: str) -> "FaissIndex":
+        """Read a checkpoint written with save_checkpoint(), without payloads"""
+        with open(os.path.join(path, "state.json")) as f:
+            state = json.load(f)
+        shard = cls(state["index_type"])
+        index_path = os.path.join(path, "index.faiss")
+        if os.path.exists(index_path):
+            shard.index = faiss.read_index(index_path)
+            if shard.index_type == "hnsw":
+                faiss.downcast_index(shard.index.index).hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+            elif shard.index_type == "ivf":
+                shard.index.nprobe = min(settings.FAISS_IVF_NPROBE, shard.index.nlist)
+        shard.next_id = state["next_id"]
+        shard.tombstones = set(state["tombstones"])
+        shard.trained_size = state["trained_size"]
+        shard.document_ids = state["document_ids"]
+        shard.segments = state["segments"]
+        return shard
+
+class AnnIndexManager:
+    """FAISS shards persisted under VECTOR_INDEX_DIR and shared between processes.
+
+    On disk a shard is a directory of immutable per-document segments (the
+    document's normalized vectors in an .npy file and its chunks in a JSON
+    file), a generation counter, and an optional checkpoint of the built
+    FAISS index. Adding or removing a document writes or deletes only that
+    document's segment, so the ingestion worker never loads a shard.
+
+    Searching processes cache shards in memory and, when the generation
+    changes, apply just the segments added or removed since. Once enough
+    has changed they write a new checkpoint, which bounds how much a cold
+    load rebuilds. Writers take an exclusive file lock and readers a shared
+    one, so the API and worker processes never lose each other's updates.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(settings.VECTOR_INDEX_DIR, "faiss")
+        self._shards: Dict[str, Tuple[int, FaissIndex]] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def shard_key(document_id: UUID, user_id: Optional[UUID] = None) -> str:
+        if settings.FAISS_SHARD_BY == "user" and user_id is not None:
+            return f"user-{user_id}"
+        return f"document-{document_id}"
+
+    def _path(self, key: str, *parts: str) -> str:
+        return os.path.join(self.root, key, *parts)
+
+    @contextmanager
+    def _file_lock(self, key: str, exclusive: bool) -> Iterator[None]:
+        # Kept next to the shard so deleting the shard does not drop the lock
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, f"{key}.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _generation(self, key: str) -> Optional[int]:
+        try:
+            with open(self._path(key, "generation")) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return None
+
+    def _bump_generation(self, key: str) -> None:
+        generation = (self._generation(key) or 0) + 1
+        tmp_path = self._path(key, f"generation.tmp-{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self._path(key, "generation"))
+
+    def _segments(self, key: str) -> Dict[str, str]:
+        """Live segment of every document in a shard, by document id"""
+        try:
+            names = os.listdir(self._path(key, "segments"))
+        except FileNotFoundError:
+            return {}
+        segments: Dict[str, str] = {}
+        # Segment names sort by creation, so a newer segment of a document wins
+        for name in sorted(names):
+            if name.endswith(".json"):
+                segment = name[:-len(".json")]
+                segments[segment.split(".")[0]] = segment
+        return segments
+
+    def _read_segment(self, key: str, segment: str) -> Tuple[List[Dict], np.ndarray]:
+        with open(self._path(key, "segments", f"{segment}.json")) as f:
+            chunks = json.load(f)
+        vectors = np.load(self._path(key, "segments", f"{segment}.npy"))
+        return chunks, vectors
+
+    def _delete_segment(self, key: str, segment: str) -> None:
+        # The JSON file marks a segment live, so it goes first
+        for suffix in (".json", ".npy"):
+            try:
+                os.remove(self._path(key, "segments", segment + suffix))
+            except FileNotFoundError:
+                pass
+
+    def _load(self, key: str, segments: Dict[str, str]) -> FaissIndex:
+        """Cold-load a shard from its checkpoint, if any"""
+        checkpoint = self._path(key, "checkpoint")
+        if not os.path.isdir(checkpoint):
+            return FaissIndex()
+        shard = FaissIndex.load_checkpoint(checkpoint)
+        for document_id, segment in list(shard.segments.items()):
+            if segments.get(document_id) != segment:
+                # Removed or replaced since the checkpoint
+                shard.remove(document_id)
+                continue
+            chunks, _ = self._read_segment(key, segment)
+            for faiss_id, chunk in zip(shard.document_ids[document_id], chunks):
+                shard.payloads[faiss_id] = {
+                    "document_id": document_id,
+                    "content": chunk["content"],
+                    "metadata": chunk.get("metadata") or {}
+                }
+        return shard
+
+    def _sync(self, key: str, shard: Optional[FaissIndex]) -> FaissIndex:
+        """Bring a cached shard up to date with the segments on disk"""
+        segments = self._segments(key)
+        if shard is None:
+            shard = self._load(key, segments)
+        for document_id, segment in list(shard.segments.items()):
+            if segments.get(document_id) != segment:
+                shard.remove(document_id)
+        for document_id, segment in segments.items():
+            if shard.segments.get(document_id) != segment:
+                chunks, vectors = self._read_segment(key, segment)
+                shard.add(document_id, chunks, vectors, segment=segment)
+        return shard
+
+    def get_shard(self, key: str) -> Optional[FaissIndex]:
+        with self._lock:
+            cached = self._shards.get(key)
+            generation = self._generation(key)
+            if generation is None:
+                self._shards.pop(key, None)
+                return None
+            if cached and cached[0] == generation:
+                return cached[1]
+
+            with self._file_lock(key, exclusive=False):
+                generation = self._generation(key)
+                if generation is None:
+                    self._shards.pop(key, None)
+                    return None
+                shard = self._sync(key, cached[1] if cached else None)
+            self._shards[key] = (generation, shard)
+
+            if shard.changes > COMPACTION_RATIO * max(shard.size, 1):
+                self._checkpoint(key, generation, shard)
+            return shard
+
+    def _checkpoint(self, key: str, generation: int, shard: FaissIndex) -> None:
+        try:
+            with self._file_lock(key, exclusive=True):
+                # Only a shard in step with the disk may be checkpointed
+                if self._generation(key) == generation:
+                    shard.save_checkpoint(self._path(key, "checkpoint"))
+        except Exception as e:
+            logger.warning(f"Failed to checkpoint FAISS shard {key}: {e}")
+
+    def open_document(self, key: str, document_id: UUID, count: int) -> "SegmentWriter":
+        """Start writing a document's segment of count chunks"""
+        return SegmentWriter(self, key, document_id, count)
+
+    def add_document(
+        self,
+        key: str,
+        document_id: UUID,
+        chunks: List[Dict],
+        embeddings: List[List[float]]
+    ) -> None:
+        """Write a document's segment, replacing any it already had"""
+        writer = self.open_document(key, document_id, len(chunks))
+        try:
+            writer.write(chunks, embeddings)
+            writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+    def remove_document(self, key: str, document_id: UUID) -> None:
+        with self._file_lock(key, exclusive=True):
+            segments = self._segments(key)
+            segment = segments.pop(str(document_id), None)
+            if segment is None:
+                return
+            self._delete_segment(key, segment)
+            if segments:
+                self._bump_generation(key)
+            else:
+                # Last document gone: searches fall back to the database
+                shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def search(
+        self,
+        query_embedding: List[float],
+        shard_documents: Dict[str, List[UUID]],
+        limit: int = 3,
+        include_embeddings: bool = False
+    ) -> Optional[List[Dict]]:
+        """Search several shards and merge their hits by score.
+
+        Returns None when a shard, or a document in it, has not been
+        indexed (e.g. it was ingested elsewhere), so callers can fall back
+        to the database.
+        """
+        matches = []
+        for key, document_ids in shard_documents.items():
+            shard = self.get_shard(key)
+            if shard is None or any(str(document_id) not in shard.segments for document_id in document_ids):
+                return None
+            matches.extend(shard.search(query_embedding, document_ids, limit, include_embeddings))
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return matches[:limit]
+
+_manager: Optional[AnnIndexManager] = None
+
+def get_ann_index() -> AnnIndexManager:
+    global _manager
+    if _manager is None:
+        _manager = AnnIndexManager()
+    return _manager
+
+class SegmentWriter:
+    """Writes one document's segment of a shard a batch of chunks at a time.
+
+    Batches go straight to temporary files, so memory use does not grow
+    with the document; commit() publishes the segment, replacing any the
+    document already had.
+    """
+
+    def __init__(self, manager: AnnIndexManager, key: str, document_id: UUID, count: int):
+        self.manager = manager
+        self.key = key
+        self.document_id = str(document_id)
+        # Time-ordered name: sorting segment names puts the newest last
+        self.segment = f"{document_id}.{time.time_ns():020d}{uuid4().hex[:8]}"
+        # Written outside the shard, which a concurrent removal may delete
+        os.makedirs(manager.root, exist_ok=True)
+        self.tmp_prefix = os.path.join(manager.root, f".tmp-{key}-{self.segment}")
+        self.vectors = MatrixWriter(f"{self.tmp_prefix}.npy", count)
+        self.written = 0
+        self.chunks = open(f"{self.tmp_prefix}.json", "w")
+        self.chunks.write("[")
+
+    def write(self, chunks: List[Dict], embeddings: List[List[float]]) -> None:
+        if not chunks:
+            return
+        self.vectors.write(FaissIndex._prepare(embeddings))
+        for chunk in chunks:
+            if self.written:
+                self.chunks.write(",")
+            json.dump({"content": chunk["content"], "metadata": chunk.get("metadata") or {}}, self.chunks)
+            self.written += 1
+
+    def commit(self) -> None:
+        try:
+            self.vectors.close()
+            self.chunks.write("]")
+            self.chunks.close()
+
+            manager, key = self.manager, self.key
+            with manager._file_lock(key, exclusive=True):
+                os.makedirs(manager._path(key, "segments"), exist_ok=True)
+                previous = manager._segments(key).get(self.document_id)
+                os.replace(f"{self.tmp_prefix}.npy", manager._path(key, "segments", f"{self.segment}.npy"))
+                os.replace(f"{self.tmp_prefix}.json", manager._path(key, "segments", f"{self.segment}.json"))
+                if previous is not None:
+                    manager._delete_segment(key, previous)
+                manager._bump_generation(key)
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Remove the temporary files of an unpublished segment"""
+        self.chunks.close()
+        self.vectors.matrix = None
+        for suffix in (".npy", ".json"):
+            if os.path.exists(self.tmp_prefix + suffix):
+                os.remove(self.tmp_prefix + suffix)
@@ -0,0 +1,125 @@
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import json
+import math
+import os
+import re
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """In-memory BM25 inverted index over a fixed list of texts.
+
+    Each term's postings are the ids of the texts containing it, stored
+    delta-encoded in an array('I') next to an array('I') of term
+    frequencies, so an index costs a few bytes per posting rather than a
+    Python object each. Queries decode postings with NumPy and score every
+    matching text at once; no embedding call is needed.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        self.postings: List[array] = []
+        self.frequencies: List[array] = []
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        return cls.from_term_counts((Counter(tokenize(text)) for text in texts), k1, b)
+
+    @classmethod
+    def from_term_counts(
+        cls,
+        documents: Iterable[Dict[str, int]],
+        k1: float = 1.5,
+        b: float = 0.75
+    ) -> "BM25Index":
+        """Index texts given as term -> count maps, e.g. the lexemes of a tsvector"""
+        index = cls(k1, b)
+        last_doc: List[int] = []
+        lengths = array("I")
+        for doc_id, counts in enumerate(documents):
+            for term, count in counts.items():
+                term_id = index.vocabulary.get(term)
+                if term_id is None:
+                    term_id = index.vocabulary[term] = len(index.postings)
+                    index.postings.append(array("I"))
+                    index.frequencies.append(array("I"))
+                    last_doc.append(0)
+                # Texts are added in id order, so deltas are never negative
+                index.postings[term_id].append(doc_id - last_doc[term_id])
+                index.frequencies[term_id].append(count)
+                last_doc[term_id] = doc_id
+            lengths.append(sum(counts.values()))
+        index.doc_lengths = np.frombuffer(lengths, dtype=np.uint32).astype(np.float32)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every text for a query (zero where no term matches)"""
+        return self.term_scores(tokenize(query))
+
+    def term_scores(self, terms: Iterable[str]) -> np.ndarray:
+        """BM25 score of every text for already tokenized query terms"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        average_length = max(float(self.doc_lengths.mean()), 1.0)
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / average_length)
+        for token in set(terms):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            doc_ids = np.cumsum(np.frombuffer(self.postings[term_id], dtype=np.uint32), dtype=np.int64)
+            tf = np.frombuffer(self.frequencies[term_id], dtype=np.uint32).astype(np.float32)
+            df = len(doc_ids)
+            idf = math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+            scores[doc_ids] += idf * tf * (self.k1 + 1) / (tf + length_norm[doc_ids])
+        return scores
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        """Top k (text id, score) pairs with a positive score, best first"""
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores > 0)
+        if len(matching) > k:
+            matching = matching[np.argpartition(-scores[matching], k - 1)[:k]]
+        ranked = matching[np.argsort(-scores[matching], kind="stable")]
+        return [(int(i), float(scores[i])) for i in ranked]
+
+    def save(self, path: str) -> None:
+        """Write the index into a directory as flat arrays"""
+        offsets = np.cumsum([0] + [len(p) for p in self.postings], dtype=np.int64)
+        np.savez(
+            os.path.join(path, "bm25.npz"),
+            postings=np.frombuffer(b"".join(p.tobytes() for p in self.postings), dtype=np.uint32),
+            frequencies=np.frombuffer(b"".join(f.tobytes() for f in self.frequencies), dtype=np.uint32),
+            offsets=offsets,
+            doc_lengths=self.doc_lengths
+        )
+        with open(os.path.join(path, "bm25.json"), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "vocabulary": self.vocabulary}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(os.path.join(path, "bm25.json")) as f:
+            params = json.load(f)
+        index = cls(params["k1"], params["b"])
+        index.vocabulary = params["vocabulary"]
+        with np.load(os.path.join(path, "bm25.npz")) as data:
+            offsets = data["offsets"]
+            postings = data["postings"]
+            frequencies = data["frequencies"]
+            index.doc_lengths = data["doc_lengths"]
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            index.postings.append(array("I", postings[start:end].tobytes()))
+            index.frequencies.append(array("I", frequencies[start:end].tobytes()))
+        return index
@@ -0,0 +1,144 @@
+from sqlalchemy import ARRAY, JSON, BigInteger, DateTime, Float, Integer, SmallInteger, String, Table, Text, UUID, insert
+from sqlalchemy.orm import Session
+from pgvector.sqlalchemy import Vector
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import io
+import json
+import struct
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL binary COPY framing
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PG_EPOCH = datetime(2000, 1, 1)
+FLOAT8_OID = 701
+
+def _encode_uuid(value) -> bytes:
+    return value.bytes
+
+def _encode_text(value) -> bytes:
+    return str(value).encode("utf-8")
+
+def _encode_int2(value) -> bytes:
+    return struct.pack("!h", value)
+
+def _encode_int4(value) -> bytes:
+    return struct.pack("!i", value)
+
+def _encode_int8(value) -> bytes:
+    return struct.pack("!q", value)
+
+def _encode_json(value) -> bytes:
+    return json.dumps(value).encode("utf-8")
+
+def _encode_timestamp(value) -> bytes:
+    delta = value - PG_EPOCH
+    return struct.pack("!q", (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+
+def _encode_float8_array(value) -> bytes:
+    # One dimension, no NULLs, then (length, value) per element
+    values = [float(v) for v in value]
+    header = struct.pack("!iiiii", 1, 0, FLOAT8_OID, len(values), 1)
+    return header + b"".join(struct.pack("!id", 8, v) for v in values)
+
+def _encode_vector(value) -> bytes:
+    # pgvector's binary form: dimensions, an unused word, then float4 values
+    values = [float(v) for v in value]
+    return struct.pack(f"!hh{len(values)}f", len(values), 0, *values)
+
+def _column_encoder(column) -> Optional[Callable[[Any], bytes]]:
+    """Binary COPY encoder for a column, or None if its type is not supported"""
+    column_type = column.type
+    if isinstance(column_type, UUID):
+        return _encode_uuid
+    if isinstance(column_type, (String, Text)):
+        return _encode_text
+    # BigInteger and SmallInteger subclass Integer, so they are matched first
+    if isinstance(column_type, BigInteger):
+        return _encode_int8
+    if isinstance(column_type, SmallInteger):
+        return _encode_int2
+    if isinstance(column_type, Integer):
+        return _encode_int4
+    if isinstance(column_type, JSON):
+        return _encode_json
+    if isinstance(column_type, DateTime) and not column_type.timezone:
+        return _encode_timestamp
+    if isinstance(column_type, Vector):
+        return _encode_vector
+    if isinstance(column_type, ARRAY) and isinstance(column_type.item_type, Float):
+        return _encode_float8_array
+    return None
+
+def encode_copy_binary(table: Table, columns: List[str], rows: List[Dict]) -> bytes:
+    """Encode rows in PostgreSQL's binary COPY format.
+
+    Embeddings go over the wire as packed floats instead of the decimal
+    text a per-row INSERT would send.
+    """
+    encoders = []
+    for name in columns:
+        encoder = _column_encoder(table.c[name])
+        if encoder is None:
+            raise TypeError(f"Column {table.name}.{name} cannot be encoded for COPY")
+        encoders.append(encoder)
+
+    buffer = io.BytesIO()
+    buffer.write(COPY_SIGNATURE)
+    buffer.write(struct.pack("!ii", 0, 0))  # flags, header extension length
+    field_count = struct.pack("!h", len(columns))
+    for row in rows:
+        buffer.write(field_count)
+        for name, encoder in zip(columns, encoders):
+            value = row.get(name)
+            if value is None:
+                buffer.write(struct.pack("!i", -1))
+                continue
+            data = encoder(value)
+            buffer.write(struct.pack("!i", len(data)))
+            buffer.write(data)
+    buffer.write(struct.pack("!h", -1))  # trailer
+    return buffer.getvalue()
+
+def bulk_insert(db: Session, table: Table, rows: List[Dict], batch_size: int, method: str = "executemany") -> Dict[str, Any]:
+    """Insert rows in the session's transaction without the ORM unit of work.
+
+    Rows are sent as executemany INSERTs of batch_size rows, or with
+    method="copy" on PostgreSQL streamed with binary COPY. The caller
+    commits. Returns timing counters.
+    """
+    stats = {"rows": len(rows), "batches": 0, "encode_seconds": 0.0, "write_seconds": 0.0, "method": method}
+    if not rows:
+        return stats
+
+    columns = list(rows[0].keys())
+    connection = db.connection()
+    if method == "copy" and connection.dialect.name != "postgresql":
+        stats["method"] = method = "executemany"
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        stats["batches"] += 1
+        if method == "copy":
+            started = time.perf_counter()
+            payload = encode_copy_binary(table, columns, batch)
+            encoded = time.perf_counter()
+            cursor = connection.connection.dbapi_connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)",
+                    io.BytesIO(payload)
+                )
+            finally:
+                cursor.close()
+            stats["encode_seconds"] += encoded - started
+            stats["write_seconds"] += time.perf_counter() - encoded
+        else:
+            started = time.perf_counter()
+            db.execute(insert(table), batch)
+            stats["write_seconds"] += time.perf_counter() - started
+
+    return stats
@@ -1,4 +1,282 @@
-# # Need to implement:
-# - Document cache
-# - Query result cache
-# - Session cache 
\ No newline at end of file
+from app.core.config import settings
+from app.services.embedding_store import normalize_rows
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies share a cache key"""
+    return re.sub(r"\s+", " ", text).strip()
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with a memory tier and a disk tier.
+
+    Keys are sha256(model, normalized text). Recently used vectors stay in a
+    bounded in-process LRU; every vector is also written to a SQLite file that
+    all workers share and that evicts least recently read entries once it
+    grows past max_disk_bytes.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_memory_items: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None
+    ):
+        self.path = path or settings.EMBEDDING_CACHE_PATH
+        self.max_memory_items = max_memory_items or settings.EMBEDDING_CACHE_MEMORY_ITEMS
+        self.max_disk_bytes = max_disk_bytes or settings.EMBEDDING_CACHE_MAX_BYTES
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # Must precede table creation for freed pages to be returned to the OS
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Look up keys, returning only the ones that are cached"""
+        found: Dict[str, np.ndarray] = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.stats["memory_hits"] += 1
+                else:
+                    missing.append(key)
+
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+                self.stats["disk_hits"] += len(rows)
+                self.stats["misses"] += len(batch) - len(rows)
+                if rows:
+                    self._db.execute(
+                        f"UPDATE embeddings SET last_access = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time(), *[key for key, _ in rows]]
+                    )
+
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put_many(self, vectors: Dict[str, List[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, values in vectors.items():
+                vector = np.asarray(values, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently read entries until the file fits its budget"""
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self._db.execute("PRAGMA page_count").fetchone()[0]
+        if page_size * page_count <= self.max_disk_bytes:
+            return
+
+        total = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if not total:
+            return
+        # Free space down to 90% of the budget, judged by the average entry size
+        target = int(self.max_disk_bytes * 0.9)
+        per_entry = max(1, (page_size * page_count) // total)
+        excess = min(total, max(1, (page_size * page_count - target) // per_entry))
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,)
+        )
+        self._db.execute("PRAGMA incremental_vacuum")
+        self.stats["evictions"] += excess
+        logger.info(f"Evicted {excess} embeddings from the disk cache")
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_singleton_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    with _singleton_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
+
+class _AnswerScope:
+    """Cached answers for one set of documents"""
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def similar(self, embedding: np.ndarray, min_similarity: float) -> Optional[Dict]:
+        candidates = [entry for entry in self.entries.values() if entry["embedding"] is not None]
+        if not candidates:
+            return None
+        matrix = np.vstack([entry["embedding"] for entry in candidates])
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] >= min_similarity else None
+
+class AnswerCache:
+    """Query-result cache in front of RAG answer generation.
+
+    Answers are scoped to a set of (document id, version) pairs. Within a
+    scope an exact tier matches the normalized question text, and a semantic
+    tier reuses an answer whose question embedding lies within max_distance
+    cosine distance of the new one. Versions make answers from an older copy
+    of a document unreachable even in workers that never saw the
+    invalidation; invalidate_document frees them in this one.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_distance: Optional[float] = None,
+        ttl_seconds: Optional[int] = None
+    ):
+        self.max_entries = max_entries or settings.ANSWER_CACHE_MAX_ENTRIES
+        self.max_distance = settings.ANSWER_CACHE_MAX_DISTANCE if max_distance is None else max_distance
+        self.ttl_seconds = ttl_seconds or settings.ANSWER_CACHE_TTL_SECONDS
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+        self._scopes: Dict[tuple, _AnswerScope] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_scope(documents: Iterable) -> tuple:
+        """Scope for (document_id, version) pairs, independent of their order"""
+        return tuple(sorted((str(document_id), str(version)) for document_id, version in documents))
+
+    @staticmethod
+    def _question_key(question: str) -> str:
+        return normalize_text(question).lower()
+
+    def _expire(self, scope: _AnswerScope) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        while scope.entries:
+            key, entry = next(iter(scope.entries.items()))
+            if entry["created_at"] >= cutoff:
+                break
+            del scope.entries[key]
+            self._size -= 1
+
+    def get(
+        self,
+        scope: tuple,
+        question: str,
+        embedding: Optional[List[float]] = None,
+        count_miss: bool = True
+    ) -> Optional[Dict]:
+        """Cached answer for a question, trying the exact tier then the semantic one.
+
+        Callers probing the exact tier before embedding the question pass
+        count_miss=False, so a question is counted as a miss only once
+        both tiers have missed.
+        """
+        with self._lock:
+            answers = self._scopes.get(scope)
+            if answers is not None:
+                self._expire(answers)
+                entry = answers.entries.get(self._question_key(question))
+                if entry is not None:
+                    self.stats["exact_hits"] += 1
+                    return dict(entry["answer"])
+                if embedding is not None and self.max_distance > 0:
+                    query = normalize_rows(np.asarray(embedding, dtype=np.float32))
+                    entry = answers.similar(query, 1.0 - self.max_distance)
+                    if entry is not None:
+                        self.stats["semantic_hits"] += 1
+                        return dict(entry["answer"])
+            if count_miss:
+                self.stats["misses"] += 1
+            return None
+
+    def put(self, scope: tuple, question: str, answer: Dict, embedding: Optional[List[float]] = None) -> None:
+        with self._lock:
+            answers = self._scopes.setdefault(scope, _AnswerScope())
+            key = self._question_key(question)
+            if key not in answers.entries:
+                self._size += 1
+            answers.entries[key] = {
+                "answer": dict(answer),
+                "embedding": normalize_rows(np.asarray(embedding, dtype=np.float32))
+                if embedding is not None else None,
+                "created_at": time.time()
+            }
+            answers.entries.move_to_end(key)
+
+            # Evict the oldest entries across scopes once over budget
+            while self._size > self.max_entries:
+                oldest_scope = min(
+                    (s for s in self._scopes.values() if s.entries),
+                    key=lambda s: next(iter(s.entries.values()))["created_at"]
+                )
+                oldest_scope.entries.popitem(last=False)
+                self._size -= 1
+            self._scopes = {k: s for k, s in self._scopes.items() if s.entries}
+
+    def invalidate_document(self, document_id) -> None:
+        """Drop every cached answer that drew on a document"""
+        document_id = str(document_id)
+        with self._lock:
+            for scope in [scope for scope in self._scopes if any(d == document_id for d, _ in scope)]:
+                self._size -= len(self._scopes.pop(scope).entries)
+                self.stats["invalidations"] += 1
+
+_answer_cache: Optional[AnswerCache] = None
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    with _singleton_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
@@ -1,36 +1,46 @@
 from sqlalchemy.orm import Session
 from app.models.chat import ChatSession, ChatMessage
 from app.services.rag_agent import RAGAgent
-from typing import List, Optional
+from app.services.memory import ConversationMemory
+from app.core.executors import run_db
+from app.core.config import get_settings
+from typing import AsyncIterator, Dict, List, Optional
 from uuid import UUID
 from fastapi import HTTPException
 
+settings = get_settings()
+
 class ChatService:
     def __init__(self, db: Session):
         self.db = db
-        self.rag_agent = RAGAgent()
+        self.rag_agent = RAGAgent(db)
+        self.memory = ConversationMemory(db) if settings.MEMORY_ENABLED else None
 
     async def create_session(self, user_id: UUID, document_id: UUID) -> ChatSession:
         """Create a new chat session"""
         session = ChatSession(user_id=user_id, document_id=document_id)
         self.db.add(session)
-        self.db.commit()
-        self.db.refresh(session)
+        await run_db(self.db.commit)
+        await run_db(self.db.refresh, session)
         return session
 
     async def get_session(self, session_id: UUID, user_id: UUID) -> Optional[ChatSession]:
         """Get a chat session by ID"""
-        return self.db.query(ChatSession).filter(
-            ChatSession.id == session_id,
-            ChatSession.user_id == user_id
-        ).first()
+        return await run_db(
+            self.db.query(ChatSession).filter(
+                ChatSession.id == session_id,
+                ChatSession.user_id == user_id
+            ).first
+        )
 
     async def get_user_sessions(self, user_id: UUID) -> List[ChatSession]:
         """Get all chat sessions for a user"""
-        return self.db.query(ChatSession)\
-            .filter(ChatSession.user_id == user_id)\
-            .order_by(ChatSession.created_at.desc())\
-            .all()
+        return await run_db(
+            self.db.query(ChatSession)
+            .filter(ChatSession.user_id == user_id)
+            .order_by(ChatSession.created_at.desc())
+            .all
+        )
 
     async def delete_session(self, session_id: UUID, user_id: UUID) -> bool:
         """Delete a chat session"""
@@ -39,9 +49,19 @@ class ChatService:
             return False
         
         self.db.delete(session)
-        self.db.commit()
+        await run_db(self.db.commit)
         return True
 
+    async def _question_context(self, session: ChatSession, content: str) -> Dict:
+        """Conversation history and standalone retrieval query for a new question"""
+        if self.memory is None:
+            return {"history": "", "retrieval_query": content}
+        memory = await self.memory.load(session)
+        retrieval_query = content
+        if settings.MEMORY_REWRITE_ENABLED:
+            retrieval_query = await self.memory.rewrite_query(content, memory)
+        return {"history": memory["history"], "retrieval_query": retrieval_query}
+
     async def add_message(
         self, 
         session_id: UUID, 
@@ -53,6 +73,9 @@ class ChatService:
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
 
+        # Read the history before the new message is pending in the session
+        question_context = await self._question_context(session, content)
+
         # Create user message
         user_message = ChatMessage(
             session_id=session_id,
@@ -65,7 +88,8 @@ class ChatService:
             # Get AI response
             response = await self.rag_agent.answer_question(
                 question=content,
-                document_ids=[session.document_id]
+                document_ids=[session.document_id],
+                **question_context
             )
 
             # Create assistant message
@@ -75,7 +99,10 @@ class ChatService:
                 content=response["answer"]
             )
             self.db.add(assistant_message)
-            self.db.commit()
+            await run_db(self.db.commit)
+
+            if self.memory is not None:
+                self.memory.schedule_update(session)
             
             return user_message, assistant_message, response["sources"]
             
@@ -86,6 +113,68 @@ class ChatService:
                 detail=f"Failed to generate response: {str(e)}"
             )
 
+    async def stream_message(
+        self,
+        session: ChatSession,
+        content: str
+    ) -> AsyncIterator[Dict]:
+        """Add a user message and stream the AI response.
+
+        Yields the agent's sources/token events, then a "message" event with
+        the persisted assistant message once the answer is complete. Nothing
+        is written if generation fails part way.
+        """
+        session_id = session.id
+        document_ids = [session.document_id]
+
+        try:
+            question_context = await self._question_context(session, content)
+
+            answer = None
+            async for event in self.rag_agent.stream_answer(
+                question=content,
+                document_ids=document_ids,
+                **question_context
+            ):
+                if event["event"] == "done":
+                    answer = event["data"]
+                else:
+                    yield event
+
+            user_message = ChatMessage(
+                session_id=session_id,
+                role="user",
+                content=content
+            )
+            assistant_message = ChatMessage(
+                session_id=session_id,
+                role="assistant",
+                content=answer["answer"]
+            )
+            self.db.add(user_message)
+            self.db.add(assistant_message)
+            await run_db(self.db.commit)
+            await run_db(self.db.refresh, assistant_message)
+
+            yield {
+                "event": "message",
+                "data": {
+                    "id": str(assistant_message.id),
+                    "content": assistant_message.content,
+                    "role": assistant_message.role,
+                    "created_at": assistant_message.created_at.isoformat()
+                    if assistant_message.created_at else None,
+                    "sources": answer["sources"]
+                }
+            }
+
+            if self.memory is not None:
+                self.memory.schedule_update(session)
+
+        except Exception as e:
+            self.db.rollback()
+            yield {"event": "error", "data": f"Failed to generate response: {str(e)}"}
+
     async def get_messages(
         self, 
         session_id: UUID, 
@@ -104,6 +193,8 @@ class ChatService:
         if before_id:
             query = query.filter(ChatMessage.id < before_id)
             
-        return query.order_by(ChatMessage.created_at.desc())\
-            .limit(limit)\
-            .all() 
\ No newline at end of file
+        return await run_db(
+            query.order_by(ChatMessage.created_at.desc())
+            .limit(limit)
+            .all
+        )
@@ -0,0 +1,175 @@
+from typing import Dict, Iterator, List, Optional
+import re
+
+# Words in pieces of up to four characters, and single punctuation marks:
+# close to BPE token counts for English text at a fraction of the cost
+TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+# Element types that open a new section
+SECTION_TYPES = {"Title", "Header"}
+# Element types that may be split between chunks at sentence boundaries
+PROSE_TYPES = {"NarrativeText", "Text", "UncategorizedText"}
+# Element types kept in a chunk of their own
+STANDALONE_TYPES = {"Table"}
+
+def estimate_tokens(text: str) -> int:
+    """Approximate model token count of a text"""
+    return len(TOKEN_PATTERN.findall(text))
+
+def split_sentences(text: str, max_tokens: int) -> List[str]:
+    """Split text into sentences, breaking any longer than max_tokens at word boundaries"""
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        current: List[str] = []
+        current_tokens = 0
+        words = []
+        for word in sentence.split():
+            # Token-dense runs without spaces (hashes, base64) are cut blindly
+            step = 4 * max_tokens
+            words.extend(word[i:i + step] for i in range(0, len(word), step))
+        for word in words:
+            tokens = estimate_tokens(word)
+            if current and current_tokens + tokens > max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += tokens
+        if current:
+            pieces.append(" ".join(current))
+    return pieces
+
+def tail_text(text: str, max_tokens: int) -> str:
+    """The longest run of whole words ending the text within max_tokens"""
+    words = text.split()
+    kept: List[str] = []
+    tokens = 0
+    for word in reversed(words):
+        tokens += estimate_tokens(word)
+        if tokens > max_tokens:
+            break
+        kept.append(word)
+    return " ".join(reversed(kept))
+
+class Chunker:
+    """Packs cleaned document elements into token-budgeted chunks as they stream in.
+
+    Chunks never cross a section (a Title starts a new one) and tables are
+    kept in chunks of their own. Prose may be split at sentence boundaries
+    to fill a chunk; other elements, such as list items, are only split
+    when one alone exceeds the budget. Consecutive chunks of a section
+    share up to overlap_tokens of text. Each chunk records the pages it
+    spans and the ids of the elements it was built from.
+    """
+
+    def __init__(self, max_tokens: int = 300, overlap_tokens: int = 40):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.chunk_index = 0
+        self.section: Optional[str] = None
+        # Pieces of element text in the chunk being built
+        self.units: List[Dict] = []
+        self.tokens = 0
+        # Leading units carried over from the previous chunk
+        self.overlap_units = 0
+
+    def _unit(self, text: str, element: Dict) -> Dict:
+        metadata = element["metadata"]
+        return {
+            "text": text,
+            "tokens": estimate_tokens(text),
+            "page_number": metadata.get("page_number"),
+            "element_id": metadata.get("element_id"),
+            "strategy": metadata.get("strategy")
+        }
+
+    def _emit(self, overlap: bool) -> Optional[Dict]:
+        if len(self.units) <= self.overlap_units:
+            # Nothing new since the last chunk
+            self.units, self.tokens, self.overlap_units = [], 0, 0
+            return None
+
+        units = self.units
+        pages = [unit["page_number"] for unit in units if unit["page_number"]]
+        element_ids = list(dict.fromkeys(unit["element_id"] for unit in units if unit["element_id"]))
+        chunk = {
+            "content": "\n".join(unit["text"] for unit in units),
+            "metadata": {
+                "chunk_index": self.chunk_index,
+                "page_number": pages[0] if pages else None,
+                "page_start": min(pages) if pages else None,
+                "page_end": max(pages) if pages else None,
+                "element_ids": element_ids,
+                "section": self.section,
+                "token_count": self.tokens,
+                "strategies": sorted({unit["strategy"] for unit in units if unit["strategy"]})
+            }
+        }
+        self.chunk_index += 1
+
+        carried: List[Dict] = []
+        if overlap and self.overlap_tokens:
+            budget = self.overlap_tokens
+            for unit in reversed(units):
+                if unit["tokens"] <= budget:
+                    carried.insert(0, unit)
+                    budget -= unit["tokens"]
+                    continue
+                tail = tail_text(unit["text"], budget) if not carried else ""
+                if tail:
+                    # Carry the end of a long unit instead of nothing
+                    carried.insert(0, dict(unit, text=tail, tokens=estimate_tokens(tail)))
+                break
+        self.units = carried
+        self.tokens = sum(unit["tokens"] for unit in carried)
+        self.overlap_units = len(carried)
+        return chunk
+
+    def add(self, elements: List[Dict]) -> Iterator[Dict]:
+        """Yield every chunk the new elements complete"""
+        for element in elements:
+            text = element["text"].strip()
+            # Skip empty or irrelevant elements
+            if not text:
+                continue
+            element_type = element.get("type")
+
+            if element_type in SECTION_TYPES or element_type in STANDALONE_TYPES:
+                chunk = self._emit(overlap=False)
+                if chunk:
+                    yield chunk
+            if element_type in SECTION_TYPES:
+                self.section = text
+
+            # Elements that fit stay whole; longer ones, and prose that would
+            # leave the current chunk underfilled, are packed sentence by sentence
+            tokens = estimate_tokens(text)
+            limit = self.max_tokens - self.overlap_tokens
+            if tokens <= self.max_tokens - self.tokens \
+                    or (tokens <= limit and element_type not in PROSE_TYPES):
+                pieces = [text]
+            else:
+                pieces = split_sentences(text, limit)
+
+            for piece in pieces:
+                unit = self._unit(piece, element)
+                if self.units and self.tokens + unit["tokens"] > self.max_tokens:
+                    chunk = self._emit(overlap=element_type not in STANDALONE_TYPES)
+                    if chunk:
+                        yield chunk
+                self.units.append(unit)
+                self.tokens += unit["tokens"]
+
+            if element_type in STANDALONE_TYPES:
+                chunk = self._emit(overlap=False)
+                if chunk:
+                    yield chunk
+
+    def flush(self) -> Iterator[Dict]:
+        """Yield the last, partly filled chunk"""
+        chunk = self._emit(overlap=False)
+        if chunk:
+            yield chunk
@@ -0,0 +1,93 @@
+from app.services.bm25 import tokenize
+from app.services.chunker import estimate_tokens
+from app.services.embedding_store import normalize_rows
+from typing import Dict, List, Optional
+import numpy as np
+
+def _position(chunk: Dict, documents: Dict[Optional[str], int]) -> tuple:
+    """Sort key placing computed results first, then each document's chunks in reading order.
+
+    documents ranks the chunk sets, so pages of different documents never
+    interleave.
+    """
+    metadata = chunk.get("metadata") or {}
+    if metadata.get("chunk_index") is None:
+        return (0, 0, 0, 0)
+    page = metadata.get("page_start") or metadata.get("page_number") or 0
+    return (1, documents[chunk.get("chunk_set")], page, metadata["chunk_index"])
+
+class ContextBuilder:
+    """Chooses and orders the retrieved chunks that go into a prompt.
+
+    Candidates (best first) are picked by maximal marginal relevance, so
+    each addition is relevant but unlike what is already chosen, and near
+    duplicates are dropped outright. Picks stop at a token budget and are
+    returned in reading order, grouped by document with the document of
+    the best pick first. Similarity uses the candidates' embeddings
+    when every candidate has one, and word overlap otherwise.
+    """
+
+    def __init__(self, max_tokens: int, mmr_lambda: float = 0.7, duplicate_threshold: float = 0.9):
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+
+    def _similarities(self, candidates: List[Dict], query_embedding: Optional[List[float]]) -> tuple:
+        """Relevance of each candidate and their pairwise similarity matrix"""
+        count = len(candidates)
+        # Without a query embedding, relevance follows the retriever's ranking
+        relevance = 1.0 - np.arange(count, dtype=np.float32) / count
+
+        if all(candidate.get("embedding") is not None for candidate in candidates):
+            matrix = normalize_rows(np.asarray([c["embedding"] for c in candidates], dtype=np.float32))
+            if query_embedding is not None:
+                relevance = matrix @ normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+            return relevance, matrix @ matrix.T
+
+        token_sets = [set(tokenize(candidate["content"])) for candidate in candidates]
+        similarity = np.eye(count, dtype=np.float32)
+        for i in range(count):
+            for j in range(i + 1, count):
+                union = len(token_sets[i] | token_sets[j])
+                if union:
+                    similarity[i, j] = similarity[j, i] = len(token_sets[i] & token_sets[j]) / union
+        return relevance, similarity
+
+    def select(self, candidates: List[Dict], query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Chosen chunks in reading order, without their embeddings"""
+        if not candidates:
+            return []
+        relevance, similarity = self._similarities(candidates, query_embedding)
+
+        # Later (lower ranked) near-duplicates of a candidate never compete
+        remaining = []
+        for i in range(len(candidates)):
+            if all(similarity[i, j] < self.duplicate_threshold for j in remaining):
+                remaining.append(i)
+
+        chosen: List[int] = []
+        budget = self.max_tokens
+        while remaining and budget > 0:
+            if chosen:
+                redundancy = similarity[np.ix_(remaining, chosen)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = remaining.pop(int(np.argmax(scores)))
+            tokens = estimate_tokens(candidates[best]["content"])
+            if tokens <= budget or not chosen:
+                # The best candidate always goes in, even if over budget alone
+                chosen.append(best)
+                budget -= tokens
+
+        selected = [
+            {key: value for key, value in candidates[i].items() if key != "embedding"}
+            for i in chosen
+        ]
+        documents: Dict[Optional[str], int] = {}
+        for chunk in selected:
+            documents.setdefault(chunk.get("chunk_set"), len(documents))
+        return sorted(selected, key=lambda chunk: _position(chunk, documents))
+
+    def format(self, chunks: List[Dict]) -> str:
+        return "\n\n".join(chunk["content"] for chunk in chunks)
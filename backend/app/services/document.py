@@ -1,11 +1,27 @@
 from sqlalchemy.orm import Session
-from app.models.document import Document, DocumentStatus
+from app.models.document import Document, DocumentChunk, DocumentStatus
+from app.models.content_blob import ContentBlob, ContentBlobStatus
 from app.services.s3 import S3Service
+from app.services.rag import delete_document_index
+from app.services.vector_store import VectorStore
+from app.services.ann_index import AnnIndexManager
+from app.core.config import settings
+from app.core.executors import run_db, run_io
 from fastapi import UploadFile, HTTPException
+from sqlalchemy.exc import IntegrityError
 from uuid import UUID, uuid4
 from datetime import datetime
+from typing import AsyncIterator, Dict, Optional, Tuple
 import os
 
+async def iter_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    """Read an UploadFile in S3-part-sized pieces"""
+    while True:
+        data = await file.read(settings.S3_MULTIPART_PART_SIZE)
+        if not data:
+            break
+        yield data
+
 class DocumentService:
     def __init__(self, db: Session):
         self.db = db
@@ -18,55 +34,245 @@ class DocumentService:
         file: UploadFile
     ) -> Document:
         """Create a new document record and upload file to S3"""
+        return await self.create_document_from_stream(
+            user_id=user_id,
+            title=title,
+            filename=file.filename,
+            content_type=file.content_type,
+            stream=iter_upload_file(file)
+        )
+
+    async def create_document_from_stream(
+        self,
+        user_id: UUID,
+        title: str,
+        filename: str,
+        content_type: Optional[str],
+        stream: AsyncIterator[bytes]
+    ) -> Document:
+        """Create a new document record, streaming its bytes to S3"""
         
         # Create document record
         document = Document(
             id=uuid4(),
             title=title,
             user_id=user_id,
-            status=DocumentStatus.PROCESSING,
+            status=DocumentStatus.QUEUED,
+            content_type=content_type,
             created_at=datetime.utcnow()
         )
         
         try:
             # Get original file extension
-            _, file_extension = os.path.splitext(file.filename)
+            _, file_extension = os.path.splitext(filename or "")
             
             # Create a unique file name
             file_key = f"documents/{document.id}/document{file_extension}"
             
-            # Upload to S3
-            file_url = await self.s3.upload_file(
-                file_data=file.file,
-                file_name=file_key
+            # Upload to S3, hashing and enforcing the size limit on the way
+            upload = await self.s3.upload_stream(
+                stream,
+                file_name=file_key,
+                content_type=content_type,
+                max_size=settings.MAX_UPLOAD_SIZE
             )
             
-            # Update document with file URL and status
-            document.file_url = file_url
-            document.status = DocumentStatus.READY
+            # Update document with file details; ingestion workers take it from here
+            document.content_hash = upload["sha256"]
+            document.file_size = upload["size"]
             
-            # Save to database
-            self.db.add(document)
-            self.db.commit()
-            self.db.refresh(document)
+            # Save to database, referencing the stored copy of this content
+            try:
+                file_url = await run_db(self._save_document, document, upload["url"])
+            except Exception:
+                # Nothing references the uploaded object yet
+                await self.s3.delete_file(file_key)
+                raise
+            if file_url != upload["url"]:
+                # Same bytes were uploaded before: keep only the original copy
+                await self.s3.delete_file(file_key)
             
             return document
             
         except Exception as e:
             self.db.rollback()
-            # Optionally update status to failed
-            if document.id:
-                document.status = DocumentStatus.FAILED
-                document.error_message = str(e)
-                self.db.commit()
             raise e
 
+    def _lock_blob(self, content_hash: Optional[str]) -> Optional[ContentBlob]:
+        if not content_hash:
+            return None
+        return self.db.query(ContentBlob)\
+            .filter(ContentBlob.content_hash == content_hash)\
+            .with_for_update()\
+            .first()
+
+    def _reference_blob(self, document: Document, file_url: str) -> ContentBlob:
+        """Take a reference on the blob for a document's content, creating it if new"""
+        blob = self._lock_blob(document.content_hash)
+        if blob is None:
+            blob = ContentBlob(
+                content_hash=document.content_hash,
+                file_url=file_url,
+                file_size=document.file_size,
+                content_type=document.content_type,
+                ref_count=0,
+                status=ContentBlobStatus.PENDING
+            )
+            self.db.add(blob)
+        blob.ref_count += 1
+        document.file_url = blob.file_url
+        return blob
+
+    def _save_document(self, document: Document, file_url: str) -> str:
+        """Insert a document, taking a reference on its content blob.
+
+        Returns the URL of the blob's file, which is the one just uploaded
+        only if this content is new.
+        """
+        for attempt in range(2):
+            try:
+                self._reference_blob(document, file_url)
+                self.db.add(document)
+                self.db.commit()
+                self.db.refresh(document)
+                return document.file_url
+            except IntegrityError:
+                # A concurrent upload of the same content created the blob first
+                self.db.rollback()
+                if attempt:
+                    raise
+
+    def _replace_content(self, document: Document, upload: Dict, content_type: Optional[str]) -> Tuple[str, bool]:
+        """Point a document at new content, moving its blob reference.
+
+        The old blob row is deleted once unreferenced, but its chunk rows are
+        left for the ingestion job, which reuses their embeddings. Returns the
+        new blob's file URL and whether the old content is now unreferenced.
+        """
+        old_hash = document.content_hash
+        for attempt in range(2):
+            try:
+                old_blob = self._lock_blob(old_hash)
+                document.content_hash = upload["sha256"]
+                document.file_size = upload["size"]
+                document.content_type = content_type
+                self._reference_blob(document, upload["url"])
+                freed = True
+                if old_blob is not None:
+                    old_blob.ref_count -= 1
+                    freed = old_blob.ref_count <= 0
+                    if freed:
+                        self.db.delete(old_blob)
+                self.db.commit()
+                self.db.refresh(document)
+                return document.file_url, freed
+            except IntegrityError:
+                self.db.rollback()
+                if attempt:
+                    raise
+
+    def _release_document(self, document: Document) -> Tuple[bool, bool]:
+        """Delete a document row and drop its reference on its content.
+
+        Returns whether the content is now unreferenced (its chunk rows are
+        deleted in the same transaction) and whether the owner still has
+        another document with the same content.
+        """
+        try:
+            blob = self._lock_blob(document.content_hash)
+            owner_references = self.db.query(Document)\
+                .filter(
+                    Document.user_id == document.user_id,
+                    Document.content_hash == document.content_hash,
+                    Document.id != document.id
+                )\
+                .count() if blob is not None else 0
+
+            chunk_set = document.chunk_set
+            self.db.delete(document)
+            freed = True
+            if blob is not None:
+                blob.ref_count -= 1
+                freed = blob.ref_count <= 0
+                if freed:
+                    self.db.delete(blob)
+            if freed:
+                self.db.query(DocumentChunk)\
+                    .filter(DocumentChunk.chunk_set == chunk_set)\
+                    .delete()
+            self.db.commit()
+            return freed, owner_references > 0
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def update_document(
+        self,
+        document_id: UUID,
+        user_id: UUID,
+        file: UploadFile
+    ) -> Tuple[Document, Optional[str]]:
+        """Replace a document's file with a new version"""
+        return await self.update_document_from_stream(
+            document_id=document_id,
+            user_id=user_id,
+            filename=file.filename,
+            content_type=file.content_type,
+            stream=iter_upload_file(file)
+        )
+
+    async def update_document_from_stream(
+        self,
+        document_id: UUID,
+        user_id: UUID,
+        filename: str,
+        content_type: Optional[str],
+        stream: AsyncIterator[bytes]
+    ) -> Tuple[Document, Optional[str]]:
+        """Replace a document's file with a new version streamed to S3.
+
+        Returns the document and the chunk set of the replaced version, or
+        None if the new file is identical and nothing needs reprocessing.
+        """
+        document = await self.get_document(document_id, user_id)
+        previous_chunk_set = document.chunk_set
+        previous_file_url = document.file_url
+
+        _, file_extension = os.path.splitext(filename or "")
+        # A new key, so the current version stays readable until replaced
+        file_key = f"documents/{document.id}/{uuid4().hex}{file_extension}"
+        upload = await self.s3.upload_stream(
+            stream,
+            file_name=file_key,
+            content_type=content_type,
+            max_size=settings.MAX_UPLOAD_SIZE
+        )
+
+        if upload["sha256"] == document.content_hash:
+            await self.s3.delete_file(file_key)
+            return document, None
+
+        try:
+            file_url, previous_freed = await run_db(self._replace_content, document, upload, content_type)
+        except Exception:
+            await self.s3.delete_file(file_key)
+            raise
+        if file_url != upload["url"]:
+            # Same bytes were uploaded before: keep only the original copy
+            await self.s3.delete_file(file_key)
+        if previous_freed and previous_file_url:
+            await self.s3.delete_file(self.s3.get_file_key(previous_file_url))
+
+        return document, previous_chunk_set
+
     async def get_document(self, document_id: UUID, user_id: UUID) -> Document:
         """Get a document by ID and verify ownership"""
-        document = self.db.query(Document).filter(
-            Document.id == document_id,
-            Document.user_id == user_id
-        ).first()
+        document = await run_db(
+            self.db.query(Document).filter(
+                Document.id == document_id,
+                Document.user_id == user_id
+            ).first
+        )
         
         if not document:
             raise HTTPException(
@@ -81,10 +287,12 @@ class DocumentService:
         # Add some debug logging
         print(f"Checking status for document {document_id} by user {user_id}")
         
-        document = self.db.query(Document).filter(
-            Document.id == document_id,
-            Document.user_id == user_id
-        ).first()
+        document = await run_db(
+            self.db.query(Document).filter(
+                Document.id == document_id,
+                Document.user_id == user_id
+            ).first
+        )
         
         if not document:
             raise HTTPException(
@@ -95,6 +303,8 @@ class DocumentService:
         return {
             "id": str(document.id),
             "status": document.status,
+            "progress": document.progress,
+            "error_message": document.error_message,
             "created_at": document.created_at,
             "file_url": document.file_url,
             "title": document.title
@@ -102,9 +312,11 @@ class DocumentService:
 
     async def list_documents(self, user_id: UUID, skip: int = 0, limit: int = 10) -> list[Document]:
         """List all documents for a user"""
-        documents = self.db.query(Document).filter(
-            Document.user_id == user_id
-        ).offset(skip).limit(limit).all()
+        documents = await run_db(
+            self.db.query(Document).filter(
+                Document.user_id == user_id
+            ).offset(skip).limit(limit).all
+        )
         
         return documents
 
@@ -113,14 +325,24 @@ class DocumentService:
         document = await self.get_document(document_id, user_id)
         
         try:
-            # Delete from S3 if file exists
-            if document.file_url:
-                file_key = document.file_url.split(f"{self.s3.bucket_name}.s3.amazonaws.com/")[1]
-                await self.s3.delete_file(file_key)
-            
-            # Delete from database
-            self.db.delete(document)
-            self.db.commit()
+            chunk_set = document.chunk_set
+            file_url = document.file_url
+            shard_key = AnnIndexManager.shard_key(document.id, document.user_id)
+
+            # Drop any persisted indexes for this document
+            await run_io(delete_document_index, document.id)
+
+            # Delete from database; shared content survives while referenced
+            freed, owner_still_references = await run_db(self._release_document, document)
+
+            vector_store = VectorStore(self.db)
+            if freed:
+                # Delete from S3 if file exists
+                if file_url:
+                    await self.s3.delete_file(self.s3.get_file_key(file_url))
+                await vector_store.delete_chunk_set(chunk_set, [shard_key])
+            elif not owner_still_references:
+                await vector_store.unlink_chunk_set(chunk_set, [shard_key])
             return True
             
         except Exception as e:
@@ -4,146 +4,430 @@ from unstructured.partition.pptx import partition_pptx
 from unstructured.partition.xlsx import partition_xlsx
 from unstructured.staging.base import elements_to_json
 from unstructured.cleaners.core import clean_extra_whitespace
-from app.services.vector_store import VectorStore
+from app.services.vector_store import ChunkSetWriter, VectorStore
 from app.services.s3 import S3Service
-from app.models.document import Document
+from app.services.chunker import Chunker
+from app.services.tables import TABULAR_CONTENT_TYPES, TableService
+from app.services.cache import get_answer_cache
+from app.models.document import Document, DocumentStatus
+from app.models.content_blob import ContentBlob, ContentBlobStatus
+from app.services.ingestion_queue import IngestionDeferred
+from app.core.config import settings
+from app.core.executors import cpu_executor, run_cpu, run_db
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
 import tempfile
+import shutil
 import os
 import logging
-from typing import List, Dict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from PyPDF2 import PdfReader, PdfWriter
 import asyncio
-from fastapi import BackgroundTasks
+from collections import deque
+from itertools import groupby
 from uuid import UUID
 
 logger = logging.getLogger(__name__)
 
+PDF_CONTENT_TYPE = "application/pdf"
+
+# unstructured partition strategies: read the embedded text layer, or OCR the rendered page
+FAST_STRATEGY = "fast"
+OCR_STRATEGY = "ocr_only"
+
+# Non-PDF files are partitioned whole, then fed downstream this many elements at a time
+ELEMENT_WINDOW = 500
+
+def pdf_page_strategies(reader: PdfReader) -> List[str]:
+    """Pick the partition strategy for each page of a PDF.
+
+    Pages with an extractable text layer (born-digital pages, or scans that
+    were already OCR'd) are read directly; only pages whose content is
+    images alone need OCR.
+    """
+    strategies = []
+    for page in reader.pages:
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        if len(text.strip()) >= settings.PDF_TEXT_LAYER_MIN_CHARS:
+            strategies.append(FAST_STRATEGY)
+            continue
+        try:
+            # Usually an indirect reference, which must be resolved to be searched
+            resources = page.get("/Resources")
+            has_images = "/XObject" in (resources.get_object() if resources is not None else {})
+        except Exception:
+            # Unreadable resources: OCR rather than risk losing the page's content
+            has_images = True
+        # A page with neither text nor images is blank; there is nothing to OCR
+        strategies.append(OCR_STRATEGY if has_images else FAST_STRATEGY)
+    return strategies
+
+def partition_pdf_by_page(file_path: str) -> List[Tuple[object, str]]:
+    """Partition a PDF with a per-page strategy, returning (element, strategy) pairs.
+
+    Runs of consecutive pages sharing a strategy are partitioned together,
+    so a fully born-digital PDF is still a single fast partition_pdf call.
+    """
+    reader = PdfReader(file_path)
+    strategies = pdf_page_strategies(reader)
+    if len(set(strategies)) <= 1:
+        strategy = strategies[0] if strategies else FAST_STRATEGY
+        return [(element, strategy) for element in partition_pdf(file_path, strategy=strategy)]
+
+    results = []
+    first_page = 0
+    for strategy, run in groupby(strategies):
+        page_count = len(list(run))
+        writer = PdfWriter()
+        for page in reader.pages[first_page:first_page + page_count]:
+            writer.add_page(page)
+        fd, run_path = tempfile.mkstemp(suffix=".pdf", dir=os.path.dirname(file_path))
+        os.close(fd)
+        try:
+            with open(run_path, "wb") as f:
+                writer.write(f)
+            elements = partition_pdf(run_path, strategy=strategy)
+        finally:
+            os.unlink(run_path)
+        for element in elements:
+            if element.metadata.page_number:
+                element.metadata.page_number += first_page
+            results.append((element, strategy))
+        first_page += page_count
+    return results
+
+def partition_document(file_path: str, file_type: str, page_offset: int = 0) -> List[Dict]:
+    """Partition a file into cleaned, structured elements.
+
+    Module-level and returning plain dicts so it can run in a worker process.
+    page_offset is added to page numbers when the file holds a page range
+    split out of a larger PDF. PDF elements record the strategy their page
+    was partitioned with.
+    """
+    if file_type == PDF_CONTENT_TYPE:
+        elements = partition_pdf_by_page(file_path)
+    elif file_type in ["application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation"]:
+        elements = partition_pptx(file_path)
+    elif file_type in ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]:
+        elements = partition_xlsx(file_path)
+    else:
+        elements = partition(filename=file_path)
+    if file_type != PDF_CONTENT_TYPE:
+        elements = [(element, None) for element in elements]
+
+    # Clean and structure the elements
+    cleaned_elements = []
+    for element, strategy in elements:
+        # Clean the text
+        cleaned_text = clean_extra_whitespace(str(element))
+        coordinates = element.metadata.coordinates
+        page_number = element.metadata.page_number
+
+        # Create structured element
+        cleaned_element = {
+            "text": cleaned_text,
+            "type": element.category,
+            "metadata": {
+                "element_id": element.id,
+                "page_number": page_number + page_offset if page_number else None,
+                "coordinates": coordinates.to_dict() if coordinates else None,
+                "strategy": strategy
+            }
+        }
+        cleaned_elements.append(cleaned_element)
+
+    return cleaned_elements
+
+def split_pdf(file_path: str, pages_per_part: int, output_dir: str, min_pages: int = 0) -> List[Tuple[str, int]]:
+    """Write consecutive page ranges of a PDF to separate files.
+
+    Returns (path, page offset) pairs in page order, or none for PDFs
+    shorter than min_pages, which are cheaper to partition whole.
+    """
+    reader = PdfReader(file_path)
+    if len(reader.pages) < min_pages:
+        return []
+
+    parts = []
+    for start in range(0, len(reader.pages), pages_per_part):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + pages_per_part]:
+            writer.add_page(page)
+        path = os.path.join(output_dir, f"pages-{start + 1:06d}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        parts.append((path, start))
+    return parts
+
 class DocumentProcessor:
     def __init__(self, db: Session):
         self.db = db
         self.vector_store = VectorStore(db)
         self.s3_service = S3Service()
         
-    async def process_file_content(self, file_path: str, file_type: str) -> List[Dict]:
+    async def process_file_content(self, file_path: str, file_type: str, page_offset: int = 0) -> List[Dict]:
         """Process different file types and extract structured content"""
         try:
-            if file_type == "application/pdf":
-                elements = partition_pdf(file_path)
-            elif file_type in ["application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation"]:
-                elements = partition_pptx(file_path)
-            elif file_type in ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]:
-                elements = partition_xlsx(file_path)
-            else:
-                elements = partition(filename=file_path)
-
-            # Clean and structure the elements
-            cleaned_elements = []
-            for element in elements:
-                # Clean the text
-                cleaned_text = clean_extra_whitespace(str(element))
-                
-                # Create structured element
-                cleaned_element = {
-                    "text": cleaned_text,
-                    "type": element.category,
-                    "metadata": {
-                        "page_number": getattr(element, "page_number", None),
-                        "coordinates": getattr(element, "coordinates", None)
-                    }
-                }
-                cleaned_elements.append(cleaned_element)
-
-            return cleaned_elements
+            # Parsing is CPU bound, so it runs in the process pool
+            return await run_cpu(partition_document, file_path, file_type, page_offset)
 
         except Exception as e:
             logger.error(f"Error processing file content: {str(e)}")
             raise Exception(f"Failed to process document: {str(e)}")
 
-    async def prepare_chunks(self, elements: List[Dict]) -> List[str]:
-        """Prepare document chunks from processed elements"""
-        chunks = []
-        current_chunk = ""
-        
-        for element in elements:
-            # Skip empty or irrelevant elements
-            if not element["text"].strip():
-                continue
-                
-            # Add page number context if available
-            page_info = f" [Page {element['metadata']['page_number']}] " if element['metadata']['page_number'] else " "
-            
-            # Combine elements into chunks
-            if len(current_chunk) + len(element["text"]) < 1000:
-                current_chunk += element["text"] + page_info
-            else:
-                chunks.append(current_chunk)
-                current_chunk = element["text"] + page_info
-        
-        # Add the last chunk if not empty
-        if current_chunk:
-            chunks.append(current_chunk)
-            
-        return chunks
-
-    async def process_document(self, document_id: UUID) -> None:
-        """Main document processing function"""
+    async def iter_element_windows(
+        self,
+        file_path: str,
+        file_type: str,
+        work_dir: str
+    ) -> AsyncIterator[Tuple[List[Dict], float]]:
+        """Partition a file a window at a time.
+
+        PDFs of at least PDF_PARALLEL_MIN_PAGES pages are split into
+        INGESTION_PAGE_WINDOW page ranges, and up to PDF_PARSE_WORKERS of
+        them are partitioned at once in the process pool. Windows are
+        yielded in page order whichever finishes first, so chunking sees
+        the same element stream as a single-process parse. Yields
+        (elements, fraction of the file parsed so far).
+        """
+        parts = None
+        if file_type == PDF_CONTENT_TYPE:
+            try:
+                parts = await run_cpu(
+                    split_pdf,
+                    file_path,
+                    settings.INGESTION_PAGE_WINDOW,
+                    work_dir,
+                    settings.PDF_PARALLEL_MIN_PAGES
+                )
+            except Exception as e:
+                logger.warning(f"Could not split PDF, partitioning it whole: {e}")
+
+        if parts:
+            workers = settings.PDF_PARSE_WORKERS or cpu_executor.max_workers
+            logger.info(f"Partitioning {file_path} as {len(parts)} page ranges on up to {workers} processes")
+            remaining = iter(parts)
+            pending = deque()
+
+            def schedule_next() -> None:
+                part = next(remaining, None)
+                if part is not None:
+                    part_path, page_offset = part
+                    task = asyncio.ensure_future(self.process_file_content(part_path, file_type, page_offset))
+                    pending.append((part_path, task))
+
+            try:
+                for _ in range(workers):
+                    schedule_next()
+                done = 0
+                while pending:
+                    part_path, task = pending.popleft()
+                    elements = await task
+                    os.unlink(part_path)
+                    # Keep the pool busy while this window moves downstream
+                    schedule_next()
+                    done += 1
+                    yield elements, done / len(parts)
+            finally:
+                for _, task in pending:
+                    task.cancel()
+            return
+
+        elements = await self.process_file_content(file_path, file_type)
+        for start in range(0, len(elements), ELEMENT_WINDOW):
+            yield elements[start:start + ELEMENT_WINDOW], min(1.0, (start + ELEMENT_WINDOW) / len(elements))
+
+    async def _ingest(self, document: Document, file_path: str, writer: ChunkSetWriter, work_dir: str) -> None:
+        """Run partition -> chunk -> embed -> insert as concurrent stages.
+
+        Bounded queues between the stages apply backpressure: parsing runs at
+        most INGESTION_PIPELINE_DEPTH windows ahead of embedding, so memory
+        stays flat however long the file is, while one window is embedded
+        and stored as the next is parsed.
+        """
+        if document.content_type in TABULAR_CONTENT_TYPES and settings.TABLE_INGESTION_ENABLED:
+            # Spreadsheets are stored as tables; only their summaries are embedded
+            chunks = await TableService(self.db).ingest(document, file_path, work_dir)
+            batch_size = settings.EMBEDDING_BATCH_SIZE
+            for start in range(0, len(chunks), batch_size):
+                await writer.add(chunks[start:start + batch_size])
+                done = min(len(chunks), start + batch_size) / len(chunks)
+                await self._report(document, DocumentStatus.PROCESSING, 10 + int(80 * done))
+            return
+
+        windows: asyncio.Queue = asyncio.Queue(maxsize=settings.INGESTION_PIPELINE_DEPTH)
+        batches: asyncio.Queue = asyncio.Queue(maxsize=settings.INGESTION_PIPELINE_DEPTH)
+        parsed = 0.0
+        page_strategies: Dict[int, str] = {}
+
+        async def parse() -> None:
+            nonlocal parsed
+            async for elements, fraction in self.iter_element_windows(file_path, document.content_type, work_dir):
+                for element in elements:
+                    metadata = element["metadata"]
+                    if metadata.get("strategy") and metadata["page_number"]:
+                        page_strategies[metadata["page_number"]] = metadata["strategy"]
+                await windows.put(elements)
+                parsed = fraction
+            await windows.put(None)
+
+        async def chunk() -> None:
+            chunker = Chunker(settings.CHUNK_MAX_TOKENS, settings.CHUNK_OVERLAP_TOKENS)
+            batch = []
+            while (elements := await windows.get()) is not None:
+                for processed_chunk in chunker.add(elements):
+                    batch.append(processed_chunk)
+                    if len(batch) >= settings.EMBEDDING_BATCH_SIZE:
+                        await batches.put(batch)
+                        batch = []
+            batch.extend(chunker.flush())
+            if batch:
+                await batches.put(batch)
+            await batches.put(None)
+
+        async def store() -> None:
+            # The only stage touching the session, so DB work never overlaps
+            while (batch := await batches.get()) is not None:
+                await writer.add(batch)
+                await self._report(document, DocumentStatus.PROCESSING, 10 + int(80 * parsed))
+
+        stages = [asyncio.create_task(stage()) for stage in (parse, chunk, store)]
+        try:
+            await asyncio.gather(*stages)
+        except Exception:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise
+
+        if page_strategies:
+            ocr_pages = sorted(page for page, strategy in page_strategies.items() if strategy == OCR_STRATEGY)
+            logger.info(
+                f"Partitioned document {document.id}: {len(page_strategies) - len(ocr_pages)} pages from "
+                f"the text layer, {len(ocr_pages)} OCR'd{f' (pages {ocr_pages})' if ocr_pages else ''}"
+            )
+
+    def _claim_content(self, content_hash: str) -> str:
+        """Claim the chunking and embedding of shared content.
+
+        Returns "claimed" if this job should process it, or the blob's status
+        if another job already has (ready) or is doing so right now.
+        """
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT)
         try:
-            # Get document from database
-            document = self.db.query(Document).filter(Document.id == document_id).first()
-            if not document:
-                raise Exception("Document not found")
+            claimed = self.db.query(ContentBlob)\
+                .filter(
+                    ContentBlob.content_hash == content_hash,
+                    or_(
+                        ContentBlob.status.in_([ContentBlobStatus.PENDING, ContentBlobStatus.FAILED]),
+                        and_(
+                            ContentBlob.status == ContentBlobStatus.PROCESSING,
+                            ContentBlob.updated_at < stale
+                        )
+                    )
+                )\
+                .update(
+                    {ContentBlob.status: ContentBlobStatus.PROCESSING, ContentBlob.updated_at: now},
+                    synchronize_session=False
+                )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        if claimed:
+            return "claimed"
+        return self.db.query(ContentBlob.status)\
+            .filter(ContentBlob.content_hash == content_hash)\
+            .scalar()
 
-            # Update status to processing
-            document.status = "processing"
+    def _set_content_status(self, content_hash: str, status: str) -> None:
+        try:
+            self.db.query(ContentBlob)\
+                .filter(ContentBlob.content_hash == content_hash)\
+                .update({ContentBlob.status: status}, synchronize_session=False)
             self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def _report(self, document: Document, status: str, progress: int) -> None:
+        """Record ingestion status and percent complete on the document"""
+        document.status = status
+        document.progress = progress
+        await run_db(self.db.commit)
+
+    async def process_document(self, document_id: UUID, previous_chunk_set: Optional[str] = None) -> None:
+        """Main document processing function.
+
+        Runs inside an ingestion worker; failures propagate so the queue can
+        retry the job and decide the document's final status. When a new
+        version replaces previous_chunk_set, only its new or changed chunks
+        are embedded.
+        """
+        # Get document from database
+        document = await run_db(self.db.query(Document).filter(Document.id == document_id).first)
+        if not document:
+            raise Exception("Document not found")
+
+        await self._report(document, DocumentStatus.PROCESSING, 0)
+
+        # Answers drawn from the previous content are stale from here on
+        get_answer_cache().invalidate_document(document_id)
 
-            # Download file from S3 to temp location
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                await self.s3_service.download_file(document.file_path, temp_file.name)
-                
-                try:
-                    # Process the document
-                    elements = await self.process_file_content(temp_file.name, document.file_type)
-                    
-                    # Prepare chunks
-                    chunks = await self.prepare_chunks(elements)
-                    
-                    # Prepare chunks with metadata
-                    processed_chunks = []
-                    processed_metadata = []
-                    for idx, content in enumerate(chunks):
-                        processed_chunk = {
-                            "content": content,
-                            "metadata": {
-                                "chunk_index": idx,
-                                "document_id": str(document_id),
-                                "page_number": elements[idx]['metadata'].get("page_number"),
-                                # Add other relevant metadata
-                            }
-                        }
-                        processed_chunks.append(processed_chunk)
-                        processed_metadata.append(elements[idx]['metadata'])
-
-                    # Store chunks with embeddings
-                    await self.vector_store.store_document_chunks(document_id, processed_chunks)
-
-                    # Update document status
-                    document.status = "completed"
-                    self.db.commit()
-                    
-                except Exception as e:
-                    document.status = "failed"
-                    document.error_message = str(e)
-                    self.db.commit()
-                    raise e
-                    
-                finally:
-                    # Clean up temp file
-                    os.unlink(temp_file.name)
+        # Identical content is parsed and embedded once, by whichever job claims it
+        content_hash = document.content_hash
+        if content_hash:
+            claim = await run_db(self._claim_content, content_hash)
+            if claim == ContentBlobStatus.READY:
+                await self.vector_store.link_document(document_id)
+                if previous_chunk_set:
+                    await self.vector_store.retire_chunk_set(previous_chunk_set, document_id)
+                document.error_message = None
+                await self._report(document, DocumentStatus.READY, 100)
+                return
+            if claim != "claimed":
+                raise IngestionDeferred(
+                    "Another job is processing the same content",
+                    delay=settings.INGESTION_POLL_INTERVAL * 5
+                )
+
+        # Download file from S3 to a scratch directory, keeping the extension for type detection
+        _, extension = os.path.splitext(document.file_url or "")
+        work_dir = tempfile.mkdtemp(prefix="ingest-")
+        temp_path = os.path.join(work_dir, f"document{extension}")
+        try:
+            await self.s3_service.download_file(self.s3_service.get_file_key(document.file_url), temp_path)
+            await self._report(document, DocumentStatus.PROCESSING, 10)
+
+            # Chunks are staged as they are embedded and only swapped in once all are stored
+            writer = await self.vector_store.open_chunk_set(document_id, previous_chunk_set)
+            try:
+                await self._ingest(document, temp_path, writer, work_dir)
+                stats = await writer.commit()
+            except BaseException:
+                await writer.abort()
+                raise
+            logger.info(f"Stored document {document_id}: {stats}")
+
+            # Update document status
+            if content_hash:
+                await run_db(self._set_content_status, content_hash, ContentBlobStatus.READY)
+            document.error_message = None
+            await self._report(document, DocumentStatus.READY, 100)
 
         except Exception as e:
             logger.error(f"Error processing document {document_id}: {str(e)}")
-            document.status = "failed"
-            document.error_message = str(e)
-            self.db.commit()
-            raise e
\ No newline at end of file
+            await run_db(self.db.rollback)
+            if content_hash:
+                # Let the next job with this content claim it
+                await run_db(self._set_content_status, content_hash, ContentBlobStatus.FAILED)
+            raise
+
+        finally:
+            # Clean up the download and any page windows split from it
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,278 @@
+from app.core.config import settings
+import numpy as np
+import shutil
+import glob
+import json
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+logger = logging.getLogger(__name__)
+
+# Marks a document's version directories, <document>.v-<id>
+VERSION_SUFFIX = ".v-"
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores along the last axis, best first"""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), scores.shape[:-1] + (k,))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
+
+class MatrixWriter:
+    """Writes a float32 .npy matrix with a known number of rows a batch at a time.
+
+    The file is memory-mapped, so rows already written are not held in
+    memory; the width is taken from the first batch.
+    """
+
+    def __init__(self, path: str, rows: int):
+        self.path = path
+        self.rows = rows
+        self.written = 0
+        self.matrix = None
+
+    def write(self, vectors: np.ndarray) -> None:
+        if self.written + len(vectors) > self.rows:
+            raise ValueError(f"More than the expected {self.rows} rows written to {self.path}")
+        if self.matrix is None:
+            self.matrix = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=np.float32, shape=(self.rows, vectors.shape[1])
+            )
+        self.matrix[self.written:self.written + len(vectors)] = vectors
+        self.written += len(vectors)
+
+    def close(self) -> None:
+        if self.written != self.rows:
+            raise ValueError(f"Expected {self.rows} rows in {self.path}, got {self.written}")
+        if self.matrix is None:
+            np.save(self.path, np.empty((0, 0), dtype=np.float32))
+        else:
+            self.matrix.flush()
+            self.matrix = None
+
+class _MappedIndex:
+    """Read-only, memory-mapped view of one document's chunk index"""
+
+    def __init__(self, path: str):
+        # mmap_mode="r" maps the files instead of reading them, so every worker
+        # process searching the same document shares one copy in the page cache
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.content = np.memmap(os.path.join(path, "content.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+        with open(os.path.join(path, "chunks.json")) as f:
+            self.chunks = json.load(f)
+
+    def get_content(self, row: int) -> str:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.content[start:end].tobytes().decode("utf-8")
+
+class EmbeddingStore:
+    """Local, file-backed store of per-document chunk embeddings.
+
+    Each document is a directory with a flat float32 embeddings.npy matrix
+    (rows pre-normalized), the chunk texts concatenated in content.bin with
+    their byte offsets in offsets.npy, and a small chunks.json sidecar holding
+    chunk ids, indexes and metadata. Every write goes to a new version
+    directory, <document>.v-<id>, and <document> is a symlink swapped to
+    the finished version, so readers see the old or the new index and
+    never a missing one.
+    """
+
+    # Open indexes, least recently searched first; evicted ones are unmapped
+    # once no search holds them
+    _cache: "OrderedDict[str, Tuple[str, _MappedIndex]]" = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(settings.VECTOR_INDEX_DIR, "chunks")
+
+    def _path(self, document_id: UUID) -> str:
+        return os.path.join(self.root, str(document_id))
+
+    def has_document(self, document_id: UUID) -> bool:
+        return os.path.isfile(os.path.join(self._path(document_id), "chunks.json"))
+
+    def open_document(self, document_id: UUID, count: int) -> "DocumentWriter":
+        """Start writing (or replacing) the index for a document of count chunks"""
+        return DocumentWriter(self._path(document_id), count)
+
+    def write_document(
+        self,
+        document_id: UUID,
+        chunks: List[Dict],
+        embeddings: List[List[float]]
+    ) -> None:
+        """Write (or replace) the index for a document.
+
+        Each chunk dict needs "id", "chunk_index", "content" and "metadata".
+        """
+        writer = self.open_document(document_id, len(chunks))
+        try:
+            writer.write(chunks, embeddings)
+            writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+    def delete_document(self, document_id: UUID) -> None:
+        path = self._path(document_id)
+        if os.path.islink(path):
+            os.unlink(path)
+        else:
+            # Written before indexes were versioned
+            shutil.rmtree(path, ignore_errors=True)
+        for version in glob.glob(glob.escape(path) + VERSION_SUFFIX + "*"):
+            shutil.rmtree(version, ignore_errors=True)
+        with self._cache_lock:
+            self._cache.pop(path, None)
+
+    def _open(self, document_id: UUID) -> Optional[_MappedIndex]:
+        """The document's index, or None if it was deleted while being opened"""
+        path = self._path(document_id)
+        # A rewrite points the link at a new version directory
+        version = os.path.realpath(path)
+        with self._cache_lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == version:
+                self._cache.move_to_end(path)
+                return cached[1]
+        try:
+            index = _MappedIndex(version)
+        except FileNotFoundError:
+            # Replaced and cleaned up between resolving the link and reading it
+            return None
+        with self._cache_lock:
+            self._cache[path] = (version, index)
+            self._cache.move_to_end(path)
+            while len(self._cache) > max(settings.VECTOR_INDEX_CACHE_DOCUMENTS, 1):
+                self._cache.popitem(last=False)
+        return index
+
+    def similarity_search(
+        self,
+        query_embedding: List[float],
+        document_ids: List[UUID],
+        limit: int = 3,
+        similarity_threshold: float = 0.7,
+        include_embeddings: bool = False
+    ) -> Optional[List[Dict]]:
+        """Cosine search over the given documents.
+
+        Returns None when any of the documents has no local index, so callers
+        can fall back to the database.
+        """
+        if not all(self.has_document(document_id) for document_id in document_ids):
+            return None
+
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+
+        candidates = []
+        for document_id in document_ids:
+            index = self._open(document_id)
+            if index is None:
+                return None
+            if not index.chunks:
+                continue
+            scores = index.embeddings @ query
+            for row in top_k_indices(scores, limit):
+                if scores[row] > similarity_threshold:
+                    candidates.append((float(scores[row]), document_id, index, int(row)))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        matches = []
+        for score, document_id, index, row in candidates[:limit]:
+            match = {
+                "document_id": str(document_id),
+                "content": index.get_content(row),
+                "metadata": index.chunks[row]["metadata"],
+                "score": score
+            }
+            if include_embeddings:
+                match["embedding"] = index.embeddings[row]
+            matches.append(match)
+        return matches
+
+class DocumentWriter:
+    """Writes one document's index a batch of chunks at a time.
+
+    Batches go straight to files in a new version directory, so memory use
+    does not grow with the document; commit() points the document's link
+    at it.
+    """
+
+    def __init__(self, path: str, count: int):
+        self.path = path
+        self.tmp_path = f"{path}{VERSION_SUFFIX}{uuid4().hex}"
+        os.makedirs(self.tmp_path, exist_ok=True)
+        self.embeddings = MatrixWriter(os.path.join(self.tmp_path, "embeddings.npy"), count)
+        self.offsets = np.zeros(count + 1, dtype=np.int64)
+        self.written = 0
+        self.content = open(os.path.join(self.tmp_path, "content.bin"), "wb")
+        self.sidecar = open(os.path.join(self.tmp_path, "chunks.json"), "w")
+        self.sidecar.write("[")
+
+    def write(self, chunks: List[Dict], embeddings: List[List[float]]) -> None:
+        """Append chunks (dicts as for EmbeddingStore.write_document) and their embeddings"""
+        if not chunks:
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1)
+        self.embeddings.write(normalize_rows(matrix))
+        for chunk in chunks:
+            data = chunk["content"].encode("utf-8")
+            self.content.write(data)
+            self.offsets[self.written + 1] = self.offsets[self.written] + len(data)
+            if self.written:
+                self.sidecar.write(",")
+            json.dump(
+                {
+                    "id": str(chunk["id"]),
+                    "chunk_index": chunk.get("chunk_index"),
+                    "metadata": chunk.get("metadata") or {}
+                },
+                self.sidecar
+            )
+            self.written += 1
+
+    def commit(self) -> None:
+        self.embeddings.close()
+        self.content.close()
+        self.sidecar.write("]")
+        self.sidecar.close()
+        np.save(os.path.join(self.tmp_path, "offsets.npy"), self.offsets)
+
+        previous = None
+        if os.path.islink(self.path):
+            previous = os.path.join(os.path.dirname(self.path), os.readlink(self.path))
+        else:
+            # Written before indexes were versioned; cannot be swapped atomically
+            shutil.rmtree(self.path, ignore_errors=True)
+
+        # Renaming a link over another is atomic, so readers resolve either
+        # version in full; open readers keep their mappings of the old one
+        link = f"{self.path}.link-{uuid4().hex}"
+        os.symlink(os.path.basename(self.tmp_path), link)
+        os.replace(link, self.path)
+        if previous is not None and previous != self.tmp_path:
+            shutil.rmtree(previous, ignore_errors=True)
+
+    def abort(self) -> None:
+        self.content.close()
+        self.sidecar.close()
+        self.embeddings.matrix = None
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
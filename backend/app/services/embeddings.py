@@ -0,0 +1,227 @@
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from app.core.config import settings
+from app.services.cache import EmbeddingCache, get_embedding_cache
+from functools import lru_cache
+import numpy as np
+import asyncio
+import hashlib
+import logging
+import random
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class LocalHashEmbeddings(Embeddings):
+    """Deterministic, offline embeddings from hashed word features.
+
+    Not semantically meaningful, but stable across runs and processes, which
+    makes it a stand-in provider for tests and local development.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimension
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+class CachedEmbeddings(Embeddings):
+    """Wraps a provider so repeated texts are served from the EmbeddingCache.
+
+    Document and query embeddings are keyed separately because providers
+    may embed them with different task types.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.make_key(self.model, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it repeats within the call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self.cache.put_many(computed)
+            vectors.update(computed)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.cache.make_key(f"{self.model}:query", text)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            return cached[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
+
+@lru_cache()
+def get_embeddings() -> Embeddings:
+    """The process-wide embedding provider selected by EMBEDDING_PROVIDER"""
+    if settings.EMBEDDING_PROVIDER == "local":
+        embeddings = LocalHashEmbeddings(settings.EMBEDDING_DIMENSION)
+    else:
+        embeddings = GoogleGenerativeAIEmbeddings(
+            model=settings.EMBEDDING_MODEL,
+            google_api_key=settings.GOOGLE_API_KEY
+        )
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        model=f"{settings.EMBEDDING_PROVIDER}:{settings.EMBEDDING_MODEL}",
+        cache=get_embedding_cache()
+    )
+
+def is_throttling_error(error: Exception) -> bool:
+    """Whether an embedding API error means "slow down" rather than "failed\""""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable"):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in ("429", "503", "quota", "rate limit", "resource exhausted"))
+
+class EmbeddingScheduler:
+    """Coalesces embedding requests from concurrent callers into full batches.
+
+    Texts queued within a short window are grouped into batches of up to
+    batch_size, and at most max_concurrency batches run at once. The provider
+    is synchronous, so calls run in a worker thread to keep the event loop
+    free. Throttled calls are retried with exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = 100,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        retry_base_delay: float = 1.0,
+        batch_wait: float = 0.02
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.batch_wait = batch_wait
+        self.stats = {"batches": 0, "texts": 0, "queries": 0, "retries": 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self) -> None:
+        # asyncio primitives belong to one loop; rebuild them if the loop changed
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._pending: List[Tuple[str, asyncio.Future]] = []
+            self._flush_handle: Optional[asyncio.TimerHandle] = None
+            # The loop only keeps weak references to tasks; these keep batches alive
+            self._tasks: Set[asyncio.Task] = set()
+
+    async def _call_with_retry(self, func: Callable, *args):
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    return await asyncio.to_thread(func, *args)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_throttling_error(e):
+                    raise
+                delay = self.retry_base_delay * (2 ** attempt) * (0.5 + random.random())
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"Embedding call throttled, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await self._call_with_retry(self.embeddings.embed_documents, texts)
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, sharing batches with any other concurrent callers"""
+        if not texts:
+            return []
+        self._bind_loop()
+
+        futures = []
+        for text in texts:
+            future = self._loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+
+        if len(self._pending) >= self.batch_size:
+            # Send every full batch now; a partial tail waits briefly for company
+            full = len(self._pending) - len(self._pending) % self.batch_size
+            tail = self._pending[full:]
+            self._pending = self._pending[:full]
+            self._flush()
+            self._pending = tail
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.batch_wait, self._flush)
+
+        return list(await asyncio.gather(*futures))
+
+    async def embed_query(self, text: str) -> List[float]:
+        """Embed a search query (providers may use a query-specific task type)"""
+        self._bind_loop()
+        self.stats["queries"] += 1
+        return await self._call_with_retry(self.embeddings.embed_query, text)
+
+_schedulers: Dict[int, EmbeddingScheduler] = {}
+
+def get_embedding_scheduler(embeddings: Optional[Embeddings] = None) -> EmbeddingScheduler:
+    """The scheduler shared by every service in this process for a provider"""
+    embeddings = embeddings or get_embeddings()
+    scheduler = _schedulers.get(id(embeddings))
+    if scheduler is None:
+        scheduler = EmbeddingScheduler(
+            embeddings,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+            retry_base_delay=settings.EMBEDDING_RETRY_BASE_DELAY,
+            batch_wait=settings.EMBEDDING_BATCH_WAIT_MS / 1000
+        )
+        _schedulers[id(embeddings)] = scheduler
+    return scheduler
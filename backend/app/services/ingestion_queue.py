@@ -0,0 +1,273 @@
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.executors import run_db
+from app.models.content_blob import ContentBlob, ContentBlobStatus
+from app.models.document import Document, DocumentChunk, DocumentStatus
+from app.models.ingestion_job import IngestionJob, IngestionJobStatus
+from app.services.vector_store import STAGING_PREFIX, staging_document_id
+from sqlalchemy import func
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import UUID
+import logging
+
+logger = logging.getLogger(__name__)
+
+class IngestionDeferred(Exception):
+    """Raised by a job that cannot run yet; it is requeued without using up an attempt"""
+
+    def __init__(self, message: str, delay: float):
+        super().__init__(message)
+        self.delay = delay
+
+class IngestionQueue:
+    """Durable queue of document ingestion jobs kept in the ingestion_jobs table.
+
+    Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number
+    of worker processes can poll the table without handing out a job twice.
+    Failed jobs are retried with exponential backoff, and jobs left running
+    by a worker that died are put back on the queue after
+    INGESTION_JOB_TIMEOUT. Documents left queued without a job (the API
+    stopped between saving a document and queueing it) are adopted after
+    the same timeout, and chunks a dead worker staged but never committed
+    are deleted.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    async def enqueue(
+        self,
+        document_id: UUID,
+        priority: int = 0,
+        previous_chunk_set: Optional[str] = None
+    ) -> IngestionJob:
+        """Queue a document for (re)processing; higher priorities run first.
+
+        previous_chunk_set names the chunk set of a replaced version, whose
+        unchanged chunks are reused instead of re-embedded.
+        """
+        return await run_db(self._enqueue, document_id, priority, previous_chunk_set)
+
+    def _enqueue(self, document_id: UUID, priority: int, previous_chunk_set: Optional[str]) -> IngestionJob:
+        try:
+            job = IngestionJob(
+                document_id=document_id,
+                priority=priority,
+                max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+                previous_chunk_set=previous_chunk_set
+            )
+            self.db.add(job)
+            document = self.db.get(Document, document_id)
+            if document is not None:
+                document.status = DocumentStatus.QUEUED
+                document.progress = 0
+                document.error_message = None
+            self.db.commit()
+            self.db.refresh(job)
+            return job
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def claim(self, worker_id: str) -> Optional[IngestionJob]:
+        """Take the next runnable job, or None if the queue is empty"""
+        return await run_db(self._claim, worker_id)
+
+    def _claim(self, worker_id: str) -> Optional[IngestionJob]:
+        now = datetime.utcnow()
+        try:
+            job = self.db.query(IngestionJob)\
+                .filter(
+                    IngestionJob.status == IngestionJobStatus.QUEUED,
+                    IngestionJob.run_after <= now
+                )\
+                .order_by(IngestionJob.priority.desc(), IngestionJob.run_after, IngestionJob.created_at)\
+                .with_for_update(skip_locked=True)\
+                .first()
+            if job is None:
+                # End the transaction so the next poll sees fresh rows
+                self.db.rollback()
+                return None
+
+            job.status = IngestionJobStatus.RUNNING
+            job.locked_by = worker_id
+            job.locked_at = now
+            job.attempts += 1
+            self.db.commit()
+            return job
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def complete(self, job_id: UUID) -> None:
+        await run_db(self._complete, job_id)
+
+    def _complete(self, job_id: UUID) -> None:
+        try:
+            job = self.db.get(IngestionJob, job_id)
+            job.status = IngestionJobStatus.SUCCEEDED
+            job.locked_by = None
+            job.last_error = None
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def fail(self, job_id: UUID, error: str) -> None:
+        """Record a failed attempt, scheduling a retry while attempts remain"""
+        await run_db(self._fail, job_id, error)
+
+    def _fail(self, job_id: UUID, error: str) -> None:
+        try:
+            job = self.db.get(IngestionJob, job_id)
+            job.last_error = error
+            job.locked_by = None
+            document = job.document
+            if job.attempts < job.max_attempts:
+                delay = settings.INGESTION_RETRY_BASE_DELAY * (2 ** (job.attempts - 1))
+                job.status = IngestionJobStatus.QUEUED
+                job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+                document.status = DocumentStatus.QUEUED
+                logger.warning(
+                    f"Ingestion of {job.document_id} failed (attempt {job.attempts}), "
+                    f"retrying in {delay}s: {error}"
+                )
+            else:
+                job.status = IngestionJobStatus.FAILED
+                document.status = DocumentStatus.FAILED
+                logger.error(f"Ingestion of {job.document_id} failed after {job.attempts} attempts: {error}")
+            document.error_message = error
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def defer(self, job_id: UUID, delay: float) -> None:
+        """Put a claimed job back on the queue to run after a delay"""
+        await run_db(self._defer, job_id, delay)
+
+    def _defer(self, job_id: UUID, delay: float) -> None:
+        try:
+            job = self.db.get(IngestionJob, job_id)
+            job.status = IngestionJobStatus.QUEUED
+            job.attempts -= 1
+            job.locked_by = None
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+            job.document.status = DocumentStatus.QUEUED
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def requeue_stale(self) -> int:
+        """Requeue (or fail) jobs held by workers that died mid-job, and queue
+        jobs for documents that were saved but never queued"""
+        return await run_db(self._requeue_stale)
+
+    def _requeue_stale(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT)
+        try:
+            jobs = self.db.query(IngestionJob)\
+                .filter(
+                    IngestionJob.status == IngestionJobStatus.RUNNING,
+                    IngestionJob.locked_at < cutoff
+                )\
+                .with_for_update(skip_locked=True)\
+                .all()
+            for job in jobs:
+                logger.warning(f"Ingestion of {job.document_id} was abandoned by {job.locked_by}")
+                job.locked_by = None
+                job.last_error = "Worker stopped before finishing the job"
+                if job.attempts < job.max_attempts:
+                    job.status = IngestionJobStatus.QUEUED
+                    job.run_after = datetime.utcnow()
+                    job.document.status = DocumentStatus.QUEUED
+                else:
+                    job.status = IngestionJobStatus.FAILED
+                    job.document.status = DocumentStatus.FAILED
+                    job.document.error_message = job.last_error
+
+            pending = self.db.query(IngestionJob.id)\
+                .filter(
+                    IngestionJob.document_id == Document.id,
+                    IngestionJob.status.in_([IngestionJobStatus.QUEUED, IngestionJobStatus.RUNNING])
+                )\
+                .exists()
+            orphans = self.db.query(Document)\
+                .filter(
+                    Document.status == DocumentStatus.QUEUED,
+                    func.coalesce(Document.updated_at, Document.created_at) < cutoff,
+                    ~pending
+                )\
+                .with_for_update(skip_locked=True)\
+                .all()
+            for document in orphans:
+                logger.warning(f"Document {document.id} was saved without an ingestion job; queueing it")
+                self.db.add(IngestionJob(
+                    document_id=document.id,
+                    max_attempts=settings.INGESTION_MAX_ATTEMPTS
+                ))
+
+            self._delete_abandoned_staging(cutoff)
+            self.db.commit()
+            return len(jobs) + len(orphans)
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _delete_abandoned_staging(self, cutoff: datetime) -> None:
+        """Delete staged chunk sets whose document has no running job"""
+        self.db.flush()
+        staged = self.db.query(DocumentChunk.chunk_set)\
+            .filter(DocumentChunk.chunk_set.like(f"{STAGING_PREFIX}%"))\
+            .group_by(DocumentChunk.chunk_set)\
+            .having(func.max(DocumentChunk.created_at) < cutoff)\
+            .all()
+        if not staged:
+            return
+        running = {
+            row.document_id
+            for row in self.db.query(IngestionJob.document_id)
+            .filter(IngestionJob.status == IngestionJobStatus.RUNNING)
+        }
+        abandoned = [row.chunk_set for row in staged if staging_document_id(row.chunk_set) not in running]
+        if abandoned:
+            logger.warning(f"Deleting {len(abandoned)} abandoned staged chunk sets")
+            self.db.query(DocumentChunk)\
+                .filter(DocumentChunk.chunk_set.in_(abandoned))\
+                .delete(synchronize_session=False)
+
+    async def heartbeat(self, job_id: UUID) -> None:
+        """Refresh a running job's lock so long documents are not presumed dead.
+
+        The claim on the document's content blob is refreshed too, so no
+        other job takes over the content while this one is still working
+        on it.
+        """
+        await run_db(self._heartbeat, job_id)
+
+    def _heartbeat(self, job_id: UUID) -> None:
+        now = datetime.utcnow()
+        try:
+            running = self.db.query(IngestionJob)\
+                .filter(
+                    IngestionJob.id == job_id,
+                    IngestionJob.status == IngestionJobStatus.RUNNING
+                )\
+                .update({IngestionJob.locked_at: now}, synchronize_session=False)
+            content_hash = self.db.query(Document.content_hash)\
+                .join(IngestionJob, IngestionJob.document_id == Document.id)\
+                .filter(IngestionJob.id == job_id)\
+                .scalar()
+            if running and content_hash:
+                self.db.query(ContentBlob)\
+                    .filter(
+                        ContentBlob.content_hash == content_hash,
+                        ContentBlob.status == ContentBlobStatus.PROCESSING
+                    )\
+                    .update({ContentBlob.updated_at: now}, synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
@@ -0,0 +1,19 @@
+from langchain_core.language_models import BaseChatModel
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_google_genai import ChatGoogleGenerativeAI
+from app.core.config import settings
+
+# Canned reply of the local stand-in model
+FAKE_LLM_RESPONSE = "This answer comes from the local stand-in model."
+
+def get_llm() -> BaseChatModel:
+    """The chat model selected by LLM_PROVIDER"""
+    if settings.LLM_PROVIDER == "fake":
+        # Streams its reply one character at a time, like a real model streams tokens
+        return FakeListChatModel(responses=[FAKE_LLM_RESPONSE])
+    return ChatGoogleGenerativeAI(
+        model=settings.LLM_MODEL,
+        google_api_key=settings.GOOGLE_API_KEY,
+        temperature=0,
+        convert_system_message_to_human=True
+    )
@@ -0,0 +1,220 @@
+from langchain.prompts import ChatPromptTemplate
+from sqlalchemy.orm import Session
+from app.models.chat import ChatSession, ChatMessage
+from app.services.chunker import estimate_tokens
+from app.services.llm import get_llm
+from app.core.executors import run_db
+from app.core.config import get_settings
+from app.db.session import SessionLocal
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+import asyncio
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Words and openings that make a question lean on earlier turns
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|they|them|their|this|that|these|those|he|she|his|her|there|"
+    r"above|previous|same|more|else|other|another|former|latter)\b"
+    r"|^\s*(and|but|also|so|what about|how about|why|then)\b",
+    re.IGNORECASE
+)
+
+# Background summary updates, kept referenced until they finish, and the
+# sessions they are for, so a session is never folded twice at once
+_fold_tasks: Set[asyncio.Task] = set()
+_folding: Set[UUID] = set()
+
+def needs_rewrite(question: str) -> bool:
+    """Whether a question is likely a follow-up that cannot be searched on its own"""
+    return bool(FOLLOW_UP_PATTERN.search(question)) or len(question.split()) < 4
+
+def clip_text(text: str, max_tokens: int) -> str:
+    """The longest run of whole words starting the text within max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept: List[str] = []
+    tokens = 0
+    for word in text.split():
+        tokens += estimate_tokens(word)
+        if tokens > max_tokens:
+            break
+        kept.append(word)
+    return " ".join(kept) + " ..."
+
+def format_history(summary: Optional[str], messages: List[Dict], max_tokens: int) -> str:
+    """Conversation summary and recent messages as prompt text within max_tokens.
+
+    The summary gets at most half the budget; recent messages fill the
+    rest newest first, so the oldest ones are dropped when space runs out.
+    """
+    parts: List[str] = []
+    budget = max_tokens
+    if summary:
+        summary_text = "Summary of earlier conversation: " + clip_text(summary, max_tokens // 2)
+        parts.append(summary_text)
+        budget -= estimate_tokens(summary_text)
+
+    recent: List[str] = []
+    for message in reversed(messages):
+        if budget <= 0:
+            break
+        line = f"{message['role'].capitalize()}: {clip_text(message['content'], budget)}"
+        recent.insert(0, line)
+        budget -= estimate_tokens(line)
+    return "\n".join(parts + recent)
+
+class ConversationMemory:
+    """Memory of a chat session for follow-up questions.
+
+    The latest MEMORY_WINDOW_MESSAGES messages are kept verbatim; older ones
+    are folded into a running summary stored on the ChatSession, in the
+    background and only once MEMORY_FOLD_MIN_MESSAGES of them have piled
+    up, so most turns make no summary call at all. Messages waiting to be
+    folded stay in the prompt verbatim. A prompt therefore carries a
+    summary and a short window instead of the whole history, and both are
+    capped at MEMORY_MAX_TOKENS, so the cost of a message stays flat
+    however long the session runs.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.llm = get_llm()
+        self.rewrite_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You rewrite follow-up questions into standalone search queries.
+            Using the conversation, replace pronouns and references with what they refer to.
+            Reply with the rewritten question only, on one line. If the question is already
+            standalone, repeat it unchanged."""),
+            ("user", """Conversation:
+            {history}
+
+            Follow-up question: {question}""")
+        ])
+        self.summary_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You maintain a running summary of a conversation about a document.
+            Update the summary with the new messages, keeping the facts, names, numbers and
+            open questions later turns may refer to. Reply with the summary only, in at most
+            {max_words} words."""),
+            ("user", """Current summary:
+            {summary}
+
+            New messages:
+            {messages}""")
+        ])
+
+    def _unsummarized_messages(self, session_id: UUID, offset: int) -> List[Dict]:
+        # Both messages of a turn are written in one transaction and share a
+        # created_at, so the user's question is ordered before the answer
+        rows = self.db.query(ChatMessage.role, ChatMessage.content)\
+            .filter(ChatMessage.session_id == session_id)\
+            .order_by(ChatMessage.created_at, ChatMessage.role.desc())\
+            .offset(offset)\
+            .all()
+        return [{"role": row.role, "content": row.content} for row in rows]
+
+    async def load(self, session: ChatSession) -> Dict:
+        """The session's summary, recent messages and their prompt text"""
+        messages = await run_db(
+            self._unsummarized_messages,
+            session.id,
+            session.summarized_message_count or 0
+        )
+        # The window plus whatever is still waiting for the next fold
+        keep = settings.MEMORY_WINDOW_MESSAGES + max(settings.MEMORY_FOLD_MIN_MESSAGES - 1, 0)
+        messages = messages[-keep:] if keep else []
+        return {
+            "summary": session.summary,
+            "messages": messages,
+            "history": format_history(session.summary, messages, settings.MEMORY_MAX_TOKENS)
+        }
+
+    async def rewrite_query(self, question: str, memory: Dict) -> str:
+        """A standalone retrieval query for a follow-up question"""
+        if not memory["history"] or not needs_rewrite(question):
+            return question
+        try:
+            response = await (self.rewrite_prompt | self.llm).ainvoke({
+                "history": memory["history"],
+                "question": question
+            })
+            lines = response.content.strip().splitlines()
+            rewritten = lines[0].strip() if lines else ""
+        except Exception as e:
+            logger.warning(f"Could not rewrite follow-up question: {e}")
+            return question
+        # Guard against replies that answer the question instead of restating it
+        if not rewritten or estimate_tokens(rewritten) > 4 * estimate_tokens(question) + 50:
+            return question
+        return rewritten
+
+    def _save_summary(self, session_id: UUID, summary: str, previous_count: int, count: int) -> bool:
+        try:
+            # Only the first of two concurrent updates from the same state wins
+            updated = self.db.query(ChatSession)\
+                .filter(
+                    ChatSession.id == session_id,
+                    ChatSession.summarized_message_count == previous_count
+                )\
+                .update(
+                    {"summary": summary, "summarized_message_count": count},
+                    synchronize_session=False
+                )
+            self.db.commit()
+            return bool(updated)
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def schedule_update(self, session: ChatSession) -> None:
+        """Update the session's summary in the background.
+
+        The fold uses its own database session, as the caller's is closed
+        when the request ends. A fold lost to a shutdown is redone on a
+        later turn.
+        """
+        if session.id in _folding:
+            return
+        _folding.add(session.id)
+        task = asyncio.create_task(_fold(session.id))
+        _fold_tasks.add(task)
+        task.add_done_callback(_fold_tasks.discard)
+
+    async def update(self, session: ChatSession) -> None:
+        """Fold messages that have left the recent window into the summary.
+
+        Nothing is folded until at least MEMORY_FOLD_MIN_MESSAGES have left
+        the window. Failures are logged and leave the memory as it was; the
+        messages are folded on a later turn.
+        """
+        previous_count = session.summarized_message_count or 0
+        try:
+            messages = await run_db(self._unsummarized_messages, session.id, previous_count)
+            overflow = len(messages) - settings.MEMORY_WINDOW_MESSAGES
+            if overflow <= 0 or overflow < settings.MEMORY_FOLD_MIN_MESSAGES:
+                return
+            folded = messages[:overflow]
+            response = await (self.summary_prompt | self.llm).ainvoke({
+                "max_words": settings.MEMORY_SUMMARY_MAX_WORDS,
+                "summary": session.summary or "(none yet)",
+                "messages": format_history(None, folded, settings.MEMORY_MAX_TOKENS)
+            })
+            summary = clip_text(response.content.strip(), settings.MEMORY_MAX_TOKENS // 2)
+            await run_db(self._save_summary, session.id, summary, previous_count, previous_count + overflow)
+        except Exception as e:
+            logger.warning(f"Could not update conversation summary for session {session.id}: {e}")
+
+async def _fold(session_id: UUID) -> None:
+    db = SessionLocal()
+    try:
+        session = await run_db(db.get, ChatSession, session_id)
+        if session is not None:
+            await ConversationMemory(db).update(session)
+    except Exception as e:
+        logger.warning(f"Could not load chat session {session_id} for its summary: {e}")
+    finally:
+        _folding.discard(session_id)
+        db.close()
@@ -1,90 +1,304 @@
 from langchain_community.document_loaders import PDFPlumberLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import Document
 from app.core.config import settings
 from app.services.s3 import S3Service
+from app.core.executors import run_cpu, run_io
+from app.services.embedding_store import normalize_rows, top_k_indices
+from app.services.bm25 import BM25Index
+from app.services.context import ContextBuilder
+from app.services.embeddings import get_embeddings, get_embedding_scheduler
+from app.services.cache import AnswerCache, get_answer_cache
+from app.services.llm import get_llm
 import tempfile
+import shutil
+import json
 import os
+import logging
 import numpy as np
-from typing import List
+from typing import Dict, List, Optional
+from uuid import UUID, uuid4
+
+logger = logging.getLogger(__name__)
 
 class SimpleVectorStore:
-    def __init__(self, documents: List[Document], embeddings):
+    def __init__(
+        self,
+        documents: List[Document],
+        embeddings,
+        doc_embeddings: Optional[np.ndarray] = None,
+        normalized: bool = False
+    ):
         self.documents = documents
         self.embeddings = embeddings
-        self.doc_embeddings = []
-        self._create_embeddings()
+        self.doc_embeddings = None
+        self.lexical_index: Optional[BM25Index] = None
+        # Identifies the indexed content (e.g. its S3 ETag) for answer caching
+        self.version = None
+        if doc_embeddings is None:
+            self._create_embeddings()
+        elif normalized:
+            self.doc_embeddings = doc_embeddings
+        else:
+            self._set_embeddings(doc_embeddings)
 
     def _create_embeddings(self):
         texts = [doc.page_content for doc in self.documents]
-        self.doc_embeddings = self.embeddings.embed_documents(texts)
+        self._set_embeddings(self.embeddings.embed_documents(texts))
+
+    def _set_embeddings(self, doc_embeddings) -> None:
+        # One contiguous, pre-normalized float32 matrix so scoring is a single BLAS call
+        matrix = np.asarray(doc_embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(self.documents), matrix.size // max(len(self.documents), 1))
+        self.doc_embeddings = np.ascontiguousarray(normalize_rows(matrix))
 
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
-        query_embedding = self.embeddings.embed_query(query)
-        
-        # Calculate similarities
-        similarities = []
-        for doc_embedding in self.doc_embeddings:
-            similarity = np.dot(query_embedding, doc_embedding)
-            similarities.append(similarity)
-        
-        # Get top k similar documents
-        top_k_indices = np.argsort(similarities)[-k:][::-1]
-        return [self.documents[i] for i in top_k_indices]
+        if not self.documents:
+            return []
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        if not self.documents:
+            return []
+        query_embedding = np.asarray(embedding, dtype=np.float32)
+
+        # Score every chunk with one matrix-vector product
+        scores = self.doc_embeddings @ normalize_rows(query_embedding)
+        return [self.documents[i] for i in top_k_indices(scores, k)]
+
+    def _get_lexical_index(self) -> BM25Index:
+        if self.lexical_index is None:
+            self.lexical_index = BM25Index.build([doc.page_content for doc in self.documents])
+        return self.lexical_index
+
+    def lexical_search(self, query: str, k: int = 4) -> List[Document]:
+        """BM25 keyword search; needs no embedding call"""
+        if not self.documents:
+            return []
+        return [self.documents[i] for i, _ in self._get_lexical_index().search(query, k)]
+
+    def hybrid_search_by_vector(
+        self,
+        query: str,
+        embedding: List[float],
+        k: int = 4,
+        candidates: int = 20,
+        rrf_k: int = 60
+    ) -> List[Document]:
+        """Fuse BM25 and embedding rankings with reciprocal rank fusion"""
+        if not self.documents:
+            return []
+        candidates = max(candidates, k)
+        scores = self.doc_embeddings @ normalize_rows(np.asarray(embedding, dtype=np.float32))
+        rankings = [
+            [int(i) for i in top_k_indices(scores, candidates)],
+            [i for i, _ in self._get_lexical_index().search(query, candidates)]
+        ]
+        fused: dict = {}
+        for ranking in rankings:
+            for rank, i in enumerate(ranking, start=1):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (rrf_k + rank)
+        best = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [self.documents[i] for i in best]
+
+    def as_candidates(self, documents: List[Document]) -> List[Dict]:
+        """Retrieved documents as context candidates carrying their embeddings"""
+        rows = {id(doc): i for i, doc in enumerate(self.documents)}
+        return [
+            {
+                "content": doc.page_content,
+                "metadata": doc.metadata,
+                "embedding": self.doc_embeddings[rows[id(doc)]]
+            }
+            for doc in documents
+        ]
+
+    def similarity_search_many(self, queries: List[str], k: int = 4) -> List[List[Document]]:
+        """Run several queries at once, scoring them all with one matrix product"""
+        if not queries or not self.documents:
+            return [[] for _ in queries]
+        # Queries embed with the query task type, exactly as in similarity_search
+        query_embeddings = np.asarray([self.embeddings.embed_query(query) for query in queries], dtype=np.float32)
+
+        scores = normalize_rows(query_embeddings) @ self.doc_embeddings.T
+        return [
+            [self.documents[i] for i in row]
+            for row in top_k_indices(scores, k)
+        ]
+
+    def save(self, path: str) -> None:
+        """Persist the chunks and their embeddings to a directory.
+
+        path names one version of the content, so a version saved
+        concurrently by another writer is identical and kept as it is.
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}-{uuid4().hex[:8]}"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        np.save(os.path.join(tmp_path, "embeddings.npy"), self.doc_embeddings)
+        with open(os.path.join(tmp_path, "documents.json"), "w") as f:
+            json.dump(
+                [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in self.documents],
+                f
+            )
+        self._get_lexical_index().save(tmp_path)
+
+        # Rename the finished index into place so readers never see a partial write
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+
+    @classmethod
+    def load(cls, path: str, embeddings) -> "SimpleVectorStore":
+        """Load a vector store previously written with save()"""
+        with open(os.path.join(path, "documents.json")) as f:
+            documents = [Document(**doc) for doc in json.load(f)]
+        # Saved matrices are already normalized float32, so map them read-only
+        # instead of copying them into this process
+        doc_embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        store = cls(documents, embeddings, doc_embeddings=doc_embeddings, normalized=True)
+        if os.path.exists(os.path.join(path, "bm25.npz")):
+            store.lexical_index = BM25Index.load(path)
+        return store
+
+def load_and_split_pdf(file_path: str) -> List[Document]:
+    """Parse a PDF into overlapping text chunks (runs in the CPU pool)"""
+    documents = PDFPlumberLoader(file_path).load()
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200
+    )
+    return text_splitter.split_documents(documents)
+
+def get_index_dir(document_id: UUID) -> str:
+    """Directory holding all persisted indexes for a document"""
+    return os.path.join(settings.VECTOR_INDEX_DIR, str(document_id))
+
+def delete_document_index(document_id: UUID) -> None:
+    """Remove every persisted index for a document and its cached answers"""
+    shutil.rmtree(get_index_dir(document_id), ignore_errors=True)
+    get_answer_cache().invalidate_document(document_id)
+
+def delete_stale_indexes(document_id: UUID, current: str) -> None:
+    """Remove a document's persisted indexes other than the current version"""
+    index_dir = get_index_dir(document_id)
+    for name in os.listdir(index_dir):
+        if name != current and ".tmp-" not in name:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+    get_answer_cache().invalidate_document(document_id)
 
 class RAGService:
     def __init__(self):
         self.s3 = S3Service()
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",
-            google_api_key=settings.GOOGLE_API_KEY,
-        )
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-pro",
-            google_api_key=settings.GOOGLE_API_KEY,
-            temperature=0,
-            convert_system_message_to_human=True
-        )
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
+        self.embeddings = get_embeddings()
+        self.embedding_scheduler = get_embedding_scheduler(self.embeddings)
+        self.llm = get_llm()
+        self.answer_cache = get_answer_cache() if settings.ANSWER_CACHE_ENABLED else None
+        self.context_builder = ContextBuilder(
+            settings.CONTEXT_MAX_TOKENS,
+            settings.CONTEXT_MMR_LAMBDA,
+            settings.CONTEXT_DUPLICATE_THRESHOLD
         )
 
-    async def process_document(self, file_url: str) -> SimpleVectorStore:
-        """Process a document and create a vector store"""
-        # Download file from S3
-        file_key = file_url.split(f"{self.s3.bucket_name}.s3.amazonaws.com/")[1]
-        file_data = await self.s3.get_file(file_key)
-        
-        # Save to temporary file
+    async def process_document(self, file_url: str, document_id: Optional[UUID] = None) -> SimpleVectorStore:
+        """Process a document and create a vector store.
+
+        When a document_id is given, the index is persisted on disk keyed by the
+        document id and the S3 ETag of the file, so later queries only need to
+        embed the question.
+        """
+        file_key = self.s3.get_file_key(file_url)
+
+        index_path = None
+        if document_id is not None:
+            content_hash = await self.s3.get_file_etag(file_key)
+            index_path = os.path.join(get_index_dir(document_id), content_hash)
+            if os.path.isdir(index_path):
+                try:
+                    vectorstore = await run_io(SimpleVectorStore.load, index_path, self.embeddings)
+                    vectorstore.version = content_hash
+                    return vectorstore
+                except Exception as e:
+                    logger.warning(f"Discarding unreadable index at {index_path}: {e}")
+                    await run_io(shutil.rmtree, index_path, True)
+
+        # Download file from S3 to a temporary file
         with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file.write(file_data.read())
             temp_path = temp_file.name
-        
+
         try:
-            # Load and process document
-            loader = PDFPlumberLoader(temp_path)
-            documents = loader.load()
-            texts = self.text_splitter.split_documents(documents)
-            
+            await self.s3.download_file(file_key, temp_path)
+
+            # Load and split the document off the event loop
+            texts = await run_cpu(load_and_split_pdf, temp_path)
+
+            # Embed through the shared scheduler so the event loop stays free
+            doc_embeddings = await self.embedding_scheduler.embed_documents(
+                [text.page_content for text in texts]
+            )
+
             # Create simple vector store
-            vectorstore = SimpleVectorStore(texts, self.embeddings)
+            vectorstore = SimpleVectorStore(texts, self.embeddings, doc_embeddings=doc_embeddings)
+
+            if index_path is not None:
+                await run_io(vectorstore.save, index_path)
+                vectorstore.version = content_hash
+                # Older versions are stale once the new one is in place
+                await run_io(delete_stale_indexes, document_id, content_hash)
+
             return vectorstore
-            
+
         finally:
             # Clean up temp file
             os.unlink(temp_path)
 
-    async def query_document(self, vectorstore: SimpleVectorStore, question: str) -> dict:
+    async def query_document(
+        self,
+        vectorstore: SimpleVectorStore,
+        question: str,
+        document_id: Optional[UUID] = None
+    ) -> dict:
         """Query a processed document"""
+        mode = settings.RAG_RETRIEVAL_MODE
+        scope = None
+        if self.answer_cache is not None and document_id is not None:
+            scope = AnswerCache.make_scope([(document_id, vectorstore.version)])
+            # Without an embedding to follow up with, this lookup is the last
+            cached = self.answer_cache.get(scope, question, count_miss=mode == "lexical")
+            if cached is not None:
+                return cached
+
         # Get relevant documents
-        relevant_docs = vectorstore.similarity_search(question)
-        
-        # Combine relevant documents into context
-        context = "\n\n".join([doc.page_content for doc in relevant_docs])
-        
+        query_embedding = None
+        if mode != "lexical":
+            query_embedding = await self.embedding_scheduler.embed_query(question)
+            if scope is not None:
+                cached = self.answer_cache.get(scope, question, query_embedding)
+                if cached is not None:
+                    return cached
+
+        k = settings.CONTEXT_CANDIDATES
+        if mode == "lexical":
+            candidates = vectorstore.lexical_search(question, k)
+        elif mode == "hybrid":
+            candidates = vectorstore.hybrid_search_by_vector(
+                question,
+                query_embedding,
+                k,
+                candidates=settings.SEARCH_CANDIDATES,
+                rrf_k=settings.SEARCH_RRF_K
+            )
+        else:
+            candidates = vectorstore.similarity_search_by_vector(query_embedding, k)
+
+        # Keep diverse, non-duplicate chunks within the context token budget
+        relevant_docs = self.context_builder.select(vectorstore.as_candidates(candidates), query_embedding)
+        context = self.context_builder.format(relevant_docs)
+
         # Create prompt
         prompt = f"""Based on the following context, please answer the question. You can:
 1. Directly quote from the context when available
@@ -98,11 +312,15 @@ Context:
 Question: {question}
 
 Answer:"""
-        
+
         # Get response from LLM
-        response = self.llm.invoke(prompt)
-        
-        return {
+        response = await self.llm.ainvoke(prompt)
+
+        result = {
             "answer": response.content,
-            "source_documents": [doc.page_content[:200] + "..." for doc in relevant_docs]
-        } 
\ No newline at end of file
+            "source_documents": [doc["content"][:200] + "..." for doc in relevant_docs]
+        }
+        if scope is not None:
+            self.answer_cache.put(scope, question, result, query_embedding)
+
+        return result
\ No newline at end of file
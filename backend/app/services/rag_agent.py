@@ -1,9 +1,16 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.chains import LLMChain
 from app.services.vector_store import VectorStore
+from app.services.search import SearchService
+from app.services.tables import TableService
+from app.services.context import ContextBuilder
+from app.services.reranker import get_reranker
+from app.services.cache import AnswerCache, get_answer_cache
+from app.services.llm import get_llm
+from app.core.executors import run_db
+from app.models.document import Document
 from app.core.config import get_settings
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
 from uuid import UUID
 import logging
@@ -16,18 +23,23 @@ class RAGAgent:
     def __init__(self, db: Session):
         self.db = db
         self.vector_store = VectorStore(db)
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-pro",
-            google_api_key=settings.GOOGLE_API_KEY,
-            temperature=0,
-            convert_system_message_to_human=True
+        self.search = SearchService(db)
+        self.tables = TableService(db)
+        self.context_builder = ContextBuilder(
+            settings.CONTEXT_MAX_TOKENS,
+            settings.CONTEXT_MMR_LAMBDA,
+            settings.CONTEXT_DUPLICATE_THRESHOLD
         )
+        self.llm = get_llm()
         
         self.prompt = ChatPromptTemplate.from_messages([
             ("system", """You are a helpful AI assistant that answers questions based on the provided context. 
             Always base your answers on the context provided and acknowledge when you're unsure about something.
-            If the context doesn't contain relevant information, say so."""),
-            ("user", """Context: {context}
+            If the context doesn't contain relevant information, say so.
+            Use the conversation so far only to understand what the question refers to."""),
+            ("user", """Conversation so far: {history}
+
+            Context: {context}
             
             Question: {question}
             
@@ -35,39 +47,196 @@ class RAGAgent:
         ])
         
         self.chain = LLMChain(llm=self.llm, prompt=self.prompt)
+        self.answer_cache = get_answer_cache() if settings.ANSWER_CACHE_ENABLED else None
+        self.reranker = get_reranker() if settings.RERANK_ENABLED else None
+
+    def _cache_scope(self, document_ids: List[UUID]) -> tuple:
+        """Answer-cache scope; updated_at changes whenever a document is reprocessed"""
+        versions = dict(
+            self.db.query(Document.id, Document.updated_at)
+            .filter(Document.id.in_(document_ids))
+            .all()
+        )
+        return AnswerCache.make_scope(
+            (document_id, versions.get(document_id)) for document_id in document_ids
+        )
     
     async def _format_context(self, chunks: List[Dict]) -> str:
         """Format retrieved chunks into a single context string"""
-        return "\n\n".join([chunk["content"] for chunk in chunks])
+        return self.context_builder.format(chunks)
     
+    def _is_cacheable(self, question: str, history: str, retrieval_query: Optional[str]) -> bool:
+        """Whether the answer depends only on the query and the documents.
+
+        With earlier turns, a question that was not rewritten may lean on
+        them ("and in 2023?"), so the same words can ask something else in
+        another conversation.
+        """
+        if self.answer_cache is None:
+            return False
+        return not history or bool(retrieval_query) and retrieval_query != question
+
+    async def _cached_answer(
+        self,
+        question: str,
+        document_ids: List[UUID]
+    ) -> Tuple[Optional[tuple], Optional[List[float]], Optional[Dict]]:
+        """Look the question up in the answer cache.
+
+        Returns the cache scope, the question embedding (reused for retrieval)
+        and the cached answer, if any.
+        """
+        if self.answer_cache is None:
+            return None, None, None
+        scope = await run_db(self._cache_scope, document_ids)
+        cached = self.answer_cache.get(scope, question, count_miss=False)
+        if cached is not None:
+            return scope, None, cached
+        query_embedding = await self.vector_store.create_embedding(question)
+        return scope, query_embedding, self.answer_cache.get(scope, question, query_embedding)
+
+    async def _retrieve(
+        self,
+        question: str,
+        document_ids: List[UUID],
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict]:
+        """Get relevant chunks using hybrid (full-text + vector) or similarity search.
+
+        A wider candidate set is retrieved, optionally reranked on the CPU,
+        and narrowed by the context builder to diverse, non-duplicate chunks
+        within the token budget.
+        Aggregate questions over spreadsheets are computed from the stored
+        tables, and the result leads the sources.
+        """
+        limit = settings.RERANK_CANDIDATES if self.reranker else settings.CONTEXT_CANDIDATES
+        if settings.HYBRID_SEARCH_ENABLED:
+            candidates = await self.search.hybrid_search(
+                query=question,
+                document_ids=document_ids,
+                limit=limit,
+                query_embedding=query_embedding,
+                include_embeddings=True
+            )
+        else:
+            candidates = await self.vector_store.similarity_search(
+                query=question,
+                document_ids=document_ids,
+                limit=limit,
+                query_embedding=query_embedding,
+                include_embeddings=True
+            )
+        if self.reranker is not None:
+            candidates = await self.reranker.rerank(question, candidates, settings.CONTEXT_CANDIDATES)
+            # Relevance now follows the reranked order, not the query embedding
+            chunks = self.context_builder.select(candidates)
+        else:
+            chunks = self.context_builder.select(candidates, query_embedding)
+        if settings.TABLE_QUERY_ENABLED:
+            table_result = await self.tables.answer_context(question, document_ids)
+            if table_result is not None:
+                chunks = [table_result] + chunks
+        return chunks
+
     async def answer_question(
         self, 
         question: str, 
-        document_ids: List[UUID]
+        document_ids: List[UUID],
+        history: str = "",
+        retrieval_query: Optional[str] = None
     ) -> Dict:
-        """Answer a question using RAG"""
+        """Answer a question using RAG.
+
+        history is the conversation so far as prompt text; retrieval_query,
+        a standalone rewrite of a follow-up question, is used for search and
+        caching in place of the question. Follow-ups that were not rewritten
+        bypass the answer cache.
+        """
         try:
+            query = retrieval_query or question
+            cacheable = self._is_cacheable(question, history, retrieval_query)
+            scope, query_embedding, cached = None, None, None
+            if cacheable:
+                scope, query_embedding, cached = await self._cached_answer(query, document_ids)
+            if cached is not None:
+                return cached
+
             # Get relevant chunks using similarity search
-            relevant_chunks = await self.vector_store.similarity_search(
-                query=question,
-                document_ids=document_ids,
-                limit=3
-            )
+            relevant_chunks = await self._retrieve(query, document_ids, query_embedding)
 
             # Format context from chunks
             context = await self._format_context(relevant_chunks)
 
             # Generate response using LLM chain
             response = await self.chain.arun(
+                history=history or "(none)",
                 context=context,
                 question=question
             )
 
-            return {
+            result = {
                 "answer": response,
                 "sources": relevant_chunks
             }
+            if cacheable:
+                self.answer_cache.put(scope, query, result, query_embedding)
+
+            return result
 
         except Exception as e:
             logger.error(f"Error generating answer: {e}")
-            raise Exception(f"Failed to generate answer: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Failed to generate answer: {str(e)}")
+
+    async def stream_answer(
+        self,
+        question: str,
+        document_ids: List[UUID],
+        history: str = "",
+        retrieval_query: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """Answer a question using RAG, yielding events as they are ready.
+
+        Yields {"event": "sources", "data": [...]} first, then one
+        {"event": "token", "data": "..."} per generated chunk, and finally
+        {"event": "done", "data": {"answer": ..., "sources": ...}}.
+        history and retrieval_query are as for answer_question.
+        """
+        try:
+            query = retrieval_query or question
+            cacheable = self._is_cacheable(question, history, retrieval_query)
+            scope, query_embedding, cached = None, None, None
+            if cacheable:
+                scope, query_embedding, cached = await self._cached_answer(query, document_ids)
+            if cached is not None:
+                yield {"event": "sources", "data": cached["sources"]}
+                yield {"event": "token", "data": cached["answer"]}
+                yield {"event": "done", "data": cached}
+                return
+
+            relevant_chunks = await self._retrieve(query, document_ids, query_embedding)
+            yield {"event": "sources", "data": relevant_chunks}
+
+            context = await self._format_context(relevant_chunks)
+
+            tokens = []
+            async for chunk in (self.prompt | self.llm).astream({
+                "history": history or "(none)",
+                "context": context,
+                "question": question
+            }):
+                if chunk.content:
+                    tokens.append(chunk.content)
+                    yield {"event": "token", "data": chunk.content}
+
+            result = {
+                "answer": "".join(tokens),
+                "sources": relevant_chunks
+            }
+            if cacheable:
+                self.answer_cache.put(scope, query, result, query_embedding)
+
+            yield {"event": "done", "data": result}
+
+        except Exception as e:
+            logger.error(f"Error streaming answer: {e}")
+            raise Exception(f"Failed to generate answer: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,171 @@
+from app.core.config import settings
+from app.core.executors import run_io
+from app.services.bm25 import tokenize
+from typing import Dict, List, Optional
+import threading
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Words that say nothing about which chunk answers a question
+STOP_WORDS = frozenset("""
+a an and are as at be by can could did do does for from had has have how i
+in is it its me my of on or our should that the their there these this those
+to was we were what when where which who why will with would you your
+""".split())
+
+def query_terms(query: str) -> List[str]:
+    terms = [term for term in tokenize(query) if term not in STOP_WORDS]
+    # A query made only of stop words still has to match something
+    return terms or tokenize(query)
+
+def lexical_scores(
+    queries: List[str],
+    texts: List[List[str]],
+    k1: float = 1.5,
+    b: float = 0.75
+) -> List[np.ndarray]:
+    """Lexical relevance of each query's candidate texts to it, in [0, 1].
+
+    Every text is tokenized once into ids of the batch's query terms; the
+    signals of all queries are then computed with array operations over
+    one term-count matrix.
+    """
+    term_lists = [query_terms(query) for query in queries]
+    vocabulary: Dict[str, int] = {}
+    for terms in term_lists:
+        for term in terms:
+            vocabulary.setdefault(term, len(vocabulary))
+    other = len(vocabulary)  # id shared by every token that is no query term
+    width = other + 1
+
+    sizes = np.asarray([len(candidates) for candidates in texts], dtype=np.int64)
+    token_ids = [
+        np.fromiter((vocabulary.get(token, other) for token in tokenize(text)), dtype=np.int64)
+        for candidates in texts for text in candidates
+    ]
+    count = len(token_ids)
+    if not count or not vocabulary:
+        return [np.zeros(size, dtype=np.float32) for size in sizes]
+
+    lengths = np.asarray([len(ids) for ids in token_ids], dtype=np.int64)
+    flat = np.concatenate(token_ids)
+    rows = np.repeat(np.arange(count), lengths)
+    tf = np.bincount(rows * width + flat, minlength=count * width)\
+        .reshape(count, width)[:, :other].astype(np.float32)
+    present = tf > 0
+
+    # Which query each text belongs to, and each query's words
+    owner = np.repeat(np.arange(len(queries)), sizes)
+    wanted = np.zeros((len(queries), other), dtype=bool)
+    for query, terms in enumerate(term_lists):
+        wanted[query, [vocabulary[term] for term in terms]] = True
+
+    # BM25 over each query's own candidates
+    df = np.zeros((len(queries), other), dtype=np.float32)
+    np.add.at(df, owner, present)
+    total = sizes.astype(np.float32)[:, None]
+    idf = np.log(1 + (total - df + 0.5) / (df + 0.5)) * wanted
+    average_length = np.maximum(
+        np.bincount(owner, weights=lengths, minlength=len(queries)) / np.maximum(sizes, 1), 1.0
+    )
+    length_norm = k1 * (1 - b + b * lengths / average_length[owner])
+    bm25 = (idf[owner] * tf * (k1 + 1) / (tf + length_norm[:, None].astype(np.float32))).sum(axis=1)
+    best = np.zeros(len(queries), dtype=np.float32)
+    np.maximum.at(best, owner, bm25)
+    bm25 = np.divide(bm25, best[owner], out=np.zeros_like(bm25), where=best[owner] > 0)
+
+    matched = (present & wanted[owner]).sum(axis=1)
+    coverage = matched / np.maximum(wanted.sum(axis=1), 1)[owner]
+
+    # Adjacent query word pairs, coded as first * width + second
+    pair_sets = [
+        np.unique([vocabulary[x] * width + vocabulary[y] for x, y in zip(terms, terms[1:])]).astype(np.int64)
+        for terms in term_lists
+    ]
+    pair_counts = np.asarray([len(pairs) for pairs in pair_sets])
+    same_text = rows[:-1] == rows[1:]
+    pair_rows = rows[:-1][same_text]
+    pair_codes = (flat[:-1] * width + flat[1:])[same_text]
+    pair_owner = owner[pair_rows]
+    offsets = np.concatenate([[0], np.cumsum(pair_counts)])
+    all_pairs = np.concatenate(pair_sets) if offsets[-1] else np.zeros(0, dtype=np.int64)
+    # A text's pair counts once per distinct query pair it contains in order
+    hit = np.zeros(len(pair_codes), dtype=bool)
+    for query in np.flatnonzero(pair_counts):
+        hit |= (pair_owner == query) & np.isin(pair_codes, all_pairs[offsets[query]:offsets[query + 1]])
+    distinct = np.unique(pair_rows[hit] * width * width + pair_codes[hit]) // (width * width)
+    adjacency = np.bincount(distinct, minlength=count) / np.maximum(pair_counts, 1)[owner]
+    adjacency = np.where(pair_counts[owner] > 0, adjacency, coverage)
+
+    combined = (0.5 * bm25 + 0.3 * coverage + 0.2 * adjacency).astype(np.float32)
+    return np.split(combined, np.cumsum(sizes)[:-1])
+
+class LexicalReranker:
+    """Rescores retrieved chunks against the query on the CPU, without a model call.
+
+    Each text is scored on three signals: BM25 over the candidate set (so a
+    query word counts for more when few candidates contain it), the share of
+    the query's words it contains, and the share of the query's adjacent word
+    pairs it contains in order. The retriever's ranking is blended in with
+    prior_weight, so semantic matches with little word overlap are demoted
+    rather than dropped.
+    """
+
+    def __init__(self, prior_weight: float = 0.3):
+        self.prior_weight = prior_weight
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "candidates": 0, "seconds_total": 0.0, "seconds_max": 0.0}
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """Lexical relevance of every text to the query, in [0, 1]"""
+        return lexical_scores([query], [texts])[0]
+
+    def score_batch(self, queries: List[str], texts: List[List[str]]) -> List[np.ndarray]:
+        """Score several queries, each against its own candidate texts"""
+        return lexical_scores(queries, texts)
+
+    async def rerank(self, query: str, candidates: List[Dict], limit: Optional[int] = None) -> List[Dict]:
+        """Candidates (best first) reordered by reranker score, keeping the top limit.
+
+        Scoring takes milliseconds, too little to be worth a trip to the
+        process pool (where it could also queue behind document parsing),
+        so it runs on a thread; NumPy releases the GIL for most of it.
+        """
+        if not candidates:
+            return []
+        started = time.perf_counter()
+
+        count = len(candidates)
+        prior = 1.0 - np.arange(count, dtype=np.float32) / count
+        (lexical,) = await run_io(lexical_scores, [query], [[candidate["content"] for candidate in candidates]])
+        combined = (1 - self.prior_weight) * lexical + self.prior_weight * prior
+        order = np.argsort(-combined, kind="stable")[:limit]
+        reranked = [dict(candidates[i], rerank_score=float(combined[i])) for i in order]
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["candidates"] += count
+            self.stats["seconds_total"] += elapsed
+            self.stats["seconds_max"] = max(self.stats["seconds_max"], elapsed)
+        logger.debug(f"Reranked {count} candidates in {elapsed * 1000:.1f}ms")
+        return reranked
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["mean_ms"] = 1000 * stats["seconds_total"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+_reranker: Optional[LexicalReranker] = None
+_singleton_lock = threading.Lock()
+
+def get_reranker() -> LexicalReranker:
+    global _reranker
+    with _singleton_lock:
+        if _reranker is None:
+            _reranker = LexicalReranker(settings.RERANK_PRIOR_WEIGHT)
+        return _reranker
@@ -1,8 +1,12 @@
 import boto3
 from botocore.exceptions import ClientError
 from fastapi import HTTPException
+import asyncio
+import hashlib
 import logging
+from typing import AsyncIterator, Dict, List, Optional, Set
 from app.core.config import settings
+from app.core.executors import run_io
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +30,8 @@ class S3Service:
             logger.info(f"Attempting to upload file: {file_name}")
             
             # Upload the file
-            self.s3_client.upload_fileobj(
+            await run_io(
+                self.s3_client.upload_fileobj,
                 file_data,
                 self.bucket_name,
                 file_name
@@ -44,10 +49,139 @@ class S3Service:
                 detail=f"Failed to upload file to storage: {str(e)}"
             )
 
+    async def upload_stream(
+        self,
+        stream: AsyncIterator[bytes],
+        file_name: str,
+        content_type: Optional[str] = None,
+        max_size: Optional[int] = None
+    ) -> Dict:
+        """Upload a byte stream to S3 without buffering it whole.
+
+        The stream is cut into S3_MULTIPART_PART_SIZE parts that are uploaded
+        concurrently while the next ones are read, and hashed as it goes. At
+        most S3_MULTIPART_CONCURRENCY parts are held in memory. Streams larger
+        than max_size are aborted with a 413 as soon as they cross the limit.
+
+        Returns the object URL, the size in bytes and the hex SHA-256.
+        """
+        part_size = settings.S3_MULTIPART_PART_SIZE
+        extra_args = {"ContentType": content_type} if content_type else {}
+        sha256 = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        upload_id = None
+        parts: List[Dict] = []
+        part_count = 0
+        in_flight: Set[asyncio.Task] = set()
+        slots = asyncio.Semaphore(settings.S3_MULTIPART_CONCURRENCY)
+
+        async def upload_part(part_number: int, body: bytes) -> None:
+            try:
+                response = await run_io(
+                    self.s3_client.upload_part,
+                    Bucket=self.bucket_name,
+                    Key=file_name,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body
+                )
+                parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+            finally:
+                slots.release()
+
+        def check_parts() -> None:
+            # Raises the error of a failed part, so the upload stops without
+            # reading the rest of the stream
+            for task in [task for task in in_flight if task.done()]:
+                in_flight.discard(task)
+                task.result()
+
+        async def send_part(body: bytes) -> None:
+            nonlocal upload_id, part_count
+            if upload_id is None:
+                response = await run_io(
+                    self.s3_client.create_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_name,
+                    **extra_args
+                )
+                upload_id = response["UploadId"]
+            # Waiting for a free slot is what bounds memory use
+            await slots.acquire()
+            check_parts()
+            part_count += 1
+            in_flight.add(asyncio.create_task(upload_part(part_count, body)))
+
+        try:
+            logger.info(f"Streaming upload of file: {file_name}")
+            async for data in stream:
+                check_parts()
+                size += len(data)
+                if max_size is not None and size > max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File exceeds the {max_size // (1024 * 1024)}MB upload limit"
+                    )
+                sha256.update(data)
+                buffer += data
+                while len(buffer) >= part_size:
+                    await send_part(bytes(buffer[:part_size]))
+                    del buffer[:part_size]
+
+            if upload_id is None:
+                # Small file: a single request is cheaper than a multipart upload
+                await run_io(
+                    self.s3_client.put_object,
+                    Bucket=self.bucket_name,
+                    Key=file_name,
+                    Body=bytes(buffer),
+                    **extra_args
+                )
+            else:
+                if buffer:
+                    await send_part(bytes(buffer))
+                await asyncio.gather(*in_flight)
+                await run_io(
+                    self.s3_client.complete_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=file_name,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])}
+                )
+
+        except Exception as e:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            if upload_id is not None:
+                # Otherwise S3 keeps (and bills for) the uploaded parts
+                try:
+                    await run_io(
+                        self.s3_client.abort_multipart_upload,
+                        Bucket=self.bucket_name,
+                        Key=file_name,
+                        UploadId=upload_id
+                    )
+                except ClientError as abort_error:
+                    logger.error(f"Error aborting multipart upload of {file_name}: {abort_error}")
+            if isinstance(e, HTTPException):
+                raise
+            logger.error(f"Error streaming file to S3: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to upload file to storage: {str(e)}"
+            )
+
+        url = f"https://{self.bucket_name}.s3.amazonaws.com/{file_name}"
+        logger.info(f"Successfully uploaded {size} bytes. URL: {url}")
+        return {"url": url, "size": size, "sha256": sha256.hexdigest()}
+
     async def get_file(self, file_name: str):
         """Get a file from S3"""
         try:
-            response = self.s3_client.get_object(
+            response = await run_io(
+                self.s3_client.get_object,
                 Bucket=self.bucket_name,
                 Key=file_name
             )
@@ -59,10 +193,47 @@ class S3Service:
                 detail="File not found"
             )
 
+    async def download_file(self, file_name: str, destination: str) -> None:
+        """Download a file from S3 to a local path"""
+        try:
+            await run_io(
+                self.s3_client.download_file,
+                self.bucket_name,
+                file_name,
+                destination
+            )
+        except ClientError as e:
+            logger.error(f"Error downloading file from S3: {e}")
+            raise HTTPException(
+                status_code=404,
+                detail="File not found"
+            )
+
+    def get_file_key(self, file_url: str) -> str:
+        """Object key of a file from the URL returned by upload_file"""
+        return file_url.split(f"{self.bucket_name}.s3.amazonaws.com/")[1]
+
+    async def get_file_etag(self, file_name: str) -> str:
+        """Get the ETag of a file in S3 without downloading it"""
+        try:
+            response = await run_io(
+                self.s3_client.head_object,
+                Bucket=self.bucket_name,
+                Key=file_name
+            )
+            return response['ETag'].strip('"')
+        except ClientError as e:
+            logger.error(f"Error getting file metadata from S3: {e}")
+            raise HTTPException(
+                status_code=404,
+                detail="File not found"
+            )
+
     async def delete_file(self, file_name: str) -> bool:
         """Delete a file from S3"""
         try:
-            self.s3_client.delete_object(
+            await run_io(
+                self.s3_client.delete_object,
                 Bucket=self.bucket_name,
                 Key=file_name
             )
@@ -1,4 +1,216 @@
-# # Need to implement:
-# - Document indexing
-# - Full-text search
-# - Metadata search 
\ No newline at end of file
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.services.bm25 import BM25Index
+from app.services.vector_store import VectorStore
+from app.core.config import get_settings
+from app.core.executors import run_db
+from typing import Dict, List, Optional
+from uuid import UUID
+import json
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+TOKEN_PATTERN = re.compile(r"[\w#./-]+")
+# A lexeme of tsvector/tsquery text output, 'word':1,4B, with ' and \ escaped
+LEXEME_PATTERN = re.compile(r"'((?:[^'\\]|''|\\.)*)'(?::([\d,A-D]+))?")
+LEXEME_ESCAPE = re.compile(r"''|\\(.)")
+
+def parse_tsvector(value: str) -> Dict[str, int]:
+    """Lexeme -> occurrence count of a tsvector (or tsquery) in its text form"""
+    counts: Dict[str, int] = {}
+    for lexeme, positions in LEXEME_PATTERN.findall(value or ""):
+        lexeme = LEXEME_ESCAPE.sub(lambda m: m.group(1) or "'", lexeme)
+        counts[lexeme] = counts.get(lexeme, 0) + (positions.count(",") + 1 if positions else 1)
+    return counts
+
+def find_identifiers(query: str) -> List[str]:
+    """Tokens of a query that look like identifiers: invoice numbers, SKUs, versions"""
+    identifiers = []
+    for token in TOKEN_PATTERN.findall(query):
+        token = token.strip("./-#")
+        if len(token) >= 4 and any(c.isdigit() for c in token) \
+                and any(c.isalpha() or c in "-/" for c in token):
+            identifiers.append(token.lower())
+    return identifiers
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], k: int, limit: int) -> List[Dict]:
+    """Merge ranked result lists by summing 1 / (k + rank) per chunk.
+
+    Chunks are matched by content, so a chunk found by both retrievers is
+    boosted above chunks only one of them ranked highly.
+    """
+    fused: Dict[str, Dict] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            entry = fused.setdefault(result["content"], {
+                "content": result["content"],
+                "metadata": result["metadata"],
+                "chunk_set": result.get("chunk_set"),
+                "score": 0.0
+            })
+            entry["score"] += 1.0 / (k + rank)
+            if result.get("embedding") is not None:
+                entry["embedding"] = result["embedding"]
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:limit]
+
+class SearchService:
+    """Hybrid retrieval over document chunks.
+
+    Full-text search on the content_tsv GIN index catches exact terms and
+    identifiers that embeddings blur together; vector search catches
+    paraphrases. Their rankings are merged with reciprocal rank fusion.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.vector_store = VectorStore(db)
+
+    async def lexical_search(
+        self,
+        query: str,
+        document_ids: List[UUID],
+        limit: int = 3,
+        include_embeddings: bool = False
+    ) -> List[Dict]:
+        """Full-text search ranked with BM25.
+
+        Chunks are matched through the content_tsv GIN index, then the
+        best SEARCH_LEXICAL_POOL matches are rescored with BM25 over their
+        stemmed lexemes. Document frequencies and the average chunk length
+        come from that pool rather than the whole corpus, which keeps the
+        query to one index scan at the cost of approximate IDF weights.
+        """
+        try:
+            shards = await run_db(self.vector_store._chunk_sets, document_ids)
+            chunk_sets = list(dict.fromkeys(key for keys in shards.values() for key in keys))
+            if not chunk_sets:
+                return []
+            return await run_db(self._lexical_search, query, chunk_sets, limit, include_embeddings)
+        except Exception as e:
+            logger.error(f"Error performing full-text search: {e}")
+            raise Exception(f"Failed to perform full-text search: {str(e)}")
+
+    def _lexical_search(
+        self,
+        query: str,
+        chunk_sets: List[str],
+        limit: int,
+        include_embeddings: bool = False
+    ) -> List[Dict]:
+        # Match any of the query's terms (plainto_tsquery alone requires all
+        # of them); ts_rank_cd only picks the pool that BM25 rescores
+        sql_query = text("""
+            WITH q AS (
+                SELECT
+                    plainto_tsquery(CAST(:config AS regconfig), :query) AS terms,
+                    to_tsquery(
+                        CAST(:config AS regconfig),
+                        replace(plainto_tsquery(CAST(:config AS regconfig), :query)::text, ' & ', ' | ')
+                    ) AS query
+            )
+            SELECT
+                id,
+                chunk_set,
+                content,
+                chunk_metadata AS metadata,
+                content_tsv::text AS lexemes,
+                q.terms::text AS terms
+            FROM document_chunks, q
+            WHERE chunk_set = ANY(:chunk_sets)
+            AND content_tsv @@ q.query
+            ORDER BY ts_rank_cd(content_tsv, q.query, 1) DESC
+            LIMIT :pool
+        """)
+
+        rows = self.db.execute(
+            sql_query,
+            {
+                "config": settings.SEARCH_TEXT_CONFIG,
+                "query": query,
+                "chunk_sets": chunk_sets,
+                "pool": max(limit, settings.SEARCH_LEXICAL_POOL)
+            }
+        ).all()
+        if not rows:
+            return []
+
+        index = BM25Index.from_term_counts(parse_tsvector(row.lexemes) for row in rows)
+        scores = index.term_scores(parse_tsvector(rows[0].terms))
+        # Stable, so ties keep the ts_rank_cd order
+        ranked = sorted(range(len(rows)), key=lambda i: -scores[i])[:limit]
+
+        embeddings = {}
+        if include_embeddings:
+            embedding_rows = self.db.execute(
+                text("SELECT id, embedding::text AS embedding FROM document_chunks WHERE id = ANY(:ids)"),
+                {"ids": [rows[i].id for i in ranked]}
+            )
+            # pgvector's text form, '[x,y,...]', is a JSON array
+            embeddings = {
+                row.id: json.loads(row.embedding)
+                for row in embedding_rows if row.embedding is not None
+            }
+
+        matches = []
+        for i in ranked:
+            row = rows[i]
+            match = {
+                "content": row.content,
+                "metadata": row.metadata,
+                "chunk_set": row.chunk_set,
+                "score": float(scores[i])
+            }
+            if row.id in embeddings:
+                match["embedding"] = embeddings[row.id]
+            matches.append(match)
+        return matches
+
+    async def hybrid_search(
+        self,
+        query: str,
+        document_ids: List[UUID],
+        limit: int = 3,
+        query_embedding: Optional[List[float]] = None,
+        include_embeddings: bool = False
+    ) -> List[Dict]:
+        """Fuse full-text and vector search results.
+
+        Full-text search runs first; when the query names identifiers and
+        full-text hits contain all of them, those hits are returned without
+        embedding the query at all.
+        """
+        try:
+            candidates = max(limit, settings.SEARCH_CANDIDATES)
+            lexical = await self.lexical_search(
+                query,
+                document_ids,
+                limit=candidates,
+                include_embeddings=include_embeddings
+            )
+
+            identifiers = find_identifiers(query)
+            if identifiers:
+                exact = [
+                    hit for hit in lexical
+                    if all(identifier in hit["content"].lower() for identifier in identifiers)
+                ]
+                if exact:
+                    return exact[:limit]
+
+            vector = await self.vector_store.similarity_search(
+                query=query,
+                document_ids=document_ids,
+                limit=candidates,
+                similarity_threshold=settings.SEARCH_VECTOR_THRESHOLD,
+                query_embedding=query_embedding,
+                include_embeddings=include_embeddings
+            )
+            return reciprocal_rank_fusion([lexical, vector], settings.SEARCH_RRF_K, limit)
+
+        except Exception as e:
+            logger.error(f"Error performing hybrid search: {e}")
+            raise Exception(f"Failed to perform hybrid search: {str(e)}")
@@ -0,0 +1,359 @@
+from langchain.prompts import ChatPromptTemplate
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.executors import run_cpu, run_db, run_io
+from app.models.document import Document
+from app.models.document_table import DocumentTable
+from app.services.s3 import S3Service
+from app.services.llm import get_llm
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+import json
+import os
+import re
+import shutil
+import tempfile
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CSV_CONTENT_TYPE = "text/csv"
+TABULAR_CONTENT_TYPES = {
+    CSV_CONTENT_TYPE,
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+# Questions worth planning a table query for: they must ask for an
+# aggregate, since every plan costs an LLM call. Words like "where" or "per"
+# alone are common in ordinary questions.
+AGGREGATE_PATTERN = re.compile(
+    r"\b(sum|total|count|how many|number of|average|mean|median|max(imum)?|min(imum)?|"
+    r"highest|lowest|largest|smallest)\b",
+    re.IGNORECASE
+)
+
+OPERATIONS = {"sum", "count", "mean", "median", "min", "max", "rows"}
+FILTER_OPERATORS = {"==", "!=", ">", ">=", "<", "<=", "contains"}
+
+def read_tables(file_path: str, file_type: str, csv_name: str = "data") -> List[tuple]:
+    """(name, DataFrame) for every non-empty sheet of a spreadsheet or CSV"""
+    if file_type == CSV_CONTENT_TYPE:
+        sheets = {csv_name: pd.read_csv(file_path)}
+    else:
+        sheets = pd.read_excel(file_path, sheet_name=None)
+
+    tables = []
+    for name, frame in sheets.items():
+        frame = frame.dropna(how="all").dropna(axis=1, how="all")
+        if frame.empty:
+            continue
+        frame.columns = [str(column).strip() for column in frame.columns]
+        # Mixed-type text columns cannot be written as Parquet as they are
+        for column in frame.columns[frame.dtypes == object]:
+            frame[column] = frame[column].astype("string")
+        tables.append((str(name), frame.reset_index(drop=True)))
+    return tables
+
+def _describe_rows(frame: pd.DataFrame) -> List[str]:
+    """One line per column: value range for numbers and dates, common values for text"""
+    lines = []
+    for column in frame.columns:
+        values = frame[column].dropna()
+        if values.empty:
+            continue
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+            lines.append(f"{column}: {values.min()} to {values.max()}")
+        else:
+            common = values.astype(str).value_counts().head(5).index
+            lines.append(f"{column}: {', '.join(value[:50] for value in common)}")
+    return lines
+
+def prepare_tables(
+    file_path: str,
+    file_type: str,
+    output_dir: str,
+    row_group_size: int,
+    csv_name: str = "data"
+) -> List[Dict]:
+    """Write each sheet as Parquet and describe it for embedding.
+
+    Module-level so it can run in a worker process. Only a header summary
+    and one summary per row group are embedded, never the rows themselves.
+    """
+    prepared = []
+    for index, (name, frame) in enumerate(read_tables(file_path, file_type, csv_name)):
+        path = os.path.join(output_dir, f"table-{index}.parquet")
+        frame.to_parquet(path, index=False, row_group_size=row_group_size)
+        columns = [{"name": column, "dtype": str(dtype)} for column, dtype in frame.dtypes.items()]
+
+        header = [
+            f"Table '{name}' with {len(frame)} rows and columns: "
+            + ", ".join(f"{column['name']} ({column['dtype']})" for column in columns),
+            "First rows:"
+        ]
+        header.extend(
+            "; ".join(f"{column}: {value}" for column, value in row.items() if pd.notna(value))
+            for row in frame.head(3).to_dict("records")
+        )
+        summaries = [{"content": "\n".join(header), "row_start": 0, "row_end": len(frame)}]
+        for start in range(0, len(frame), row_group_size):
+            rows = frame.iloc[start:start + row_group_size]
+            summaries.append({
+                "content": "\n".join(
+                    [f"Rows {start + 1}-{start + len(rows)} of table '{name}':"] + _describe_rows(rows)
+                ),
+                "row_start": start,
+                "row_end": start + len(rows)
+            })
+
+        prepared.append({
+            "name": name,
+            "path": path,
+            "columns": columns,
+            "row_count": len(frame),
+            "summaries": summaries
+        })
+    return prepared
+
+def run_table_query(frame: pd.DataFrame, spec: Dict) -> Tuple[str, int]:
+    """Execute a planned query against a table.
+
+    Returns the result as text and the number of rows left after the
+    filters. Only whitelisted pandas operations run; the plan is data,
+    never code.
+    """
+    operation = spec.get("operation")
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unsupported operation: {operation}")
+    for key in ("column", "group_by"):
+        if spec.get(key) is not None and spec[key] not in frame.columns:
+            raise ValueError(f"Unknown column: {spec[key]}")
+
+    mask = pd.Series(True, index=frame.index)
+    for condition in spec.get("filters") or []:
+        column, operator, value = condition.get("column"), condition.get("op"), condition.get("value")
+        if column not in frame.columns or operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter: {condition}")
+        series = frame[column]
+        if operator == "contains":
+            mask &= series.astype(str).str.contains(str(value), case=False, na=False, regex=False)
+            continue
+        if pd.api.types.is_numeric_dtype(series):
+            value = float(value)
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            value = pd.Timestamp(value)
+        else:
+            series = series.astype(str).str.lower()
+            value = str(value).lower()
+        mask &= {
+            "==": series == value,
+            "!=": series != value,
+            ">": series > value,
+            ">=": series >= value,
+            "<": series < value,
+            "<=": series <= value
+        }[operator].fillna(False)
+    selected = frame[mask]
+    return _aggregate(selected, operation, spec), len(selected)
+
+def _aggregate(selected: pd.DataFrame, operation: str, spec: Dict) -> str:
+    limit = min(int(spec.get("limit") or 20), 100)
+    if operation == "rows":
+        return selected.head(limit).to_csv(index=False)
+
+    if operation == "count":
+        if spec.get("group_by"):
+            return selected.groupby(spec["group_by"]).size().sort_values(ascending=False).head(limit).to_string()
+        return str(len(selected))
+
+    if not spec.get("column"):
+        raise ValueError(f"{operation} needs a column")
+    target = selected[spec["column"]]
+    if spec.get("group_by"):
+        result = getattr(target.groupby(selected[spec["group_by"]]), operation)()
+        return result.sort_values(ascending=False).head(limit).to_string()
+    return str(getattr(target, operation)())
+
+class TableService:
+    """Columnar storage of spreadsheet content and direct answering of aggregate questions"""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.s3_service = S3Service()
+        self.plan_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You translate questions about tables into a JSON query plan.
+            Reply with JSON only, in this form:
+            {{"table": <table number>, "operation": "sum" | "count" | "mean" | "median" | "min" | "max" | "rows",
+              "column": <column name or null>, "group_by": <column name or null>,
+              "filters": [{{"column": <column name>, "op": "==" | "!=" | ">" | ">=" | "<" | "<=" | "contains", "value": <value>}}],
+              "limit": <max rows for "rows" or grouped results>}}
+            Use exact column names. Reply {{"table": null}} if the tables cannot answer the question."""),
+            ("user", """Tables:
+            {tables}
+
+            Question: {question}""")
+        ])
+
+    async def ingest(self, document: Document, file_path: str, work_dir: str) -> List[Dict]:
+        """Store a spreadsheet's tables and return the summary chunks to embed"""
+        chunk_set = document.chunk_set
+        prepared = await run_cpu(
+            prepare_tables,
+            file_path,
+            document.content_type,
+            work_dir,
+            settings.TABLE_ROW_GROUP_SIZE,
+            document.title
+        )
+
+        # Replace whatever an earlier attempt stored for this content
+        await self.delete_tables(chunk_set)
+
+        tables = []
+        chunks = []
+        for index, table in enumerate(prepared):
+            with open(table["path"], "rb") as f:
+                file_url = await self.s3_service.upload_file(f, f"tables/{chunk_set}/table-{index}.parquet")
+            db_table = DocumentTable(
+                chunk_set=chunk_set,
+                name=table["name"],
+                file_url=file_url,
+                columns=table["columns"],
+                row_count=table["row_count"]
+            )
+            tables.append(db_table)
+            for summary in table["summaries"]:
+                chunks.append({
+                    "content": summary["content"],
+                    "metadata": {
+                        "chunk_index": len(chunks),
+                        "page_number": None,
+                        "table": table["name"],
+                        "row_start": summary["row_start"],
+                        "row_end": summary["row_end"]
+                    }
+                })
+        await run_db(self._save_tables, tables)
+        logger.info(f"Stored {len(tables)} tables for {chunk_set} with {len(chunks)} summary chunks")
+        return chunks
+
+    def _save_tables(self, tables: List[DocumentTable]) -> None:
+        try:
+            self.db.add_all(tables)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def delete_tables(self, chunk_set: str) -> None:
+        """Delete the tables of a chunk set and their Parquet files"""
+        file_urls = await run_db(self._delete_tables, chunk_set)
+        for file_url in file_urls:
+            await self.s3_service.delete_file(self.s3_service.get_file_key(file_url))
+        shutil.rmtree(os.path.join(settings.VECTOR_INDEX_DIR, "tables", chunk_set), ignore_errors=True)
+
+    def _delete_tables(self, chunk_set: str) -> List[str]:
+        try:
+            tables = self.db.query(DocumentTable).filter(DocumentTable.chunk_set == chunk_set).all()
+            file_urls = [table.file_url for table in tables]
+            for table in tables:
+                self.db.delete(table)
+            self.db.commit()
+            return file_urls
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _tables_for(self, document_ids: List[UUID]) -> List[Dict]:
+        documents = self.db.query(Document).filter(Document.id.in_(document_ids)).all()
+        titles = {document.chunk_set: document.title for document in documents}
+        if not titles:
+            return []
+        tables = self.db.query(DocumentTable)\
+            .filter(DocumentTable.chunk_set.in_(list(titles)))\
+            .order_by(DocumentTable.chunk_set, DocumentTable.name)\
+            .all()
+        return [
+            {
+                "id": table.id,
+                "chunk_set": table.chunk_set,
+                "name": table.name,
+                "document": titles[table.chunk_set],
+                "file_url": table.file_url,
+                "columns": table.columns,
+                "row_count": table.row_count
+            }
+            for table in tables
+        ]
+
+    async def load_frame(self, table: Dict) -> pd.DataFrame:
+        """Read a table, keeping a local copy of its Parquet file for later questions"""
+        path = os.path.join(
+            settings.VECTOR_INDEX_DIR,
+            "tables",
+            table["chunk_set"],
+            os.path.basename(table["file_url"])
+        )
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            os.close(fd)
+            try:
+                await self.s3_service.download_file(self.s3_service.get_file_key(table["file_url"]), partial)
+                os.replace(partial, path)
+            except Exception:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise
+        return await run_io(pd.read_parquet, path)
+
+    async def answer_context(self, question: str, document_ids: List[UUID]) -> Optional[Dict]:
+        """Compute the answer to an aggregate question from the documents' tables.
+
+        Returns a source to put in front of the retrieved chunks, or None
+        when the question is not aggregate, there are no tables, or no valid
+        plan could be made.
+        """
+        if not AGGREGATE_PATTERN.search(question):
+            return None
+        tables = await run_db(self._tables_for, document_ids)
+        if not tables:
+            return None
+
+        listing = "\n".join(
+            f"{number}. '{table['name']}' from '{table['document']}', {table['row_count']} rows: "
+            + ", ".join(f"{column['name']} ({column['dtype']})" for column in table["columns"])
+            for number, table in enumerate(tables)
+        )
+        try:
+            response = await (self.plan_prompt | get_llm()).ainvoke({"tables": listing, "question": question})
+            plan_text = response.content.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+            plan = json.loads(plan_text)
+            if plan.get("table") is None:
+                return None
+            number = int(plan["table"])
+            if not 0 <= number < len(tables):
+                raise ValueError(f"Unknown table: {plan['table']}")
+            table = tables[number]
+            frame = await self.load_frame(table)
+            result, row_count = await run_io(run_table_query, frame, plan)
+        except Exception as e:
+            logger.warning(f"Could not answer from tables: {e}")
+            return None
+
+        description = f"{plan['operation']}({plan.get('column') or '*'})"
+        if plan.get("group_by"):
+            description += f" by {plan['group_by']}"
+        if plan.get("filters"):
+            description += " where " + " and ".join(
+                f"{f['column']} {f['op']} {f['value']}" for f in plan["filters"]
+            )
+        rows = f"all {row_count}" if row_count == table["row_count"] else f"{row_count} of {table['row_count']}"
+        return {
+            "content": f"Computed from {rows} rows of table '{table['name']}': "
+                       f"{description} =\n{result}",
+            "metadata": {"table": table["name"], "query": plan},
+            "score": 1.0
+        }
@@ -1,27 +1,95 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, and_, cast, func, or_, tuple_, String
 from sqlalchemy.orm import Session
 from app.core.config import get_settings
-from app.models.document import DocumentChunk
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from app.models.document import Document, DocumentChunk
+from app.models.ingestion_job import IngestionJob, IngestionJobStatus
+from app.services.embedding_store import EmbeddingStore
+from app.services.ann_index import AnnIndexManager, get_ann_index
+from app.services.embeddings import get_embeddings, get_embedding_scheduler
+from app.services.cache import normalize_text
+from app.services.bulk_insert import bulk_insert
+from app.services.tables import TableService
+from app.core.executors import run_db, run_io
+from app.db.pgvector import vector_search_params
 import numpy as np
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
+from datetime import datetime
+import hashlib
 import logging
-from uuid import UUID
+import time
+from uuid import UUID, uuid4
 
 logger = logging.getLogger(__name__)
 
+# Prefix of the chunk_set of rows staged by a ChunkSetWriter
+STAGING_PREFIX = "staging-"
+
+def chunk_content_hash(content: str) -> str:
+    """Hex SHA-256 identifying a chunk's text, ignoring whitespace differences"""
+    return hashlib.sha256(normalize_text(content).encode("utf-8")).hexdigest()
+
+def staging_document_id(staging_key: str) -> Optional[UUID]:
+    """Document whose ChunkSetWriter staged rows under a key"""
+    try:
+        return UUID(staging_key[len(STAGING_PREFIX):].split("-")[0])
+    except ValueError:
+        return None
+
 class VectorStore:
+    """Chunks and embeddings of documents, stored per chunk set.
+
+    A chunk set (Document.chunk_set) is shared by every document with the
+    same file content, so callers address documents while storage and the
+    search indexes are keyed by chunk set.
+    """
+
     def __init__(self, db: Session):
         self.db = db
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001",  # this is Google's text embedding model
-            google_api_key=get_settings().GOOGLE_API_KEY
+        self.embeddings = get_embeddings()
+        # Shared by every VectorStore in the process so concurrent uploads coalesce
+        self.embedding_scheduler = get_embedding_scheduler(self.embeddings)
+        self.local_store = EmbeddingStore()
+        self.ann_index = get_ann_index() if get_settings().VECTOR_SEARCH_BACKEND == "faiss" else None
+
+    def _chunk_sets(self, document_ids: List[UUID]) -> Dict[str, List[str]]:
+        """Group the chunk sets of documents by the ANN shard that holds them.
+
+        A document whose replacement is still being ingested keeps searching
+        the previous version's set until the new one is swapped in.
+        """
+        rows = self.db.query(Document).filter(Document.id.in_(document_ids)).all()
+        replaced = dict(
+            self.db.query(IngestionJob.document_id, IngestionJob.previous_chunk_set)
+            .filter(
+                IngestionJob.document_id.in_(document_ids),
+                IngestionJob.status.in_([IngestionJobStatus.QUEUED, IngestionJobStatus.RUNNING]),
+                IngestionJob.previous_chunk_set.isnot(None)
+            )
+            .all()
         )
-        
+        shards: Dict[str, List[str]] = {}
+        for document in rows:
+            key = AnnIndexManager.shard_key(document.id, document.user_id)
+            chunk_sets = shards.setdefault(key, [])
+            chunk_set = document.chunk_set
+            if document.id in replaced and self.db.query(DocumentChunk.id)\
+                    .filter(DocumentChunk.chunk_set == chunk_set)\
+                    .first() is None:
+                chunk_set = replaced[document.id]
+            if chunk_set not in chunk_sets:
+                chunk_sets.append(chunk_set)
+        return shards
+
+    def _get_document(self, document_id: UUID) -> Document:
+        document = self.db.query(Document).filter(Document.id == document_id).first()
+        if document is None:
+            raise Exception("Document not found")
+        return document
+
     async def create_embedding(self, text: str) -> List[float]:
         """Create embedding for a single text"""
         try:
-            return await self.embeddings.embed_query(text)
+            return await self.embedding_scheduler.embed_query(text)
         except Exception as e:
             logger.error(f"Error creating embedding: {e}")
             raise Exception(f"Failed to create embedding: {str(e)}")
@@ -29,105 +97,381 @@ class VectorStore:
     async def create_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Create embeddings for multiple texts"""
         try:
-            return await self.embeddings.embed_documents(texts)
+            return await self.embedding_scheduler.embed_documents(texts)
         except Exception as e:
             logger.error(f"Error creating embeddings: {e}")
             raise Exception(f"Failed to create embeddings: {str(e)}")
 
+    async def open_chunk_set(
+        self,
+        document_id: UUID,
+        previous_chunk_set: Optional[str] = None
+    ) -> "ChunkSetWriter":
+        """Start writing a document's chunk set batch by batch.
+
+        previous_chunk_set is the set of the version being replaced; chunks
+        whose content it already holds reuse its embeddings.
+        """
+        document = await run_db(self._get_document, document_id)
+        if previous_chunk_set == document.chunk_set:
+            previous_chunk_set = None
+        known = await run_db(
+            self._known_chunks,
+            [key for key in (document.chunk_set, previous_chunk_set) if key]
+        )
+        adopt_previous = previous_chunk_set is not None \
+            and await run_db(self._is_unreferenced, previous_chunk_set)
+        return ChunkSetWriter(self, document, previous_chunk_set, known, adopt_previous)
+
     async def store_document_chunks(
-        self, 
-        document_id: UUID, 
-        chunks: List[Dict]
-    ) -> None:
-        """Store document chunks with their embeddings"""
-        try:
-            # Create embeddings for all chunks
-            texts = [chunk['content'] for chunk in chunks]
-            embeddings = await self.create_embeddings(texts)
-            
-            # Store chunks and embeddings
-            for chunk, embedding in zip(chunks, embeddings):
-                db_chunk = DocumentChunk(
-                    document_id=document_id,
-                    content=chunk['content'],
-                    metadata=chunk.get('metadata', {}),
-                    embedding=embedding
-                )
-                self.db.add(db_chunk)
-            
-            self.db.commit()
-            
+        self,
+        document_id: UUID,
+        chunks: List[Dict],
+        previous_chunk_set: Optional[str] = None
+    ) -> Dict[str, float]:
+        """Store a document's chunks with their embeddings, replacing its chunk set.
+
+        Returns counts of stored, embedded and reused chunks, and the time
+        spent embedding and inserting them.
+        """
+        try:
+            writer = await self.open_chunk_set(document_id, previous_chunk_set)
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Error storing document chunks: {e}")
             raise Exception(f"Failed to store document chunks: {str(e)}")
+        try:
+            await writer.add(chunks)
+            return await writer.commit()
+        except Exception:
+            await writer.abort()
+            raise
+
+    def _known_chunks(self, chunk_sets: List[str]) -> Dict[str, Dict]:
+        """Existing rows of some chunk sets by content hash, earlier sets first"""
+        if not chunk_sets:
+            return {}
+        rows = self.db.query(DocumentChunk.id, DocumentChunk.chunk_set, DocumentChunk.content_hash)\
+            .filter(
+                DocumentChunk.chunk_set.in_(chunk_sets),
+                DocumentChunk.content_hash.isnot(None)
+            )\
+            .all()
+        known: Dict[str, Dict] = {}
+        for row in sorted(rows, key=lambda row: chunk_sets.index(row.chunk_set)):
+            known.setdefault(row.content_hash, {"id": row.id, "chunk_set": row.chunk_set})
+        return known
+
+    def _embeddings_for(self, chunk_ids: List[UUID]) -> Dict[UUID, List[float]]:
+        if not chunk_ids:
+            return {}
+        rows = self.db.query(DocumentChunk.id, DocumentChunk.embedding)\
+            .filter(DocumentChunk.id.in_(chunk_ids))\
+            .all()
+        return {row.id: [float(value) for value in row.embedding] for row in rows}
+
+    def _is_unreferenced(self, chunk_set: str) -> bool:
+        """Whether no document searches a chunk set any more"""
+        return self.db.query(Document.id)\
+            .filter(or_(
+                Document.content_hash == chunk_set,
+                and_(Document.content_hash.is_(None), cast(Document.id, String) == chunk_set)
+            ))\
+            .first() is None
+
+    def _insert_chunks(self, rows: List[Dict]) -> Dict:
+        try:
+            stats = bulk_insert(
+                self.db,
+                DocumentChunk.__table__,
+                rows,
+                get_settings().CHUNK_INSERT_BATCH_SIZE,
+                get_settings().CHUNK_INSERT_METHOD
+            )
+            self.db.commit()
+            return stats
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _swap_chunk_set(
+        self,
+        chunk_set: str,
+        staging_key: str,
+        moved: Dict[UUID, Dict],
+        retired_chunk_set: Optional[str] = None
+    ) -> None:
+        # One transaction, so readers never see a half-old set
+        try:
+            self.db.query(DocumentChunk)\
+                .filter(DocumentChunk.chunk_set == chunk_set)\
+                .delete()
+            self.db.query(DocumentChunk)\
+                .filter(DocumentChunk.chunk_set == staging_key)\
+                .update({DocumentChunk.chunk_set: chunk_set}, synchronize_session=False)
+            for chunk_id, values in moved.items():
+                self.db.query(DocumentChunk)\
+                    .filter(DocumentChunk.id == chunk_id)\
+                    .update(values, synchronize_session=False)
+            if retired_chunk_set is not None:
+                # Whatever was not moved over is stale
+                self.db.query(DocumentChunk)\
+                    .filter(DocumentChunk.chunk_set == retired_chunk_set)\
+                    .delete()
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def retire_chunk_set(self, chunk_set: str, document_id: UUID) -> None:
+        """Stop serving a chunk set a document no longer uses.
+
+        Its rows and indexes are deleted if no other document uses it;
+        otherwise it is only dropped from the owner's ANN shard, if the owner
+        has no other document with that content.
+        """
+        document = await run_db(self._get_document, document_id)
+        shard_key = AnnIndexManager.shard_key(document.id, document.user_id)
+        if await run_db(self._is_unreferenced, chunk_set):
+            await run_db(self._delete_chunks, chunk_set)
+            await self.delete_chunk_set(chunk_set, [shard_key])
+        elif not await run_db(self._owner_references, document.user_id, chunk_set):
+            await self.unlink_chunk_set(chunk_set, [shard_key])
+
+    def _owner_references(self, user_id: UUID, chunk_set: str) -> bool:
+        return self.db.query(Document.id)\
+            .filter(Document.user_id == user_id, Document.content_hash == chunk_set)\
+            .first() is not None
+
+    def _delete_chunks(self, chunk_set: str) -> None:
+        try:
+            self.db.query(DocumentChunk)\
+                .filter(DocumentChunk.chunk_set == chunk_set)\
+                .delete()
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    async def link_document(self, document_id: UUID) -> None:
+        """Make an already-embedded chunk set searchable for another document.
+
+        Only the ANN backend needs work: its shards are per user, so a set
+        first embedded for one user is copied into the new owner's shard.
+        """
+        if self.ann_index is None:
+            return
+        try:
+            document = await run_db(self._get_document, document_id)
+            shard_key = AnnIndexManager.shard_key(document.id, document.user_id)
+            count = await run_db(self._count_chunks, document.chunk_set)
+            writer = await run_io(self.ann_index.open_document, shard_key, document.chunk_set, count)
+            try:
+                async for chunks, embeddings in self.iter_chunk_set(document.chunk_set):
+                    await run_io(writer.write, chunks, embeddings)
+                await run_io(writer.commit)
+            except Exception:
+                await run_io(writer.abort)
+                raise
+        except Exception as e:
+            logger.error(f"Error linking document chunks: {e}")
+            raise Exception(f"Failed to link document chunks: {str(e)}")
+
+    def _count_chunks(self, chunk_set: str) -> int:
+        return self.db.query(DocumentChunk.id)\
+            .filter(DocumentChunk.chunk_set == chunk_set)\
+            .count()
+
+    def _chunk_page(
+        self,
+        chunk_set: str,
+        after: Optional[Tuple[int, UUID]],
+        limit: int
+    ) -> Tuple[List[Dict], List[List[float]]]:
+        query = self.db.query(
+            DocumentChunk.id,
+            DocumentChunk.chunk_index,
+            DocumentChunk.content,
+            DocumentChunk.chunk_metadata,
+            DocumentChunk.embedding
+        ).filter(DocumentChunk.chunk_set == chunk_set)
+        if after is not None:
+            # Keyset pagination: each page is an index range scan, however deep
+            query = query.filter(tuple_(DocumentChunk.chunk_index, DocumentChunk.id) > after)
+        rows = query.order_by(DocumentChunk.chunk_index, DocumentChunk.id).limit(limit).all()
+        chunks = [
+            {
+                "id": row.id,
+                "chunk_index": row.chunk_index,
+                "content": row.content,
+                "metadata": row.chunk_metadata
+            }
+            for row in rows
+        ]
+        return chunks, [[float(value) for value in row.embedding] for row in rows]
+
+    async def iter_chunk_set(self, chunk_set: str) -> AsyncIterator[Tuple[List[Dict], List[List[float]]]]:
+        """A chunk set's chunks and embeddings in chunk order, a page at a time"""
+        page_size = get_settings().CHUNK_INSERT_BATCH_SIZE
+        after = None
+        while True:
+            chunks, embeddings = await run_db(self._chunk_page, chunk_set, after, page_size)
+            if not chunks:
+                return
+            yield chunks, embeddings
+            after = (chunks[-1]["chunk_index"], chunks[-1]["id"])
 
     async def similarity_search(
         self,
         query: str,
         document_ids: List[UUID],
         limit: int = 3,
-        similarity_threshold: float = 0.7
+        similarity_threshold: float = 0.7,
+        query_embedding: Optional[List[float]] = None,
+        include_embeddings: bool = False
     ) -> List[Dict]:
         """
-        Perform similarity search against stored document chunks
+        Perform similarity search against stored document chunks.
+
+        With include_embeddings, matches carry their embedding where the
+        index keeps one, for diversity-aware context building.
         """
         try:
-            # Create query embedding
-            query_embedding = await self.create_embedding(query)
-            
-            # Convert document_ids to strings for SQL
-            doc_ids_str = ",".join([f"'{id}'" for id in document_ids])
-            
-            # Perform similarity search using cosine similarity
-            sql_query = text("""
-                SELECT 
-                    content,
-                    metadata,
-                    1 - (embedding <-> :query_embedding) as similarity
-                FROM document_chunks
-                WHERE document_id = ANY(:document_ids)
-                AND 1 - (embedding <-> :query_embedding) > :similarity_threshold
-                ORDER BY embedding <-> :query_embedding
-                LIMIT :limit
-            """)
-            
-            result = self.db.execute(
-                sql_query,
-                {
-                    "query_embedding": query_embedding,
-                    "document_ids": document_ids,
-                    "similarity_threshold": similarity_threshold,
-                    "limit": limit
-                }
+            # Create query embedding unless the caller already has one
+            if query_embedding is None:
+                query_embedding = await self.create_embedding(query)
+
+            shards = await run_db(self._chunk_sets, document_ids)
+            chunk_sets = list(dict.fromkeys(key for keys in shards.values() for key in keys))
+            if not chunk_sets:
+                return []
+
+            if self.ann_index is not None:
+                matches = await run_io(
+                    self.ann_index.search, query_embedding, shards, limit, include_embeddings
+                )
+                # None: some chunk set is not in this host's shards, so use the database
+                if matches is not None:
+                    results = []
+                    for match in matches:
+                        if match["score"] <= similarity_threshold:
+                            continue
+                        result = {
+                            "content": match["content"],
+                            "metadata": match["metadata"],
+                            # ANN and local indexes are keyed by chunk set
+                            "chunk_set": match["document_id"],
+                            "score": match["score"]
+                        }
+                        if include_embeddings:
+                            result["embedding"] = match["embedding"]
+                        results.append(result)
+                    return results
+
+            # Prefer the local memory-mapped index when every chunk set has one
+            if get_settings().VECTOR_SEARCH_BACKEND != "pgvector":
+                matches = self.local_store.similarity_search(
+                    query_embedding,
+                    chunk_sets,
+                    limit=limit,
+                    similarity_threshold=similarity_threshold,
+                    include_embeddings=include_embeddings
+                )
+                if matches is not None:
+                    for match in matches:
+                        match["chunk_set"] = match.pop("document_id")
+                    return matches
+
+            return await run_db(
+                self._sql_similarity_search,
+                query_embedding,
+                chunk_sets,
+                limit,
+                similarity_threshold,
+                include_embeddings
             )
-            
-            matches = []
-            for row in result:
-                matches.append({
-                    "content": row.content,
-                    "metadata": row.metadata,
-                    "score": float(row.similarity)
-                })
-            
-            return matches
-            
+
         except Exception as e:
             logger.error(f"Error performing similarity search: {e}")
             raise Exception(f"Failed to perform similarity search: {str(e)}")
 
-    async def delete_document_chunks(self, document_id: UUID) -> None:
-        """Delete all chunks for a document"""
+    def _sql_similarity_search(
+        self,
+        query_embedding: List[float],
+        chunk_sets: List[str],
+        limit: int,
+        similarity_threshold: float,
+        include_embeddings: bool = False
+    ) -> List[Dict]:
+        # Cosine distance, so the vector_cosine_ops index serves the ORDER BY
+        distance = DocumentChunk.embedding.cosine_distance(query_embedding)
+        columns = [
+            DocumentChunk.chunk_set,
+            DocumentChunk.content,
+            DocumentChunk.chunk_metadata,
+            distance.label("distance")
+        ]
+        if include_embeddings:
+            columns.append(DocumentChunk.embedding)
+        exact = self._is_small_selection(chunk_sets)
+        with vector_search_params(self.db, limit, exact=exact):
+            rows = self.db.query(*columns)\
+                .filter(
+                    DocumentChunk.chunk_set.in_(chunk_sets),
+                    distance < 1 - similarity_threshold
+                )\
+                .order_by(distance)\
+                .limit(limit)\
+                .all()
+
+        matches = []
+        for row in rows:
+            match = {
+                "content": row.content,
+                "metadata": row.chunk_metadata,
+                "chunk_set": row.chunk_set,
+                "score": 1 - float(row.distance)
+            }
+            if include_embeddings:
+                match["embedding"] = row.embedding
+            matches.append(match)
+
+        # An iterative IVFFlat scan may return rows slightly out of order
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return matches
+
+    def _is_small_selection(self, chunk_sets: List[str]) -> bool:
+        """Whether the chunk sets are small enough to compare every row exactly.
+
+        A filter matching a sliver of a large table is where the ANN index
+        returns too few rows, and where an exact scan is cheapest.
+        """
+        max_rows = get_settings().PGVECTOR_EXACT_SEARCH_MAX_ROWS
+        if max_rows <= 0:
+            return False
+        # Counts at most max_rows + 1 rows, so large selections stay cheap to check
+        selected = self.db.query(DocumentChunk.id)\
+            .filter(DocumentChunk.chunk_set.in_(chunk_sets))\
+            .limit(max_rows + 1)\
+            .subquery()
+        return self.db.query(func.count()).select_from(selected).scalar() <= max_rows
+
+    async def delete_chunk_set(self, chunk_set: str, shard_keys: List[str]) -> None:
+        """Drop the search indexes and tables of a chunk set whose rows were deleted"""
         try:
-            self.db.query(DocumentChunk)\
-                .filter(DocumentChunk.document_id == document_id)\
-                .delete()
-            self.db.commit()
+            await run_io(self.local_store.delete_document, chunk_set)
+            await TableService(self.db).delete_tables(chunk_set)
+            await self.unlink_chunk_set(chunk_set, shard_keys)
         except Exception as e:
-            self.db.rollback()
             logger.error(f"Error deleting document chunks: {e}")
             raise Exception(f"Failed to delete document chunks: {str(e)}")
 
+    async def unlink_chunk_set(self, chunk_set: str, shard_keys: List[str]) -> None:
+        """Drop a chunk set from ANN shards whose owners no longer reference it"""
+        if self.ann_index is None:
+            return
+        for key in shard_keys:
+            await run_io(self.ann_index.remove_document, key, chunk_set)
+
     async def get_document_chunks(
         self,
         document_id: UUID,
@@ -136,20 +480,209 @@ class VectorStore:
     ) -> List[Dict]:
         """Get chunks for a document with pagination"""
         try:
-            chunks = self.db.query(DocumentChunk)\
-                .filter(DocumentChunk.document_id == document_id)\
-                .offset(offset)\
-                .limit(limit)\
-                .all()
-                
-            return [
-                {
-                    "content": chunk.content,
-                    "metadata": chunk.metadata,
-                    "created_at": chunk.created_at
-                }
-                for chunk in chunks
-            ]
+            return await run_db(self._get_document_chunks, document_id, offset, limit)
         except Exception as e:
             logger.error(f"Error getting document chunks: {e}")
-            raise Exception(f"Failed to get document chunks: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to get document chunks: {str(e)}")
+
+    def _get_document_chunks(self, document_id: UUID, offset: int, limit: int) -> List[Dict]:
+        chunk_set = self._get_document(document_id).chunk_set
+        chunks = self.db.query(DocumentChunk)\
+            .filter(DocumentChunk.chunk_set == chunk_set)\
+            .order_by(DocumentChunk.chunk_index)\
+            .offset(offset)\
+            .limit(limit)\
+            .all()
+
+        return [
+            {
+                "content": chunk.content,
+                "metadata": chunk.chunk_metadata,
+                "created_at": chunk.created_at
+            }
+            for chunk in chunks
+        ]
+
+class ChunkSetWriter:
+    """Writes a document's chunk set incrementally, then swaps it in atomically.
+
+    Each batch passed to add() is embedded and inserted right away under a
+    private staging key, so ingestion can store chunks while later pages are
+    still being parsed. commit() replaces the live set in one transaction,
+    then copies it into the local and ANN indexes a page at a time.
+
+    Chunks whose content hash is already in the live set (left by a failed
+    attempt), the previous version's set or an earlier batch reuse that
+    embedding, so only new or changed chunks are embedded. If nothing else
+    references the previous set, its unchanged rows are moved into the new
+    set and the stale rest deleted by the same transaction. Until then the
+    document keeps searching the previous set.
+    """
+
+    def __init__(
+        self,
+        store: VectorStore,
+        document: Document,
+        previous_chunk_set: Optional[str],
+        known: Dict[str, Dict],
+        adopt_previous: bool
+    ):
+        self.store = store
+        self.document_id = document.id
+        self.chunk_set = document.chunk_set
+        # Shared sets must not be cascade-deleted along with the first document
+        self.owner_id = None if document.content_hash else document.id
+        self.shard_key = AnnIndexManager.shard_key(document.id, document.user_id)
+        self.previous_chunk_set = previous_chunk_set
+        self.adopt_previous = adopt_previous
+        self.known = known
+        # Names the document, so rows left by a dead worker can be swept (IngestionQueue)
+        self.staging_key = f"{STAGING_PREFIX}{document.id.hex}-{uuid4().hex[:8]}"
+        self.moved: Dict[UUID, Dict] = {}
+        self.stats = {
+            "chunks": 0,
+            "embedded": 0,
+            "reused": 0,
+            "embed_seconds": 0.0,
+            "insert_seconds": 0.0,
+            "insert_batches": 0
+        }
+
+    async def add(self, chunks: List[Dict]) -> None:
+        """Embed and stage a batch of chunks"""
+        if not chunks:
+            return
+        started = time.perf_counter()
+        try:
+            hashes = [chunk_content_hash(chunk['content']) for chunk in chunks]
+
+            # Create embeddings only for content not seen before
+            missing = list(dict.fromkeys(
+                chunk['content'] for chunk, content_hash in zip(chunks, hashes)
+                if content_hash not in self.known
+            ))
+            embedded = dict(zip(missing, await self.store.create_embeddings(missing)))
+            reused = await run_db(
+                self.store._embeddings_for,
+                list({self.known[h]["id"] for h in hashes if h in self.known})
+            )
+
+            rows = []
+            for idx, (chunk, content_hash) in enumerate(zip(chunks, hashes)):
+                metadata = chunk.get('metadata', {})
+                chunk_index = metadata.get('chunk_index', self.stats["chunks"] + idx)
+                previous = self.known.get(content_hash)
+
+                if previous is not None and self.adopt_previous \
+                        and previous["chunk_set"] == self.previous_chunk_set \
+                        and previous["id"] not in self.moved:
+                    # Unchanged chunk of a retired version: move the row instead of copying it
+                    self.moved[previous["id"]] = {
+                        "document_id": self.owner_id,
+                        "chunk_set": self.chunk_set,
+                        "chunk_index": chunk_index,
+                        "chunk_metadata": metadata
+                    }
+                    continue
+
+                row = {
+                    "id": uuid4(),
+                    "document_id": self.owner_id,
+                    "chunk_set": self.staging_key,
+                    "content_hash": content_hash,
+                    "content": chunk['content'],
+                    "chunk_index": chunk_index,
+                    "chunk_metadata": metadata,
+                    "embedding": embedded[chunk['content']] if chunk['content'] in embedded else reused[previous["id"]],
+                    "created_at": datetime.utcnow()
+                }
+                rows.append(row)
+                if previous is None:
+                    # Later repeats of this content reuse the new row's embedding
+                    self.known[content_hash] = {"id": row["id"], "chunk_set": self.staging_key}
+            embedded_at = time.perf_counter()
+
+            insert_stats = await run_db(self.store._insert_chunks, rows)
+
+        except Exception as e:
+            logger.error(f"Error storing document chunks: {e}")
+            raise Exception(f"Failed to store document chunks: {str(e)}")
+
+        self.stats["chunks"] += len(chunks)
+        self.stats["embedded"] += len(missing)
+        self.stats["reused"] += len(chunks) - len(missing)
+        self.stats["embed_seconds"] += embedded_at - started
+        self.stats["insert_seconds"] += insert_stats["write_seconds"] + insert_stats["encode_seconds"]
+        self.stats["insert_batches"] += insert_stats["batches"]
+
+    async def commit(self) -> Dict[str, float]:
+        """Make the staged chunks the document's live chunk set"""
+        try:
+            await run_db(
+                self.store._swap_chunk_set,
+                self.chunk_set,
+                self.staging_key,
+                self.moved,
+                self.previous_chunk_set if self.adopt_previous else None
+            )
+        except Exception as e:
+            logger.error(f"Error storing document chunks: {e}")
+            raise Exception(f"Failed to store document chunks: {str(e)}")
+        logger.info(f"Stored chunk set {self.chunk_set}: {self.stats}")
+
+        await self._write_indexes()
+
+        if self.previous_chunk_set is not None:
+            await self.store.retire_chunk_set(self.previous_chunk_set, self.document_id)
+
+        return dict(self.stats)
+
+    async def _write_indexes(self) -> None:
+        """Copy the committed set into the local store and the ANN shard a page at a time.
+
+        The database stays the source of truth, so a failed local index only
+        costs search speed.
+        """
+        store = self.store
+        count = await run_db(store._count_chunks, self.chunk_set)
+        try:
+            local = await run_io(store.local_store.open_document, self.chunk_set, count)
+        except Exception as e:
+            logger.warning(f"Failed to write local embedding index for {self.chunk_set}: {e}")
+            local = None
+        ann = None
+        if store.ann_index is not None:
+            ann = await run_io(store.ann_index.open_document, self.shard_key, self.chunk_set, count)
+        try:
+            async for chunks, embeddings in store.iter_chunk_set(self.chunk_set):
+                if local is not None:
+                    try:
+                        await run_io(local.write, chunks, embeddings)
+                    except Exception as e:
+                        logger.warning(f"Failed to write local embedding index for {self.chunk_set}: {e}")
+                        await run_io(local.abort)
+                        local = None
+                if ann is not None:
+                    await run_io(ann.write, chunks, embeddings)
+            if local is not None:
+                writer, local = local, None
+                try:
+                    await run_io(writer.commit)
+                except Exception as e:
+                    logger.warning(f"Failed to write local embedding index for {self.chunk_set}: {e}")
+                    await run_io(writer.abort)
+            if ann is not None:
+                writer, ann = ann, None
+                await run_io(writer.commit)
+        finally:
+            if local is not None:
+                await run_io(local.abort)
+            if ann is not None:
+                await run_io(ann.abort)
+
+    async def abort(self) -> None:
+        """Discard staged chunks after a failure"""
+        try:
+            await run_db(self.store._delete_chunks, self.staging_key)
+        except Exception as e:
+            logger.warning(f"Failed to discard staged chunks {self.staging_key}: {e}")
@@ -0,0 +1,116 @@
+"""Ingestion worker.
+
+Processes documents queued in the ingestion_jobs table, independently of
+the API processes. Run as many as needed:
+
+    python -m app.worker --concurrency 4
+"""
+from app.db import base  # noqa: registers every model with the mapper
+from app.db.session import SessionLocal
+from app.core.config import settings
+from app.core.executors import shutdown_executors
+from app.models.ingestion_job import IngestionJob
+from app.services.document_processor import DocumentProcessor
+from app.services.ingestion_queue import IngestionDeferred, IngestionQueue
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+
+logger = logging.getLogger(__name__)
+
+async def _heartbeat(job: IngestionJob) -> None:
+    # Uses its own session: the job's session is busy in the processor
+    db = SessionLocal()
+    try:
+        queue = IngestionQueue(db)
+        while True:
+            await asyncio.sleep(settings.INGESTION_JOB_TIMEOUT / 3)
+            await queue.heartbeat(job.id)
+    finally:
+        db.close()
+
+async def run_job(job: IngestionJob, db, queue: IngestionQueue) -> None:
+    heartbeat = asyncio.create_task(_heartbeat(job))
+    try:
+        await DocumentProcessor(db).process_document(job.document_id, job.previous_chunk_set)
+    except IngestionDeferred as e:
+        logger.info(f"Deferring ingestion of {job.document_id}: {e}")
+        await queue.defer(job.id, e.delay)
+    except Exception as e:
+        await queue.fail(job.id, str(e))
+    else:
+        await queue.complete(job.id)
+        logger.info(f"Ingested document {job.document_id}")
+    finally:
+        heartbeat.cancel()
+
+async def run_slot(worker_id: str, stop: asyncio.Event) -> None:
+    """Claim and process jobs one at a time until asked to stop"""
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            queue = IngestionQueue(db)
+            job = await queue.claim(worker_id)
+            if job is not None:
+                await run_job(job, db, queue)
+                continue
+        except Exception as e:
+            logger.error(f"Ingestion worker {worker_id} error: {e}")
+        finally:
+            db.close()
+
+        # Queue empty (or the database unreachable): wait before polling again
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=settings.INGESTION_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def reap_stale_jobs(stop: asyncio.Event) -> None:
+    """Periodically requeue jobs left behind by crashed workers"""
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            requeued = await IngestionQueue(db).requeue_stale()
+            if requeued:
+                logger.warning(f"Recovered {requeued} abandoned ingestion jobs")
+        except Exception as e:
+            logger.error(f"Failed to recover abandoned ingestion jobs: {e}")
+        finally:
+            db.close()
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            pass
+
+async def main(concurrency: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Finish in-flight documents, then exit
+        loop.add_signal_handler(sig, stop.set)
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Ingestion worker {worker_id} started with {concurrency} slots")
+    try:
+        await asyncio.gather(
+            reap_stale_jobs(stop),
+            *(run_slot(f"{worker_id}/{slot}", stop) for slot in range(concurrency))
+        )
+    finally:
+        shutdown_executors()
+        logger.info(f"Ingestion worker {worker_id} stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued document ingestion jobs")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=settings.INGESTION_WORKER_CONCURRENCY,
+        help="Documents processed at once by this worker"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.concurrency))
@@ -0,0 +1,22 @@
+"""Test settings: a throwaway SQLite database and index directory, local
+embeddings and the fake LLM. Set before any app module reads the settings."""
+import os
+import tempfile
+import pytest
+
+_data_dir = tempfile.mkdtemp(prefix="document-enquery-tests-")
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("S3_BUCKET_NAME", "document-enquery-tests")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", f"sqlite:///{_data_dir}/test.db")
+os.environ.setdefault("VECTOR_INDEX_DIR", os.path.join(_data_dir, "indexes"))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("EMBEDDING_PROVIDER", "local")
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services.ann_index import AnnIndexManager
+
+def _chunks(name: str, count: int):
+    rng = np.random.default_rng(sum(map(ord, name)))
+    chunks = [{"content": f"{name} chunk {i}", "metadata": {"chunk_index": i}} for i in range(count)]
+    return chunks, rng.normal(size=(count, 16)).astype(np.float32)
+
+def test_processes_see_each_others_updates(tmp_path):
+    # Two managers on one directory stand in for the API and worker processes
+    api = AnnIndexManager(str(tmp_path))
+    worker = AnnIndexManager(str(tmp_path))
+
+    a_chunks, a_vectors = _chunks("a", 5)
+    b_chunks, b_vectors = _chunks("b", 5)
+    worker.add_document("user-1", "a", a_chunks, a_vectors)
+    assert api.search(a_vectors[0], {"user-1": ["a"]}, limit=1)[0]["content"] == "a chunk 0"
+
+    worker.add_document("user-1", "b", b_chunks, b_vectors)
+    api.remove_document("user-1", "a")
+
+    assert api.search(b_vectors[2], {"user-1": ["b"]}, limit=1)[0]["content"] == "b chunk 2"
+    assert worker.get_shard("user-1").document_ids.keys() == {"b"}
+
+def test_missing_shard_or_document_returns_none(tmp_path):
+    manager = AnnIndexManager(str(tmp_path))
+    chunks, vectors = _chunks("a", 3)
+    assert manager.search(vectors[0], {"user-1": ["a"]}) is None
+
+    manager.add_document("user-1", "a", chunks, vectors)
+    assert manager.search(vectors[0], {"user-1": ["a", "not-indexed"]}) is None
+
+    manager.remove_document("user-1", "a")
+    assert manager.search(vectors[0], {"user-1": ["a"]}) is None
+
+def test_cold_load_from_checkpoint_and_segments(tmp_path):
+    manager = AnnIndexManager(str(tmp_path))
+    for name in ("a", "b", "c"):
+        manager.add_document("user-1", name, *_chunks(name, 4))
+    # Searching syncs the shard and writes a checkpoint
+    manager.get_shard("user-1")
+    assert (tmp_path / "user-1" / "checkpoint" / "state.json").exists()
+
+    # Changes after the checkpoint are replayed from segments
+    replaced_chunks, replaced_vectors = _chunks("b2", 2)
+    manager.add_document("user-1", "b", replaced_chunks, replaced_vectors)
+    manager.remove_document("user-1", "c")
+
+    shard = AnnIndexManager(str(tmp_path)).get_shard("user-1")
+    assert shard.document_ids.keys() == {"a", "b"}
+    assert sorted(payload["content"] for payload in shard.payloads.values() if payload["document_id"] == "b") \
+        == ["b2 chunk 0", "b2 chunk 1"]
+    match = shard.search(replaced_vectors[1], ["b"], limit=1)[0]
+    assert match["content"] == "b2 chunk 1"
+
+def test_segment_written_in_batches(tmp_path):
+    manager = AnnIndexManager(str(tmp_path))
+    chunks, vectors = _chunks("a", 6)
+
+    writer = manager.open_document("user-1", "a", 6)
+    writer.write(chunks[:4], vectors[:4])
+    writer.write(chunks[4:], vectors[4:])
+    writer.commit()
+
+    assert manager.search(vectors[5], {"user-1": ["a"]}, limit=1)[0]["content"] == "a chunk 5"
+    # Temporary files are gone once the segment is published
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["user-1", "user-1.lock"]
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf"])
+def test_matches_can_carry_their_vectors(tmp_path, monkeypatch, index_type):
+    # Context building needs the vectors for diversity and near-duplicate checks
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", index_type)
+    manager = AnnIndexManager(str(tmp_path))
+    chunks, vectors = _chunks("a", 50)
+    manager.add_document("user-1", "a", chunks, vectors)
+
+    matches = manager.search(vectors[3], {"user-1": ["a"]}, limit=3, include_embeddings=True)
+
+    by_content = {chunk["content"]: vector for chunk, vector in zip(chunks, vectors)}
+    for match in matches:
+        expected = by_content[match["content"]]
+        assert np.allclose(match["embedding"], expected / np.linalg.norm(expected), atol=1e-5)
+    assert "embedding" not in manager.search(vectors[3], {"user-1": ["a"]}, limit=1)[0]
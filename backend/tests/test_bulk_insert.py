@@ -0,0 +1,103 @@
+"""Binary COPY encoding. The round trip through PostgreSQL runs only when
+TEST_DATABASE_URL points at a database with the vector extension available."""
+import os
+import struct
+import uuid
+from datetime import datetime
+import pytest
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import (
+    ARRAY, JSON, BigInteger, Column, DateTime, Float, Integer, MetaData, SmallInteger, Table, Text,
+    UUID, create_engine, select, text
+)
+from sqlalchemy.orm import Session
+from app.services.bulk_insert import bulk_insert, encode_copy_binary
+
+metadata = MetaData()
+sample = Table(
+    "bulk_insert_sample",
+    metadata,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("content", Text),
+    Column("small", SmallInteger),
+    Column("count", Integer),
+    Column("size", BigInteger),
+    Column("extra", JSON),
+    Column("created_at", DateTime),
+    Column("embedding", Vector(3)),
+    Column("weights", ARRAY(Float))
+)
+
+ROWS = [
+    {
+        "id": uuid.uuid4(),
+        "content": "första",
+        "small": -2,
+        "count": 7,
+        "size": 5 * 2 ** 31,
+        "extra": {"page": 1},
+        "created_at": datetime(2024, 2, 29, 12, 30, 15, 250),
+        "embedding": [0.5, -1.0, 2.0],
+        "weights": [0.25, 4.0]
+    },
+    {
+        "id": uuid.uuid4(),
+        "content": None,
+        "small": None,
+        "count": None,
+        "size": None,
+        "extra": None,
+        "created_at": None,
+        "embedding": None,
+        "weights": None
+    }
+]
+
+def _fields(payload: bytes, count: int):
+    """Field values of the first row of a binary COPY payload"""
+    offset = 11 + 8  # signature, flags and header extension length
+    assert struct.unpack_from("!h", payload, offset)[0] == count
+    offset += 2
+    fields = []
+    for _ in range(count):
+        (length,) = struct.unpack_from("!i", payload, offset)
+        offset += 4
+        fields.append(payload[offset:offset + length] if length >= 0 else None)
+        offset += max(length, 0)
+    return fields
+
+def test_integers_are_encoded_at_their_column_width():
+    payload = encode_copy_binary(sample, ["small", "count", "size"], ROWS[:1])
+
+    small, count, size = _fields(payload, 3)
+    assert struct.unpack("!h", small)[0] == -2
+    assert struct.unpack("!i", count)[0] == 7
+    assert struct.unpack("!q", size)[0] == 5 * 2 ** 31
+    assert payload.endswith(struct.pack("!h", -1))
+
+def test_nulls_are_marked():
+    payload = encode_copy_binary(sample, list(ROWS[1].keys())[1:], ROWS[1:])
+    assert _fields(payload, len(ROWS[1]) - 1) == [None] * (len(ROWS[1]) - 1)
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL (PostgreSQL)")
+def test_copy_round_trip_on_postgresql():
+    engine = create_engine(os.environ["TEST_DATABASE_URL"])
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        sample.drop(connection, checkfirst=True)
+        sample.create(connection)
+    try:
+        with Session(engine) as db:
+            stats = bulk_insert(db, sample, ROWS, batch_size=1, method="copy")
+            db.commit()
+            assert stats["method"] == "copy" and stats["batches"] == 2
+
+            stored = {row.id: row._asdict() for row in db.execute(select(sample))}
+        for row in ROWS:
+            value = stored[row["id"]]
+            embedding = value.pop("embedding")
+            assert value == {key: item for key, item in row.items() if key != "embedding"}
+            assert (None if embedding is None else list(embedding)) == row["embedding"]
+    finally:
+        sample.drop(engine, checkfirst=True)
+        engine.dispose()
@@ -0,0 +1,75 @@
+import numpy as np
+from app.core.config import settings
+from app.services.cache import AnswerCache, EmbeddingCache
+
+def _cache():
+    return AnswerCache(max_entries=10, max_distance=0.1, ttl_seconds=60)
+
+def test_semantic_hit_is_not_also_a_miss():
+    cache = _cache()
+    scope = AnswerCache.make_scope([("doc", 1)])
+    cache.put(scope, "What is the total?", {"answer": "42"}, [1.0, 0.0])
+
+    # Exact probe before embedding, then the lookup with the embedding
+    assert cache.get(scope, "How much is the total?", count_miss=False) is None
+    assert cache.get(scope, "How much is the total?", [0.99, 0.05]) == {"answer": "42"}
+
+    assert cache.stats["semantic_hits"] == 1
+    assert cache.stats["misses"] == 0
+
+def test_miss_counted_once_both_tiers_miss():
+    cache = _cache()
+    scope = AnswerCache.make_scope([("doc", 1)])
+    cache.put(scope, "What is the total?", {"answer": "42"}, [1.0, 0.0])
+
+    assert cache.get(scope, "Who signed it?", count_miss=False) is None
+    assert cache.get(scope, "Who signed it?", [0.0, 1.0]) is None
+    assert cache.get(scope, "What is the total?") == {"answer": "42"}
+
+    assert cache.stats == {"exact_hits": 1, "semantic_hits": 0, "misses": 1, "invalidations": 0}
+
+def _vector(seed, size=256):
+    return np.random.default_rng(seed).normal(size=size).astype(np.float32).tolist()
+
+def test_embedding_memory_tier_keeps_the_most_recently_used(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"), max_memory_items=2)
+    cache.put_many({"a": _vector(1), "b": _vector(2)})
+    cache.get_many(["a"])
+    cache.put_many({"c": _vector(3)})
+
+    # "b" was least recently used; it is still read through from disk
+    assert list(cache._memory) == ["a", "c"]
+    assert cache.get_many(["b"]) == {"b": _vector(2)}
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["disk_hits"] == 1
+
+def test_embedding_disk_tier_is_shared_and_reads_through(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    key = EmbeddingCache.make_key("model", "Late  payment\ninterest")
+    EmbeddingCache(path=path).put_many({key: _vector(1)})
+
+    # Another worker opening the same file, with whitespace normalized away
+    other = EmbeddingCache(path=path)
+    found = other.get_many([EmbeddingCache.make_key("model", "Late payment interest"), "missing"])
+
+    assert found == {key: _vector(1)}
+    assert key in other._memory
+    assert (other.stats["disk_hits"], other.stats["misses"]) == (1, 1)
+    assert EmbeddingCache.make_key("other-model", "Late payment interest") != key
+
+def test_embedding_disk_tier_evicts_least_recently_read_past_its_budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "EMBEDDING_CACHE_MAX_BYTES", 64 * 1024)
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"), max_memory_items=1)
+    cache.put_many({"kept": _vector(0)})
+    for seed in range(1, 120):
+        # Reading "kept" keeps it the most recently used entry on disk
+        cache.get_many(["kept"])
+        cache._memory.clear()
+        cache.put_many({f"key-{seed}": _vector(seed)})
+
+    page_size = cache._db.execute("PRAGMA page_size").fetchone()[0]
+    page_count = cache._db.execute("PRAGMA page_count").fetchone()[0]
+    assert cache.stats["evictions"] > 0
+    assert page_size * page_count <= 64 * 1024 * 1.1
+    assert cache.get_many(["kept"]) == {"kept": _vector(0)}
+    assert cache.get_many(["key-1"]) == {}
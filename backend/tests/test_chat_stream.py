@@ -0,0 +1,88 @@
+import json
+import uuid
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.v1.endpoints import chat as chat_endpoints
+from app.api.dependencies.auth import get_current_user
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.chat import ChatSession, ChatMessage
+from app.models.document import Document
+from app.models.user import User
+from app.services.llm import FAKE_LLM_RESPONSE
+from app.services.rag_agent import RAGAgent
+
+SOURCE = {"content": "The fee is 40 euros.", "metadata": {"chunk_index": 0}, "score": 0.9}
+
+@pytest.fixture
+def chat_session(monkeypatch):
+    Base.metadata.create_all(
+        bind=engine,
+        tables=[User.__table__, Document.__table__, ChatSession.__table__, ChatMessage.__table__]
+    )
+    db = SessionLocal()
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    document = Document(title="Fees", user_id=user.id, status="ready")
+    db.add(document)
+    db.flush()
+    session = ChatSession(user_id=user.id, document_id=document.id)
+    db.add(session)
+    db.commit()
+    db.refresh(user)
+    db.refresh(session)
+    db.expunge_all()
+    db.close()
+
+    async def retrieve(self, question, document_ids, query_embedding=None):
+        return [SOURCE]
+
+    # Retrieval needs pgvector; the answer comes from the fake LLM
+    monkeypatch.setattr(RAGAgent, "_retrieve", retrieve)
+    return user, session
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        name, data = block.split("\n", 1)
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+def test_stream_uses_its_own_session(chat_session, monkeypatch):
+    user, session = chat_session
+    opened = []
+
+    def session_factory():
+        db = SessionLocal()
+        opened.append(db)
+        return db
+
+    monkeypatch.setattr(chat_endpoints, "SessionLocal", session_factory)
+    app = FastAPI()
+    app.include_router(chat_endpoints.router)
+    app.dependency_overrides[get_current_user] = lambda: user
+
+    response = TestClient(app).post(
+        f"/sessions/{session.id}/messages/stream",
+        json={"content": "What is the fee?"}
+    )
+
+    assert response.status_code == 200
+    events = _events(response.text)
+    assert events[0] == ("sources", [SOURCE])
+    assert "".join(data for name, data in events if name == "token") == FAKE_LLM_RESPONSE
+    assert events[-1][0] == "message"
+    assert events[-1][1]["content"] == FAKE_LLM_RESPONSE
+
+    # The stream's session was opened for it and closed when it finished
+    assert len(opened) == 1
+    assert not opened[0].in_transaction()
+
+    db = SessionLocal()
+    try:
+        stored = db.query(ChatMessage).filter(ChatMessage.session_id == session.id).all()
+        assert sorted(message.role for message in stored) == ["assistant", "user"]
+    finally:
+        db.close()
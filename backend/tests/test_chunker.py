@@ -0,0 +1,76 @@
+from app.services.chunker import Chunker, estimate_tokens
+
+def _element(text, page, element_type="NarrativeText", element_id=None):
+    return {
+        "text": text,
+        "type": element_type,
+        "metadata": {"page_number": page, "element_id": element_id or f"{element_type}-{page}-{len(text)}"}
+    }
+
+def _sentences(count, topic):
+    return " ".join(f"Sentence {i} of the {topic} section explains one more rule." for i in range(count))
+
+def _chunk(elements, max_tokens=60, overlap_tokens=12):
+    chunker = Chunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    chunks = list(chunker.add(elements))
+    return chunks + list(chunker.flush())
+
+def test_chunks_stay_within_the_token_budget():
+    chunks = _chunk([_element(_sentences(40, "fees"), 1), _element("x" * 2000, 2)])
+
+    assert len(chunks) > 5
+    for chunk in chunks:
+        assert estimate_tokens(chunk["content"]) <= 60
+        assert chunk["metadata"]["token_count"] <= 60
+    assert [chunk["metadata"]["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+
+def test_consecutive_chunks_of_a_section_overlap():
+    chunks = _chunk([_element(_sentences(20, "fees"), 1)])
+
+    assert len(chunks) > 2
+    for previous, chunk in zip(chunks, chunks[1:]):
+        carried = chunk["content"].split("\n")[0]
+        assert previous["content"].endswith(carried)
+        assert 0 < estimate_tokens(carried) <= 12
+
+def test_chunks_do_not_overlap_across_sections():
+    chunks = _chunk([
+        _element("Fees", 1, "Title"),
+        _element(_sentences(6, "fees"), 1),
+        _element("Termination", 2, "Title"),
+        _element(_sentences(6, "termination"), 2)
+    ])
+
+    sections = [chunk["metadata"]["section"] for chunk in chunks]
+    first = sections.index("Termination")
+    assert sections[:first] == ["Fees"] * first
+    assert set(sections[first:]) == {"Termination"}
+    # The new section starts at its title, with nothing carried from the last one
+    assert chunks[first]["content"].startswith("Termination\n")
+    assert "fees" not in chunks[first]["content"]
+
+def test_tables_are_kept_whole_in_chunks_of_their_own():
+    table = "region | amount\nnorth | 10\nsouth | 20\neast | 40"
+    chunks = _chunk([
+        _element("Orders were placed in three regions this quarter.", 1),
+        _element(table, 1, "Table"),
+        _element("The east region led the quarter.", 2)
+    ])
+
+    assert [chunk["content"] for chunk in chunks] == [
+        "Orders were placed in three regions this quarter.",
+        table,
+        "The east region led the quarter."
+    ]
+
+def test_chunks_record_the_pages_they_span():
+    chunks = _chunk([
+        _element("The agreement starts on page one.", 1),
+        _element("It continues on page two.", 2),
+        _element("And ends on page three.", 3)
+    ], max_tokens=300)
+
+    chunk, = chunks
+    assert (chunk["metadata"]["page_start"], chunk["metadata"]["page_end"]) == (1, 3)
+    assert chunk["metadata"]["page_number"] == 1
+    assert len(chunk["metadata"]["element_ids"]) == 3
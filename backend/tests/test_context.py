@@ -0,0 +1,27 @@
+from app.services.context import ContextBuilder
+
+def _chunk(chunk_set, page, index, content):
+    return {
+        "content": content,
+        "chunk_set": chunk_set,
+        "metadata": {"chunk_index": index, "page_number": page}
+    }
+
+def test_chunks_are_grouped_by_document_in_reading_order():
+    candidates = [
+        _chunk("contract", 4, 9, "termination requires ninety days notice"),
+        _chunk("invoice", 1, 0, "invoice total due in thirty days"),
+        _chunk("contract", 1, 2, "parties agree on the service scope"),
+        {"content": "sum(amount) = 40", "metadata": {"table": "orders"}},
+        _chunk("invoice", 2, 3, "late payments accrue interest monthly")
+    ]
+
+    selected = ContextBuilder(max_tokens=1000, mmr_lambda=1.0).select(candidates)
+
+    assert [chunk["content"] for chunk in selected] == [
+        "sum(amount) = 40",
+        "parties agree on the service scope",
+        "termination requires ninety days notice",
+        "invoice total due in thirty days",
+        "late payments accrue interest monthly"
+    ]
@@ -0,0 +1,102 @@
+import asyncio
+import io
+import pytest
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+)
+from app.core.config import settings
+from app.services import document_processor as processor_module
+from app.services.document_processor import (
+    FAST_STRATEGY, OCR_STRATEGY, PDF_CONTENT_TYPE, DocumentProcessor, pdf_page_strategies
+)
+
+def _pdf(scanned: bool) -> PdfReader:
+    """A one-page PDF with no text; a scan draws an image from indirect /Resources"""
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    page = writer.pages[0]
+    if scanned:
+        image = DecodedStreamObject()
+        image.set_data(b"\x80" * 4)
+        image.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(2),
+            NameObject("/Height"): NumberObject(2),
+            NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+            NameObject("/BitsPerComponent"): NumberObject(8)
+        })
+        resources = DictionaryObject({
+            NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer._add_object(image)})
+        })
+        page[NameObject("/Resources")] = writer._add_object(resources)
+        content = DecodedStreamObject()
+        content.set_data(b"q 200 0 0 200 0 0 cm /Im0 Do Q")
+        page[NameObject("/Contents")] = ArrayObject([writer._add_object(content)])
+
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+    return PdfReader(buffer)
+
+def test_scanned_page_needs_ocr():
+    reader = _pdf(scanned=True)
+    assert isinstance(reader.pages[0].get("/Resources"), IndirectObject)
+    assert pdf_page_strategies(reader) == [OCR_STRATEGY]
+
+def test_blank_page_is_read_directly():
+    assert pdf_page_strategies(_pdf(scanned=False)) == [FAST_STRATEGY]
+
+PAGES = 23
+
+@pytest.fixture
+def pdf(tmp_path):
+    """A blank PDF whose page widths encode their page numbers"""
+    writer = PdfWriter()
+    for page in range(1, PAGES + 1):
+        writer.add_blank_page(width=100 + page, height=100)
+    path = tmp_path / "document.pdf"
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+@pytest.mark.anyio
+async def test_page_windows_cover_every_page_once_in_order(monkeypatch, tmp_path, pdf):
+    monkeypatch.setattr(settings, "INGESTION_PAGE_WINDOW", 5)
+    monkeypatch.setattr(settings, "PDF_PARALLEL_MIN_PAGES", 10)
+    monkeypatch.setattr(settings, "PDF_PARSE_WORKERS", 3)
+
+    async def run_cpu(func, *args):
+        return func(*args)
+
+    async def process_file_content(self, file_path, file_type, page_offset=0):
+        pages = PdfReader(file_path).pages
+        # Later windows finish first
+        await asyncio.sleep(0.01 * (PAGES - page_offset) / PAGES)
+        return [
+            {
+                "text": f"page {int(page.mediabox.width) - 100}",
+                "type": "NarrativeText",
+                "metadata": {"page_number": page_offset + number}
+            }
+            for number, page in enumerate(pages, start=1)
+        ]
+
+    monkeypatch.setattr(processor_module, "run_cpu", run_cpu)
+    monkeypatch.setattr(DocumentProcessor, "process_file_content", process_file_content)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+
+    windows = [
+        (elements, fraction)
+        async for elements, fraction in DocumentProcessor(db=None).iter_element_windows(pdf, PDF_CONTENT_TYPE, str(work_dir))
+    ]
+
+    assert [len(elements) for elements, _ in windows] == [5, 5, 5, 5, 3]
+    elements = [element for window, _ in windows for element in window]
+    assert [element["metadata"]["page_number"] for element in elements] == list(range(1, PAGES + 1))
+    # Each window held the pages its offset claims
+    assert [element["text"] for element in elements] == [f"page {page}" for page in range(1, PAGES + 1)]
+    assert [fraction for _, fraction in windows] == [0.2, 0.4, 0.6, 0.8, 1.0]
+    assert list(work_dir.iterdir()) == []
@@ -0,0 +1,36 @@
+import uuid
+import boto3
+import pytest
+from moto import mock_aws
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.document import DocumentService
+
+pytestmark = pytest.mark.anyio
+
+async def _stream(data: bytes):
+    yield data
+
+async def test_failed_save_deletes_the_upload(monkeypatch):
+    def save_document(self, document, file_url):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(DocumentService, "_save_document", save_document)
+    db = SessionLocal()
+    try:
+        with mock_aws():
+            s3 = boto3.client("s3", region_name=settings.AWS_REGION)
+            s3.create_bucket(Bucket=settings.S3_BUCKET_NAME)
+
+            with pytest.raises(RuntimeError, match="database unavailable"):
+                await DocumentService(db).create_document_from_stream(
+                    user_id=uuid.uuid4(),
+                    title="Report",
+                    filename="report.pdf",
+                    content_type="application/pdf",
+                    stream=_stream(b"%PDF-1.4 report")
+                )
+
+            assert s3.list_objects_v2(Bucket=settings.S3_BUCKET_NAME)["KeyCount"] == 0
+    finally:
+        db.close()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import uuid
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services.embedding_store import EmbeddingStore
+
+def _chunks(count: int, start: int = 0):
+    rng = np.random.default_rng(start)
+    chunks = [
+        {"id": uuid.uuid4(), "chunk_index": i, "content": f"chunk {i} é", "metadata": {"page_number": i // 2}}
+        for i in range(start, start + count)
+    ]
+    return chunks, rng.normal(size=(count, 8)).astype(np.float32)
+
+def test_document_written_in_batches_is_searchable(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    first, first_vectors = _chunks(3)
+    second, second_vectors = _chunks(2, start=3)
+
+    writer = store.open_document("set-1", 5)
+    writer.write(first, first_vectors)
+    writer.write(second, second_vectors)
+    writer.commit()
+
+    match = store.similarity_search(second_vectors[1], ["set-1"], limit=1, similarity_threshold=0.0)[0]
+    assert match["content"] == "chunk 4 é"
+    assert match["metadata"] == {"page_number": 2}
+    assert match["score"] == pytest.approx(1.0, abs=1e-5)
+
+def test_short_write_leaves_the_previous_index(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.write_document("set-1", *_chunks(2))
+
+    writer = store.open_document("set-1", 5)
+    writer.write(*_chunks(3))
+    with pytest.raises(ValueError):
+        writer.commit()
+    writer.abort()
+
+    # Only the link and the version it points to are left
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["set-1", os.readlink(tmp_path / "set-1")]
+    query = _chunks(2)[1][0]
+    assert store.similarity_search(query, ["set-1"], limit=5, similarity_threshold=-1.0)[0]["content"] == "chunk 0 é"
+
+def test_empty_document(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.write_document("set-1", [], [])
+    assert store.similarity_search([1.0, 0.0], ["set-1"]) == []
+
+def test_rewrite_swaps_versions_under_an_open_reader(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    chunks, vectors = _chunks(2)
+    store.write_document("set-1", chunks, vectors)
+    reader = EmbeddingStore(str(tmp_path))
+    assert reader.similarity_search(vectors[0], ["set-1"], limit=1, similarity_threshold=0.0)
+
+    # Two rewrites in a row replace the link each time and drop the old versions
+    store.write_document("set-1", *_chunks(3, start=10))
+    store.write_document("set-1", *_chunks(1, start=20))
+
+    assert len(list(tmp_path.iterdir())) == 2
+    matches = reader.similarity_search(vectors[0], ["set-1"], limit=5, similarity_threshold=-1.0)
+    assert [match["content"] for match in matches] == ["chunk 20 é"]
+
+def test_index_removed_while_opening_falls_back(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    chunks, vectors = _chunks(2)
+    store.write_document("set-1", chunks, vectors)
+    EmbeddingStore._cache.clear()
+
+    # The link still resolves, but the version behind it is gone
+    shutil.rmtree(tmp_path / os.readlink(tmp_path / "set-1"))
+    os.makedirs(tmp_path / os.readlink(tmp_path / "set-1"))
+    open(tmp_path / "set-1" / "chunks.json", "w").close()
+
+    assert store.similarity_search(vectors[0], ["set-1"]) is None
+
+def test_delete_removes_the_link_and_its_versions(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.write_document("set-1", *_chunks(2))
+    store.delete_document("set-1")
+
+    assert list(tmp_path.iterdir()) == []
+    assert not store.has_document("set-1")
+
+def test_open_indexes_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_INDEX_CACHE_DOCUMENTS", 2)
+    EmbeddingStore._cache.clear()
+    store = EmbeddingStore(str(tmp_path))
+    chunks, vectors = _chunks(1)
+    for name in ("set-1", "set-2", "set-3"):
+        store.write_document(name, chunks, vectors)
+
+    for name in ("set-1", "set-2", "set-1", "set-3"):
+        store.similarity_search(vectors[0], [name])
+
+    # set-2 was the least recently searched
+    assert list(EmbeddingStore._cache) == [str(tmp_path / "set-1"), str(tmp_path / "set-3")]
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+import pytest
+from langchain_core.embeddings import Embeddings
+from app.services.embeddings import EmbeddingScheduler
+
+pytestmark = pytest.mark.anyio
+
+class FakeEmbeddings(Embeddings):
+    """Records calls and concurrency; the first `failures` calls raise `error`"""
+
+    def __init__(self, delay: float = 0.0, failures: int = 0, error: str = "429 Resource exhausted"):
+        self.delay = delay
+        self.failures = failures
+        self.error = error
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            with self._lock:
+                if self.failures:
+                    self.failures -= 1
+                    raise Exception(self.error)
+                self.calls.append(list(texts))
+            return [[float(len(text))] for text in texts]
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+async def test_concurrent_callers_share_batches():
+    provider = FakeEmbeddings()
+    scheduler = EmbeddingScheduler(provider, batch_size=4, batch_wait=0.01)
+
+    results = await asyncio.gather(
+        scheduler.embed_documents(["a", "bb"]),
+        scheduler.embed_documents(["ccc"]),
+        scheduler.embed_documents(["dddd", "eeeee", "ffffff"])
+    )
+
+    assert results == [[[1.0], [2.0]], [[3.0]], [[4.0], [5.0], [6.0]]]
+    # Six texts from three callers: one full batch sent at once, the tail after the wait
+    assert sorted(len(call) for call in provider.calls) == [2, 4]
+    assert scheduler.stats["batches"] == 2
+
+async def test_batches_respect_max_concurrency():
+    provider = FakeEmbeddings(delay=0.05)
+    scheduler = EmbeddingScheduler(provider, batch_size=1, max_concurrency=2)
+
+    results = await scheduler.embed_documents([str(i) for i in range(6)])
+
+    assert len(results) == 6
+    assert len(provider.calls) == 6
+    assert provider.max_active == 2
+
+async def test_throttled_calls_are_retried():
+    provider = FakeEmbeddings(failures=2)
+    scheduler = EmbeddingScheduler(provider, retry_base_delay=0.001)
+
+    assert await scheduler.embed_documents(["abc"]) == [[3.0]]
+    assert scheduler.stats["retries"] == 2
+
+async def test_other_errors_fail_without_retry():
+    provider = FakeEmbeddings(failures=1, error="invalid argument")
+    scheduler = EmbeddingScheduler(provider, retry_base_delay=0.001)
+
+    with pytest.raises(Exception, match="invalid argument"):
+        await scheduler.embed_documents(["abc"])
+    assert scheduler.stats["retries"] == 0
@@ -0,0 +1,110 @@
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.content_blob import ContentBlob, ContentBlobStatus
+from app.models.document import Document, DocumentStatus
+from app.models.ingestion_job import IngestionJob, IngestionJobStatus
+from app.models.user import User
+from app.services.document_processor import DocumentProcessor
+from app.services.ingestion_queue import IngestionQueue
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(
+        bind=engine,
+        tables=[User.__table__, ContentBlob.__table__, Document.__table__, IngestionJob.__table__]
+    )
+    with engine.begin() as connection:
+        # SQLite cannot create the real table (tsvector, vector); the queue only
+        # touches these columns
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS document_chunks "
+            "(id INTEGER PRIMARY KEY, chunk_set VARCHAR(64), created_at DATETIME)"
+        ))
+    session = SessionLocal()
+    yield session
+    session.close()
+
+async def test_documents_saved_without_a_job_are_adopted(db):
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    old = datetime.utcnow() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT + 60)
+    orphan = Document(title="orphan", user_id=user.id, status=DocumentStatus.QUEUED, created_at=old)
+    # Just saved; its job is about to be queued by the API
+    fresh = Document(title="fresh", user_id=user.id, status=DocumentStatus.QUEUED)
+    queued = Document(title="queued", user_id=user.id, status=DocumentStatus.QUEUED, created_at=old)
+    db.add_all([orphan, fresh, queued])
+    db.flush()
+    db.add(IngestionJob(document_id=queued.id))
+    db.commit()
+
+    assert await IngestionQueue(db).requeue_stale() == 1
+
+    jobs = db.query(IngestionJob).filter(IngestionJob.document_id.in_([orphan.id, fresh.id])).all()
+    assert [(job.document_id, job.status) for job in jobs] == [(orphan.id, IngestionJobStatus.QUEUED)]
+    assert await IngestionQueue(db).requeue_stale() == 0
+
+async def test_abandoned_staging_rows_are_deleted(db):
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    dead = Document(title="dead", user_id=user.id, status=DocumentStatus.PROCESSING)
+    alive = Document(title="alive", user_id=user.id, status=DocumentStatus.PROCESSING)
+    db.add_all([dead, alive])
+    db.flush()
+    db.add(IngestionJob(document_id=alive.id, status=IngestionJobStatus.RUNNING, locked_at=datetime.utcnow()))
+    db.commit()
+
+    old = datetime.utcnow() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT + 60)
+    for chunk_set, created_at in [
+        (f"staging-{dead.id.hex}-0001", old),
+        (f"staging-{dead.id.hex}-0002", datetime.utcnow()),
+        (f"staging-{alive.id.hex}-0003", old),
+        ("live-set", old)
+    ]:
+        db.execute(
+            text("INSERT INTO document_chunks (chunk_set, created_at) VALUES (:chunk_set, :created_at)"),
+            {"chunk_set": chunk_set, "created_at": created_at}
+        )
+    db.commit()
+
+    await IngestionQueue(db).requeue_stale()
+
+    remaining = {row[0] for row in db.execute(text("SELECT chunk_set FROM document_chunks"))}
+    assert f"staging-{dead.id.hex}-0001" not in remaining
+    assert {f"staging-{dead.id.hex}-0002", f"staging-{alive.id.hex}-0003", "live-set"} <= remaining
+
+async def test_heartbeat_keeps_a_long_job_on_its_content(db):
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    content_hash = uuid.uuid4().hex
+    claimed_at = datetime.utcnow() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT + 60)
+    db.add(ContentBlob(
+        content_hash=content_hash,
+        file_url="https://bucket/blob",
+        status=ContentBlobStatus.PROCESSING,
+        updated_at=claimed_at
+    ))
+    first = Document(title="first", user_id=user.id, status=DocumentStatus.PROCESSING, content_hash=content_hash)
+    second = Document(title="second", user_id=user.id, status=DocumentStatus.QUEUED, content_hash=content_hash)
+    db.add_all([first, second])
+    db.flush()
+    job = IngestionJob(document_id=first.id, status=IngestionJobStatus.RUNNING, locked_at=claimed_at)
+    db.add(job)
+    db.commit()
+
+    # Still working after the timeout: the heartbeat renews the claim
+    await IngestionQueue(db).heartbeat(job.id)
+
+    assert DocumentProcessor(db)._claim_content(content_hash) == ContentBlobStatus.PROCESSING
+    blob = db.get(ContentBlob, content_hash)
+    db.refresh(blob)
+    assert blob.updated_at > claimed_at
@@ -0,0 +1,94 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+import pytest
+from app.core.config import settings
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.chat import ChatMessage, ChatSession
+from app.models.document import Document
+from app.models.user import User
+from app.services import memory as memory_module
+from app.services.llm import FAKE_LLM_RESPONSE
+from app.services.memory import ConversationMemory
+from app.services.rag_agent import RAGAgent
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_WINDOW_MESSAGES", 2)
+    monkeypatch.setattr(settings, "MEMORY_FOLD_MIN_MESSAGES", 2)
+    Base.metadata.create_all(
+        bind=engine,
+        tables=[User.__table__, Document.__table__, ChatSession.__table__, ChatMessage.__table__]
+    )
+    session = SessionLocal()
+    yield session
+    session.close()
+
+def _chat(db) -> ChatSession:
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    document = Document(title="Fees", user_id=user.id, status="ready")
+    db.add(document)
+    db.flush()
+    chat = ChatSession(user_id=user.id, document_id=document.id)
+    db.add(chat)
+    db.commit()
+    return chat
+
+def _add_turn(db, chat: ChatSession, number: int) -> None:
+    asked = datetime(2024, 1, 1) + timedelta(minutes=number)
+    db.add_all([
+        ChatMessage(session_id=chat.id, role="user", content=f"question {number}", created_at=asked),
+        ChatMessage(session_id=chat.id, role="assistant", content=f"answer {number}", created_at=asked)
+    ])
+    db.commit()
+
+async def _fold(db, chat: ChatSession) -> ChatSession:
+    ConversationMemory(db).schedule_update(chat)
+    await asyncio.gather(*memory_module._fold_tasks)
+    db.expire_all()
+    return db.get(ChatSession, chat.id)
+
+async def test_messages_are_folded_in_batches_in_the_background(db):
+    chat = _chat(db)
+    _add_turn(db, chat, 1)
+    _add_turn(db, chat, 2)
+    _add_turn(db, chat, 3)
+
+    # Four messages have left a window of two; one summary call folds them all
+    chat = await _fold(db, chat)
+    assert chat.summarized_message_count == 4
+    assert chat.summary == FAKE_LLM_RESPONSE
+
+    _add_turn(db, chat, 4)
+    _add_turn(db, chat, 5)
+    chat = await _fold(db, chat)
+    assert chat.summarized_message_count == 8
+
+async def test_a_single_message_past_the_window_waits_for_the_next_turn(db, monkeypatch):
+    monkeypatch.setattr(settings, "MEMORY_FOLD_MIN_MESSAGES", 4)
+    chat = _chat(db)
+    _add_turn(db, chat, 1)
+    _add_turn(db, chat, 2)
+
+    chat = await _fold(db, chat)
+    assert chat.summarized_message_count == 0
+
+    # Unfolded messages stay in the prompt verbatim
+    loaded = await ConversationMemory(db).load(chat)
+    assert [message["content"] for message in loaded["messages"]] == [
+        "question 1", "answer 1", "question 2", "answer 2"
+    ]
+
+def test_follow_ups_that_were_not_rewritten_bypass_the_answer_cache():
+    agent = RAGAgent(db=None)
+    agent.answer_cache = object()
+
+    assert agent._is_cacheable("What is the fee?", "", None)
+    assert agent._is_cacheable("And in 2023?", "User: What is the fee?", "What was the fee in 2023?")
+    assert not agent._is_cacheable("And in 2023?", "User: What is the fee?", "And in 2023?")
+    assert not agent._is_cacheable("And in 2023?", "User: What is the fee?", None)
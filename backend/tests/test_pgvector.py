@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+import pytest
+from app.core.config import settings
+from app.db import pgvector
+
+class RecordingSession:
+    """Stands in for a PostgreSQL session, recording the statements run"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.statements = []
+
+    def get_bind(self):
+        return SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+        return SimpleNamespace(scalar=lambda: self.version)
+
+    def begin_nested(self):
+        self.statements.append("SAVEPOINT")
+        return SimpleNamespace(rollback=lambda: self.statements.append("ROLLBACK TO SAVEPOINT"))
+
+@pytest.fixture
+def hnsw(monkeypatch):
+    monkeypatch.setattr(settings, "PGVECTOR_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(settings, "PGVECTOR_HNSW_EF_SEARCH", 40)
+    monkeypatch.setattr(pgvector, "_extension_version", None)
+
+def _settings_applied(db: RecordingSession):
+    return [statement for statement in db.statements if statement.startswith("SET")]
+
+def test_ef_search_covers_the_limit(hnsw):
+    db = RecordingSession("0.7.4")
+    pgvector.set_vector_search_params(db, limit=50)
+    assert _settings_applied(db) == ["SET LOCAL hnsw.ef_search = 50"]
+
+def test_ef_search_keeps_a_higher_setting_and_the_cap(hnsw):
+    db = RecordingSession("0.7.4")
+    pgvector.set_vector_search_params(db, limit=10)
+    pgvector.set_vector_search_params(db, limit=5000)
+    assert _settings_applied(db) == ["SET LOCAL hnsw.ef_search = 40", "SET LOCAL hnsw.ef_search = 1000"]
+
+def test_iterative_scan_on_pgvector_0_8(hnsw):
+    db = RecordingSession("0.8.0")
+    pgvector.set_vector_search_params(db, limit=50)
+    assert _settings_applied(db) == ["SET LOCAL hnsw.ef_search = 50", "SET LOCAL hnsw.iterative_scan = strict_order"]
+
+def test_exact_search_skips_the_index(hnsw):
+    db = RecordingSession("0.8.0")
+    pgvector.set_vector_search_params(db, limit=50, exact=True)
+    assert _settings_applied(db) == ["SET LOCAL enable_indexscan = off"]
+
+def test_scoped_settings_are_rolled_back_after_the_query(hnsw):
+    db = RecordingSession("0.8.0")
+    with pgvector.vector_search_params(db, limit=50, exact=True):
+        db.execute("SELECT 1")
+    assert db.statements == [
+        "SAVEPOINT", "SET LOCAL enable_indexscan = off", "SELECT 1", "ROLLBACK TO SAVEPOINT"
+    ]
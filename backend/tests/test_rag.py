@@ -0,0 +1,75 @@
+import uuid
+import numpy as np
+from langchain.schema import Document
+from app.core.config import settings
+from app.services.embedding_store import top_k_indices
+from app.services.embeddings import LocalHashEmbeddings
+from app.services.rag import SimpleVectorStore, delete_stale_indexes, get_index_dir
+
+def _store(texts):
+    rng = np.random.default_rng(len(texts))
+    documents = [Document(page_content=text, metadata={"page": i}) for i, text in enumerate(texts)]
+    return SimpleVectorStore(documents, embeddings=None, doc_embeddings=rng.normal(size=(len(texts), 8)))
+
+def test_saving_a_version_twice_keeps_the_first(tmp_path):
+    path = str(tmp_path / "etag-1")
+    first = _store(["alpha", "beta"])
+    first.save(path)
+
+    # A concurrent save of the same content finds the version already there
+    _store(["alpha", "beta"]).save(path)
+
+    loaded = SimpleVectorStore.load(path, embeddings=None)
+    assert [doc.page_content for doc in loaded.documents] == ["alpha", "beta"]
+    assert np.allclose(loaded.doc_embeddings, first.doc_embeddings)
+    assert [p.name for p in tmp_path.iterdir()] == ["etag-1"]
+
+def test_stale_versions_are_removed_after_the_new_one_is_saved(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "VECTOR_INDEX_DIR", str(tmp_path))
+    document_id = uuid.uuid4()
+    index_dir = get_index_dir(document_id)
+    _store(["old"]).save(f"{index_dir}/etag-1")
+    _store(["new"]).save(f"{index_dir}/etag-2")
+
+    delete_stale_indexes(document_id, "etag-2")
+
+    assert [p.name for p in (tmp_path / str(document_id)).iterdir()] == ["etag-2"]
+
+class QueryTaskEmbeddings(LocalHashEmbeddings):
+    """Embeds queries differently from documents, as task-typed models do"""
+
+    def embed_documents(self, texts):
+        raise AssertionError("queries must not be embedded as documents")
+
+    def embed_query(self, text):
+        return super().embed_query(text + " question")
+
+def test_batched_queries_match_single_query_search():
+    texts = [f"chunk {i} about topic {i % 5} and item {i % 7}" for i in range(40)]
+    embeddings = QueryTaskEmbeddings(64)
+    store = SimpleVectorStore(
+        [Document(page_content=text) for text in texts],
+        embeddings,
+        doc_embeddings=LocalHashEmbeddings(64).embed_documents(texts)
+    )
+    queries = ["topic 3", "item 6 chunk", "about topic 1 and item 2"]
+
+    batched = store.similarity_search_many(queries, k=5)
+
+    def scores(query, documents):
+        vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+        rows = [texts.index(doc.page_content) for doc in documents]
+        return store.doc_embeddings[rows] @ (vector / np.linalg.norm(vector))
+
+    # Hashed features tie often, and a matrix product may round ties apart
+    # differently from a matrix-vector one, so compare the scores reached
+    for query, documents in zip(queries, batched):
+        assert np.allclose(scores(query, documents), scores(query, store.similarity_search(query, k=5)), atol=1e-6)
+
+def test_batched_top_k_matches_the_per_row_loop():
+    scores = np.random.default_rng(0).normal(size=(6, 100)).astype(np.float32)
+
+    for k in (1, 7, 100, 150):
+        batched = top_k_indices(scores, k)
+        assert [row.tolist() for row in batched] == [top_k_indices(row, k).tolist() for row in scores]
+        assert [row.tolist() for row in batched] == [np.argsort(-row)[:k].tolist() for row in scores]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from app.services.bm25 import BM25Index, tokenize
+from app.services.reranker import LexicalReranker, lexical_scores, query_terms
+
+QUERIES = ["What is the invoice total?", "late payment interest", "the", "zebra"]
+TEXTS = [
+    ["The invoice total is 40 EUR.", "Invoice number 7, total due", "Shipping address", ""],
+    ["Late payment accrues interest.", "Payment late? Interest applies late payment", "Nothing here"],
+    ["the the cat", "a dog"],
+    []
+]
+
+def _reference(query, texts):
+    """One query scored the straightforward way"""
+    scores = np.zeros(len(texts), dtype=np.float32)
+    terms = query_terms(query)
+    if not texts or not terms:
+        return scores
+    bm25 = BM25Index.build(texts).scores(" ".join(terms))
+    if bm25.max() > 0:
+        bm25 /= bm25.max()
+    wanted = set(terms)
+    pairs = set(zip(terms, terms[1:]))
+    coverage = np.zeros(len(texts), dtype=np.float32)
+    adjacency = np.zeros(len(texts), dtype=np.float32)
+    for i, text in enumerate(texts):
+        tokens = tokenize(text)
+        coverage[i] = len(wanted.intersection(tokens)) / len(wanted)
+        adjacency[i] = len(pairs.intersection(zip(tokens, tokens[1:]))) / len(pairs) if pairs else coverage[i]
+    return 0.5 * bm25 + 0.3 * coverage + 0.2 * adjacency
+
+def test_batch_scores_match_scoring_each_query_alone():
+    batch = lexical_scores(QUERIES, TEXTS)
+
+    assert [len(scores) for scores in batch] == [len(texts) for texts in TEXTS]
+    for query, texts, scores in zip(QUERIES, TEXTS, batch):
+        assert np.allclose(scores, _reference(query, texts), atol=1e-6)
+
+@pytest.mark.anyio
+async def test_rerank_promotes_lexical_matches():
+    candidates = [{"content": text} for text in ["Shipping address", "The invoice total is 40 EUR."]]
+
+    reranked = await LexicalReranker(prior_weight=0.3).rerank("invoice total", candidates, limit=1)
+
+    assert [candidate["content"] for candidate in reranked] == ["The invoice total is 40 EUR."]
@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import boto3
+import pytest
+from fastapi import HTTPException
+from moto import mock_aws
+from app.core.config import settings
+from app.services.s3 import S3Service
+
+pytestmark = pytest.mark.anyio
+
+MB = 1024 * 1024
+
+@pytest.fixture
+def s3(monkeypatch):
+    # S3 rejects parts under 5MB other than the last
+    monkeypatch.setattr(settings, "S3_MULTIPART_PART_SIZE", 5 * MB)
+    monkeypatch.setattr(settings, "S3_MULTIPART_CONCURRENCY", 2)
+    with mock_aws():
+        boto3.client("s3", region_name=settings.AWS_REGION).create_bucket(Bucket=settings.S3_BUCKET_NAME)
+        yield S3Service()
+
+def _blocks(count: int, block_size: int = MB):
+    return [bytes([i % 251]) * block_size for i in range(count)]
+
+async def _stream(blocks, read=None):
+    for block in blocks:
+        if read is not None:
+            read.append(len(block))
+        # Let finished part uploads be noticed between reads, as a socket would
+        await asyncio.sleep(0.001)
+        yield block
+
+def _open_uploads(s3: S3Service):
+    return s3.s3_client.list_multipart_uploads(Bucket=s3.bucket_name).get("Uploads", [])
+
+async def test_large_stream_is_uploaded_in_parts(s3):
+    blocks = _blocks(11)
+    data = b"".join(blocks)
+
+    result = await s3.upload_stream(_stream(blocks), "big.bin", content_type="application/pdf")
+
+    assert result["size"] == len(data)
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    stored = s3.s3_client.get_object(Bucket=s3.bucket_name, Key="big.bin")
+    assert stored["Body"].read() == data
+    assert stored["ContentType"] == "application/pdf"
+    # 5MB + 5MB + 1MB
+    assert stored["ETag"].strip('"').endswith("-3")
+
+async def test_small_stream_is_a_single_put(s3):
+    result = await s3.upload_stream(_stream([b"hello ", b"world"]), "small.txt")
+
+    assert result["sha256"] == hashlib.sha256(b"hello world").hexdigest()
+    stored = s3.s3_client.get_object(Bucket=s3.bucket_name, Key="small.txt")
+    assert stored["Body"].read() == b"hello world"
+    assert "-" not in stored["ETag"]
+
+async def test_oversized_stream_is_aborted(s3):
+    with pytest.raises(HTTPException) as error:
+        await s3.upload_stream(_stream(_blocks(11)), "too-big.bin", max_size=7 * MB)
+
+    assert error.value.status_code == 413
+    assert _open_uploads(s3) == []
+    assert s3.s3_client.list_objects_v2(Bucket=s3.bucket_name).get("KeyCount") == 0
+
+async def test_failed_part_stops_reading(s3, monkeypatch):
+    def upload_part(**kwargs):
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(s3.s3_client, "upload_part", upload_part)
+    read = []
+
+    with pytest.raises(HTTPException) as error:
+        await s3.upload_stream(_stream(_blocks(40), read), "broken.bin")
+
+    assert error.value.status_code == 500
+    assert "connection reset" in error.value.detail
+    assert len(read) < 40
+    assert _open_uploads(s3) == []
@@ -0,0 +1,26 @@
+import numpy as np
+from app.services.bm25 import BM25Index
+from app.services.search import parse_tsvector
+
+def test_tsvector_text_is_parsed_into_lexeme_counts():
+    assert parse_tsvector("'invoic':1,7A 'o''brien':3 'path\\\\to':5 'total':2") == {
+        "invoic": 2,
+        "o'brien": 1,
+        "path\\to": 1,
+        "total": 1
+    }
+    # tsquery text carries no positions
+    assert parse_tsvector("'invoic' & 'total'") == {"invoic": 1, "total": 1}
+    assert parse_tsvector("") == {}
+
+def test_term_counts_score_like_the_tokenized_index():
+    texts = ["the invoice total is due", "invoice invoice number", "shipping address"]
+    counted = BM25Index.from_term_counts(
+        parse_tsvector(" ".join(f"'{t}':{i}" for i, t in enumerate(text.split(), 1)))
+        for text in texts
+    )
+
+    expected = BM25Index.build(texts).scores("invoice total")
+    scores = counted.term_scores(["invoice", "total"])
+    assert np.allclose(scores, expected)
+    assert scores[0] > scores[1] > scores[2] == 0
@@ -0,0 +1,75 @@
+import json
+import uuid
+import pandas as pd
+import pytest
+from langchain_community.chat_models.fake import FakeListChatModel
+from app.services import tables as tables_module
+from app.services.tables import TableService, run_table_query
+
+pytestmark = pytest.mark.anyio
+
+FRAME = pd.DataFrame({
+    "region": ["north", "south", "north", "east"],
+    "amount": [10.0, 20.0, 30.0, 40.0]
+})
+
+TABLE = {
+    "id": 1,
+    "chunk_set": "sales",
+    "name": "orders",
+    "document": "Sales",
+    "file_url": "https://bucket.s3.amazonaws.com/tables/sales/table-0.parquet",
+    "columns": [{"name": "region", "dtype": "string"}, {"name": "amount", "dtype": "float64"}],
+    "row_count": len(FRAME)
+}
+
+def test_query_reports_the_rows_left_by_its_filters():
+    result, row_count = run_table_query(FRAME, {
+        "operation": "sum",
+        "column": "amount",
+        "filters": [{"column": "region", "op": "==", "value": "North"}]
+    })
+
+    assert float(result) == 40.0
+    assert row_count == 2
+
+def _service(monkeypatch, plan):
+    monkeypatch.setattr(
+        tables_module, "get_llm", lambda: FakeListChatModel(responses=[json.dumps(plan)])
+    )
+    monkeypatch.setattr(TableService, "_tables_for", lambda self, document_ids: [TABLE])
+
+    async def load_frame(self, table):
+        return FRAME
+
+    monkeypatch.setattr(TableService, "load_frame", load_frame)
+    return TableService(db=None)
+
+async def test_filtered_answer_names_the_rows_it_used(monkeypatch):
+    service = _service(monkeypatch, {
+        "table": 0,
+        "operation": "count",
+        "filters": [{"column": "amount", "op": ">", "value": 15}]
+    })
+
+    source = await service.answer_context("How many orders are over 15?", [uuid.uuid4()])
+
+    assert source["content"].startswith("Computed from 3 of 4 rows of table 'orders'")
+
+@pytest.mark.parametrize("number", [-1, 1])
+async def test_plans_naming_an_unknown_table_are_ignored(monkeypatch, number):
+    service = _service(monkeypatch, {"table": number, "operation": "count"})
+
+    assert await service.answer_context("How many orders are there?", [uuid.uuid4()]) is None
+
+@pytest.mark.parametrize("question", [
+    "Where is the north office?",
+    "What is the fee per order?",
+    "Who signed it, by each region?",
+    "Which clause covers the top floor?"
+])
+async def test_questions_without_an_aggregate_are_not_planned(monkeypatch, question):
+    service = _service(monkeypatch, {"table": 0, "operation": "count"})
+    monkeypatch.setattr(tables_module, "get_llm", lambda: pytest.fail("planned a non-aggregate question"))
+
+    assert await service.answer_context(question, [uuid.uuid4()]) is None
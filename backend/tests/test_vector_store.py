@@ -0,0 +1,145 @@
+import uuid
+import pytest
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.models.content_blob import ContentBlob
+from app.models.document import Document, DocumentChunk, DocumentStatus
+from app.models.ingestion_job import IngestionJob, IngestionJobStatus
+from app.models.user import User
+from app.services.tables import TableService
+from app.services.vector_store import VectorStore
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "VECTOR_SEARCH_BACKEND", "local")
+
+    async def delete_tables(self, chunk_set):
+        pass
+
+    monkeypatch.setattr(TableService, "delete_tables", delete_tables)
+    Base.metadata.create_all(
+        bind=engine,
+        tables=[User.__table__, ContentBlob.__table__, Document.__table__, IngestionJob.__table__]
+    )
+    with engine.begin() as connection:
+        # SQLite cannot create the real table (tsvector, vector): the same
+        # columns without the generated search vector
+        connection.execute(text("DROP TABLE IF EXISTS document_chunks"))
+        connection.execute(text(
+            "CREATE TABLE document_chunks (id CHAR(32) PRIMARY KEY, document_id CHAR(32), "
+            "content TEXT, chunk_set VARCHAR(64), chunk_index INTEGER, content_hash VARCHAR(64), "
+            "embedding TEXT, chunk_metadata JSON, created_at DATETIME)"
+        ))
+    session = SessionLocal()
+    yield session
+    session.close()
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS document_chunks"))
+
+@pytest.fixture
+def embedded(monkeypatch):
+    """Texts sent to the embedder, in order"""
+    texts = []
+
+    async def create_embeddings(self, batch):
+        texts.extend(batch)
+        return [[float(len(content))] + [1.0] * (settings.EMBEDDING_DIMENSION - 1) for content in batch]
+
+    monkeypatch.setattr(VectorStore, "create_embeddings", create_embeddings)
+    return texts
+
+def _hashes(count):
+    """Fresh content hashes; the test database outlives each test"""
+    return [uuid.uuid4().hex for _ in range(count)]
+
+def _documents(db, *content_hashes):
+    user = User(email=f"{uuid.uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    for content_hash in set(content_hashes):
+        db.add(ContentBlob(content_hash=content_hash, file_url=f"s3://{content_hash}"))
+    documents = [
+        Document(title=f"doc {i}", user_id=user.id, content_hash=content_hash, status=DocumentStatus.READY)
+        for i, content_hash in enumerate(content_hashes)
+    ]
+    db.add_all(documents)
+    db.commit()
+    return documents
+
+def _replace(db, document, content_hash):
+    db.add(ContentBlob(content_hash=content_hash, file_url=f"s3://{content_hash}"))
+    document.content_hash = content_hash
+    db.commit()
+
+def _chunks(*contents):
+    return [{"content": content, "metadata": {"chunk_index": i}} for i, content in enumerate(contents)]
+
+def _rows(db, chunk_set):
+    return {
+        row.content: row.id
+        for row in db.query(DocumentChunk.content, DocumentChunk.id).filter(DocumentChunk.chunk_set == chunk_set)
+    }
+
+async def test_an_update_embeds_only_changed_chunks_and_moves_the_rest(db, embedded):
+    v1, v2 = _hashes(2)
+    document, = _documents(db, v1)
+    await VectorStore(db).store_document_chunks(document.id, _chunks("intro", "terms", "fees"))
+    before = _rows(db, v1)
+    embedded.clear()
+
+    _replace(db, document, v2)
+    stats = await VectorStore(db).store_document_chunks(
+        document.id, _chunks("intro", "new terms", "fees", "intro"), previous_chunk_set=v1
+    )
+
+    assert embedded == ["new terms"]
+    assert (stats["embedded"], stats["reused"]) == (1, 3)
+    after = db.query(DocumentChunk.chunk_index, DocumentChunk.content, DocumentChunk.id)\
+        .filter(DocumentChunk.chunk_set == v2)\
+        .order_by(DocumentChunk.chunk_index)\
+        .all()
+    assert [row.content for row in after] == ["intro", "new terms", "fees", "intro"]
+    # Unchanged rows of the unreferenced old version were moved, not copied;
+    # the repeated "intro" gets a row of its own
+    assert after[0].id == before["intro"]
+    assert after[2].id == before["fees"]
+    assert after[3].id not in before.values()
+    # and the stale "terms" row is gone with the old set
+    assert _rows(db, v1) == {}
+
+async def test_a_shared_previous_set_is_copied_and_kept(db, embedded):
+    v1, v2 = _hashes(2)
+    document, other = _documents(db, v1, v1)
+    await VectorStore(db).store_document_chunks(document.id, _chunks("intro", "terms"))
+    before = _rows(db, v1)
+    embedded.clear()
+
+    _replace(db, document, v2)
+    await VectorStore(db).store_document_chunks(document.id, _chunks("intro", "fees"), previous_chunk_set=v1)
+
+    assert embedded == ["fees"]
+    after = _rows(db, v2)
+    assert set(after) == {"intro", "fees"}
+    assert after["intro"] != before["intro"]
+    # The other document still searches the old version
+    assert _rows(db, v1) == before
+
+async def test_a_replaced_document_searches_its_previous_set_until_the_swap(db, embedded):
+    v1, v2 = _hashes(2)
+    document, = _documents(db, v1)
+    await VectorStore(db).store_document_chunks(document.id, _chunks("intro"))
+    _replace(db, document, v2)
+    job = IngestionJob(document_id=document.id, previous_chunk_set=v1, status=IngestionJobStatus.RUNNING)
+    db.add(job)
+    db.commit()
+
+    assert list(VectorStore(db)._chunk_sets([document.id]).values()) == [[v1]]
+
+    await VectorStore(db).store_document_chunks(document.id, _chunks("intro"), previous_chunk_set=v1)
+
+    assert list(VectorStore(db)._chunk_sets([document.id]).values()) == [[v2]]
@@ -0,0 +1,4 @@
+-- Conversation memory: running summary of older chat messages.
+ALTER TABLE chat_sessions
+    ADD COLUMN IF NOT EXISTS summary text,
+    ADD COLUMN IF NOT EXISTS summarized_message_count integer NOT NULL DEFAULT 0;
@@ -0,0 +1,11 @@
+-- Incremental re-ingestion: chunks are matched by content hash so unchanged
+-- chunks of an updated document reuse their embeddings. Chunks stored before
+-- this have no hash and are re-embedded the next time their document changes.
+ALTER TABLE document_chunks
+    ADD COLUMN IF NOT EXISTS content_hash varchar(64);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_chunks_content_hash
+    ON document_chunks (content_hash);
+
+ALTER TABLE ingestion_jobs
+    ADD COLUMN IF NOT EXISTS previous_chunk_set varchar(64);
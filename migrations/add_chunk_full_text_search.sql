@@ -0,0 +1,8 @@
+-- Full-text search over chunk content for hybrid retrieval.
+-- The text search configuration must match SEARCH_TEXT_CONFIG.
+ALTER TABLE document_chunks
+    ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_chunks_content_tsv
+    ON document_chunks USING gin (content_tsv);
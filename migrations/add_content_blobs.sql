@@ -0,0 +1,36 @@
+-- Deduplicated uploads: documents with the same bytes share one content blob
+-- and one chunk set (document_chunks.chunk_set, see Document.chunk_set).
+CREATE TABLE IF NOT EXISTS content_blobs (
+    content_hash varchar(64) PRIMARY KEY,
+    file_url varchar NOT NULL,
+    file_size bigint,
+    content_type varchar,
+    ref_count integer NOT NULL,
+    status varchar NOT NULL,
+    created_at timestamp,
+    updated_at timestamp
+);
+
+-- Documents hashed before blobs existed have no blob and keep the chunks
+-- they have, so they go back to a per-document chunk set keyed by id.
+UPDATE documents d SET content_hash = NULL
+WHERE content_hash IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM content_blobs b WHERE b.content_hash = d.content_hash);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'documents_content_hash_fkey') THEN
+        ALTER TABLE documents
+            ADD CONSTRAINT documents_content_hash_fkey
+            FOREIGN KEY (content_hash) REFERENCES content_blobs (content_hash);
+    END IF;
+END $$;
+
+ALTER TABLE document_chunks
+    ADD COLUMN IF NOT EXISTS chunk_set varchar(64);
+
+UPDATE document_chunks SET chunk_set = document_id::text
+WHERE chunk_set IS NULL AND document_id IS NOT NULL;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_chunks_chunk_set
+    ON document_chunks (chunk_set);
@@ -0,0 +1,7 @@
+-- Size and SHA-256 of uploaded files, recorded while streaming them to S3.
+ALTER TABLE documents
+    ADD COLUMN IF NOT EXISTS content_hash varchar(64),
+    ADD COLUMN IF NOT EXISTS file_size bigint;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documents_content_hash
+    ON documents (content_hash);
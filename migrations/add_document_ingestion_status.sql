@@ -0,0 +1,9 @@
+-- Ingestion progress and errors reported by the worker (app/worker.py).
+-- The ingestion_jobs table is new and is created by the API on startup.
+ALTER TABLE documents
+    ADD COLUMN IF NOT EXISTS content_type varchar,
+    ADD COLUMN IF NOT EXISTS progress integer DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS error_message text;
+
+-- Documents processed before the queue existed are complete.
+UPDATE documents SET progress = 100 WHERE status = 'ready';
@@ -1,9 +1,22 @@
--- Enable the vector extension
+-- Enable the vector extension (pgvector >= 0.5 for HNSW indexes).
+-- It ships vector_cosine_ops, vector_l2_ops and vector_ip_ops itself.
 CREATE EXTENSION IF NOT EXISTS vector;
 
--- Create a custom operator class for vector similarity search
-CREATE OPERATOR CLASS vector_cosine_ops
-    FOR TYPE vector
-    USING ivfflat
-    AS
-    OPERATOR 1 <-> (vector, vector) FOR ORDER BY float_ops; 
\ No newline at end of file
+-- Convert embeddings stored as float arrays to a pgvector column sized for
+-- the embedding model (EMBEDDING_DIMENSION, 768 for models/embedding-001).
+-- Rows of another dimension cannot be cast and must be re-ingested.
+ALTER TABLE document_chunks
+    ALTER COLUMN embedding TYPE vector(768)
+    USING embedding::vector(768);
+
+-- The cosine index is created, and rebuilt after a change to
+-- PGVECTOR_INDEX_TYPE or its parameters, by a one-off command run from
+-- backend/ after the tables exist:
+--
+--   python -m app.scripts.ensure_vector_index
+--
+-- The manual equivalent for the defaults is:
+--
+-- CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_chunks_embedding
+--     ON document_chunks USING hnsw (embedding vector_cosine_ops)
+--     WITH (m = 16, ef_construction = 64);